@@ -0,0 +1,46 @@
+"""
+file: activity_construction.py
+
+description: Measures how many Activity objects are created per second from raw Strava activities, one by one
+and with Activity.from_page, and the size of one instance (the object and its __dict__, if it has one).
+
+Run from the root of the repository:
+    python -m benchmarks.activity_construction [activities]
+
+Author: Julian Friedl
+"""
+
+import sys
+import time
+
+from src.shared.models.activity import Activity
+
+
+def make_raw(count: int):
+    return [{"id": i, "name": "x", "type": "Run", "start_date_local": "2026-03-%02dT10:21:00Z" % (i % 28 + 1),
+             "moving_time": 1800, "elapsed_time": 1900, "distance": 5000, "total_elevation_gain": 3,
+             "map": {"id": "a", "summary_polyline": "abc" * 500}} for i in range(count)]
+
+
+def best_of(run, repeat: int = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    raw = make_raw(count)
+    for name, run in (("one by one", lambda: [Activity(activity) for activity in raw]),
+                      ("from_page", lambda: Activity.from_page(raw))):
+        print(f"{name:10} {count / best_of(run):12,.0f} activities/s (best of 5)")
+    activity = Activity(raw[0])
+    size = sys.getsizeof(activity) + (sys.getsizeof(activity.__dict__) if hasattr(activity, "__dict__") else 0)
+    print(f"{size} bytes per instance")
+
+
+if __name__ == "__main__":
+    main()
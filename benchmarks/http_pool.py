@@ -0,0 +1,70 @@
+"""
+file: http_pool.py
+
+description: Compares sequential GET requests with a new connection per request (cold, like the plain
+requests.get calls before the shared client) against the pooled keep-alive session of http_client.
+The requests go to a local HTTP/1.1 server, so there is no TLS handshake; against strava.com the
+difference of the pooled session is larger.
+
+Run from the root of the repository:
+    python -m benchmarks.http_pool [requests]
+
+Author: Julian Friedl
+"""
+
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import src.shared.api.http_client as http_client
+
+BODY = b'[{"id": 1, "type": "Run", "moving_time": 1800}]'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # the headers and the body are two writes, don't wait for the delayed ACK
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def cold(url: str, count: int):
+    for _ in range(count):
+        # a new session per request opens a new connection every time
+        with requests.Session() as new_session:
+            new_session.get(url, headers={"Connection": "close"}).json()
+
+
+def pooled(url: str, count: int):
+    for _ in range(count):
+        http_client.get(url).json()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/athlete/activities"
+
+    pooled(url, 10)  # warm up
+    for name, run in (("cold", cold), ("pooled", pooled)):
+        start = time.perf_counter()
+        run(url, count)
+        elapsed = time.perf_counter() - start
+        print(f"{name:7} {count} GETs {elapsed:6.2f} s, {elapsed / count * 1000:5.2f} ms per request")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
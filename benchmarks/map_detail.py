@@ -0,0 +1,105 @@
+"""
+file: map_detail.py
+
+description: Measures the /api/map response of every detail tier (low, medium, full): the number of route points,
+the size of the body with and without gzip and the server time through the Flask test client, once for a miss of
+the response cache and as the mean of 20 cached requests. It also reports the time build_route needs per route to
+compute the tiers when a route is saved.
+
+The routes are synthetic random walks of 150-700 points, saved for 8 athletes to a JSON backend in a temporary
+directory.
+
+Run from the root of the repository:
+    python -m benchmarks.map_detail [routes per athlete]
+
+Author: Julian Friedl
+"""
+
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import polyline
+
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.storage.backend as storage_backend
+from src.shared.models.activity import Activity
+from src.shared.storage.json_backend import JsonBackend
+from src.web.backend.flask_app import app
+from src.web.backend.map_cache import map_cache
+
+YEAR = 2026
+ATHLETES = 8
+
+
+def track(rnd: random.Random, points: int):
+    """
+    Returns the polyline of a random walk with steps of 15-40 m that changes its heading slowly, like a run.
+    """
+    lat, lng, heading = 47.26 + rnd.uniform(-0.2, 0.2), 11.39 + rnd.uniform(-0.3, 0.3), rnd.uniform(0, 2 * math.pi)
+    track_points = []
+    for _ in range(points):
+        heading += rnd.gauss(0, 0.25)
+        step = rnd.uniform(15, 40) / 111320
+        lat += step * math.cos(heading)
+        lng += step * math.sin(heading) / math.cos(math.radians(lat))
+        track_points.append((round(lat, 5), round(lng, 5)))
+    return polyline.encode(track_points)
+
+
+def save_routes(rnd: random.Random, routes_per_athlete: int):
+    """
+    Builds and saves the routes, returns the mean time of build_route in seconds.
+    """
+    build_time = 0
+    for athlete_id in range(1, ATHLETES + 1):
+        routes = []
+        for i in range(routes_per_athlete):
+            activity = Activity({
+                "id": athlete_id * 100000 + i, "name": "run", "type": "Run",
+                "start_date_local": f"{YEAR}-03-01T08:00:00Z", "start_date": f"{YEAR}-03-01T07:00:00Z",
+                "moving_time": 3600, "elapsed_time": 3700, "distance": 10000, "total_elevation_gain": 100,
+                "kudos_count": 2, "suffer_score": 5, "map": {"id": "a", "summary_polyline": track(rnd, rnd.randint(150, 700))},
+            })
+            start = time.perf_counter()
+            routes.append(routes_data_controller.build_route(activity))
+            build_time += time.perf_counter() - start
+        storage_backend.backend.save_routes(YEAR, {"user_id": athlete_id, "discord_user_id": str(athlete_id),
+                                                   "user_name": f"Athlete {athlete_id}"}, routes)
+    return build_time / (ATHLETES * routes_per_athlete)
+
+
+def main():
+    routes_per_athlete = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        storage_backend.backend = JsonBackend(directory)
+        build_time = save_routes(random.Random(7), routes_per_athlete)
+        print(f"{ATHLETES * routes_per_athlete} routes, build_route with tiers {build_time * 1000:.2f} ms per route")
+
+        client = app.test_client()
+        athletes = ",".join(str(athlete_id) for athlete_id in range(1, ATHLETES + 1))
+        for detail in ("low", "medium", "full"):
+            url = f"/api/map?years={YEAR}&athletes={athletes}&detail={detail}"
+            map_cache.entries.clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            miss = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(20):
+                gzipped = client.get(url, headers={"Accept-Encoding": "gzip"})
+            hit = (time.perf_counter() - start) / 20
+
+            routes = [route for athlete in json.loads(response.data)[str(YEAR)]["athletes"].values() for route in athlete["routes"]]
+            points = sum(len(polyline.decode(route["map"]["summary_polyline"])) for route in routes)
+            print(f"{detail:6} {points:8} points  body {len(response.data) / 1024:7.0f} KB  gzip {len(gzipped.data) / 1024:6.0f} KB  "
+                  f"miss {miss * 1000:6.1f} ms  cached {hit * 1000:5.2f} ms")
+        print(f"routes.json {os.path.getsize(storage_backend.backend.routes_file(YEAR)) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+file: scoring_memory.py
+
+description: Measures the peak memory of reading the activities of an athlete from the activity store and scoring
+all weeks of the year, like the total command does for every athlete. The store is generated in a temporary
+directory by a child process, so the seeding doesn't count to the peak RSS of the measurement. The sync with
+Strava and the route write are left out, only the streaming from the store and the scoring are measured.
+
+Run from the root of the repository:
+    python -m benchmarks.scoring_memory [activities]
+
+Author: Julian Friedl
+"""
+
+import datetime
+import multiprocessing
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import polyline
+
+from src.shared.models.athlete import Athlete
+import src.shared.services.activities_data_controller as activities_data_controller
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.scoring_engine as scoring_engine
+
+YEAR = 2026
+TYPES = ["Run", "Ride", "Walk", "Workout"]
+
+
+def seed(count: int):
+    rnd = random.Random(1)
+    activities = []
+    for activity_id in range(1, count + 1):
+        # a random walk of 100 points, about the size of the summary polyline of a one hour run
+        lat, lng, points = 48.2, 16.4, []
+        for _ in range(100):
+            lat, lng = lat + rnd.uniform(-0.001, 0.001), lng + rnd.uniform(-0.001, 0.001)
+            points.append((lat, lng))
+        start = datetime.datetime(YEAR, 1, 5, 6) + datetime.timedelta(minutes=rnd.randint(0, 280 * 24 * 60))
+        activities.append({
+            "id": activity_id, "name": f"a{activity_id}", "type": rnd.choice(TYPES),
+            "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"), "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "moving_time": rnd.choice([900, 1800, 3600]), "elapsed_time": 3700, "distance": 5000, "total_elevation_gain": 10,
+            "map": {"id": "x", "summary_polyline": polyline.encode(points)},
+        })
+    activities_data_controller.save_activities(1, activities)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as directory:
+        activities_data_controller.ACTIVITIES_PATH = directory
+        seeding = multiprocessing.get_context("fork").Process(target=seed, args=(count,))
+        seeding.start()
+        seeding.join()
+
+        Athlete.sync_activities = lambda self, **kwargs: (0, 0)
+        routes_data_controller.write_routes = lambda routes, user: None
+        athlete = Athlete({
+            "strava_data": {"access_token": "t", "refresh_token": "r", "expires_at": time.time() + 99999,
+                            "athlete": {"id": 1, "firstname": "A", "lastname": "B", "profile_medium": ""}},
+            "constants": {"rules": {"Ride": 60, "Run": 30, "Walk": 60, "Workout": 60}, "points_required": 3,
+                          "price_per_week": 5, "spazi": 3, "walking_limit": 1, "hit_required": 2, "hit_min_time": 15,
+                          "min_duration_multi_day": 360, "start_week": 1},
+            "vars": {"joker": 1, "joker_weeks": [], "week_results": []},
+            "discord_user_id": "1",
+        })
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        start = time.perf_counter()
+        activities, _, _ = athlete.fetch_athlete_activities(datetime.date(YEAR, 1, 1), datetime.date(YEAR + 1, 1, 1))
+        points = scoring_engine.score_weeks(activities, athlete, list(range(1, 43)))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"{count} activities, 42 weeks, {sum(points.values())} points in {elapsed:.2f} s (slowed down by tracemalloc)")
+    print(f"peak traced allocations {peak / 1e6:.1f} MB, peak RSS {rss_after / 1024:.1f} MB "
+          f"(+{(rss_after - rss_before) / 1024:.1f} MB during the call)")
+
+
+if __name__ == "__main__":
+    main()
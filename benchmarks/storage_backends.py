@@ -0,0 +1,104 @@
+"""
+file: storage_backends.py
+
+description: Measures the save and load latency of the JSON and the SQLite storage backend with generated
+athletes and routes, in a temporary directory. Saving a route or a changed athlete rewrites the whole year file
+with the JSON backend, the SQLite backend only writes the changed rows.
+
+Run from the root of the repository:
+    python -m benchmarks.storage_backends [athletes] [routes per athlete]
+
+Author: Julian Friedl
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from src.shared.storage.json_backend import JsonBackend
+from src.shared.storage.sqlite_backend import SqliteBackend
+
+YEAR = 2026
+TYPES = ["Ride", "Run", "Walk", "Hike", "Swim"]
+# a short polyline, the stored routes of the bot are a few hundred bytes to a few kB
+POLYLINE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@" * 20
+
+
+def make_athlete(athlete_id: int):
+    return {
+        "strava_data": {"access_token": "a", "refresh_token": "r", "expires_at": 0,
+                        "athlete": {"id": athlete_id, "firstname": f"F{athlete_id}", "lastname": "L"}},
+        "constants": {"rules": {"Ride": 60, "Run": 30}, "points_required": 3, "price_per_week": 5},
+        "vars": {"joker": 1, "joker_weeks": [], "week_results": [f"{week}_{week % 2}" for week in range(1, 43)]},
+        "discord_user_id": str(athlete_id),
+    }
+
+
+def make_route(rnd: random.Random, activity_id: int):
+    return {
+        "activity_id": activity_id,
+        "type": rnd.choice(TYPES),
+        "start_date": f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T07:00:00Z",
+        "moving_time": rnd.randint(600, 7200),
+        "distance": rnd.uniform(1000, 50000),
+        "total_elevation_gain": rnd.uniform(0, 800),
+        "map": {"summary_polyline": POLYLINE},
+    }
+
+
+def measure(run, repeat: int):
+    """
+    Returns the median and the max of repeat runs in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def bench(name: str, backend, athletes: int, routes_per_athlete: int):
+    rnd = random.Random(1)
+    backend.save_athletes(YEAR, [make_athlete(athlete_id) for athlete_id in range(1, athletes + 1)])
+    activity_id = 0
+    for athlete_id in range(1, athletes + 1):
+        user = {"user_id": athlete_id, "discord_user_id": str(athlete_id), "user_name": f"F{athlete_id} L"}
+        routes = []
+        for _ in range(routes_per_athlete):
+            activity_id += 1
+            routes.append(make_route(rnd, activity_id))
+        backend.save_routes(YEAR, user, routes)
+
+    user = {"user_id": 1, "discord_user_id": "1", "user_name": "F1 L"}
+
+    def save_route():
+        nonlocal activity_id
+        activity_id += 1
+        backend.save_routes(YEAR, user, [make_route(rnd, activity_id)])
+
+    results = {
+        "save 1 athlete": measure(lambda: backend.save_athletes(YEAR, [make_athlete(1)]), 50),
+        "load athletes": measure(lambda: backend.load_athletes(YEAR), 50),
+        "load 1 athlete": measure(lambda: backend.load_athlete_by_discord_id(YEAR, "1"), 50),
+        "save 1 route": measure(save_route, 50),
+        "load routes": measure(lambda: backend.load_routes(YEAR), 20),
+    }
+    for operation, (median, worst) in results.items():
+        print(f"{name:7} {operation:15} median {median:8.2f} ms   max {worst:8.2f} ms")
+
+
+def main():
+    athletes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    routes_per_athlete = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    print(f"{athletes} athletes, {athletes * routes_per_athlete} routes")
+    with tempfile.TemporaryDirectory() as directory:
+        bench("json", JsonBackend(os.path.join(directory, "json")), athletes, routes_per_athlete)
+        bench("sqlite", SqliteBackend(os.path.join(directory, "challenge.sqlite3")), athletes, routes_per_athlete)
+
+
+if __name__ == "__main__":
+    main()
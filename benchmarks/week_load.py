@@ -0,0 +1,195 @@
+"""
+file: week_load.py
+
+description: Load test of the /week command: 10 commands for the same week are started at the same time against
+a local mock of the Strava API with a fixed latency. It reports the wall time, the requests the mock received,
+the peak number of threads and the max lag of the event loop.
+
+The modes are
+    threads    every command runs excecute_week_command in the default executor, like the bot did before
+    async      every command awaits excecute_week_command_async
+    coalesced  like async, but identical commands share one run through an AsyncSingleFlight, like the bot does
+
+The athletes, the activity store and the response cache are created in a temporary directory. With --warm one
+command runs first, so the store is synced like in the steady state.
+
+Run from the root of the repository:
+    python -m benchmarks.week_load threads|async|coalesced [--warm] [latency in s]
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+import src.shared.api.api_calls as api_calls
+import src.shared.api.async_http_client as async_http_client
+import src.shared.models.athlete as athlete_model
+import src.shared.services.activities_data_controller as activities_data_controller
+import src.shared.storage.backend as storage_backend
+from src.bot.commands.week_command import WeekCommand
+from src.shared.api.cache_store import CacheStore
+from src.shared.services.single_flight import AsyncSingleFlight
+from src.shared.storage.json_backend import JsonBackend
+
+YEAR = athlete_model.YEAR
+ATHLETES = 3
+COMMANDS = 10
+TYPES = ["Ride", "Run", "Walk", "Workout", "WeightTraining", "Hike", "Swim"]
+POLYLINE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def last_week():
+    """
+    Returns the last week of YEAR that is over.
+    """
+    today = datetime.date.today()
+    if today.year > YEAR:
+        return datetime.date(YEAR, 12, 28).isocalendar().week
+    return max(today.isocalendar().week - 1, 1)
+
+
+def make_activities(athlete_id: int):
+    """
+    Returns random activities of the athlete from the start of YEAR to today, like Strava stores them.
+    """
+    rnd = random.Random(athlete_id)
+    activities = []
+    day = datetime.datetime(YEAR, 1, 1, 6)
+    end = min(datetime.datetime.now(), datetime.datetime(YEAR + 1, 1, 1))
+    while day < end:
+        for _ in range(rnd.choice([0, 1, 1, 2])):
+            start = day + datetime.timedelta(minutes=rnd.randint(0, 14 * 60))
+            activity_id = athlete_id * 100000 + len(activities)
+            activities.append({
+                "id": activity_id, "name": f"activity {activity_id}", "type": rnd.choice(TYPES),
+                "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "start_date": (start - datetime.timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "moving_time": rnd.choice([10, 20, 30, 45, 60, 90]) * 60, "elapsed_time": 6000, "distance": 5000.0,
+                "total_elevation_gain": 20, "map": {"id": f"a{activity_id}", "summary_polyline": POLYLINE},
+            })
+        day += datetime.timedelta(days=1)
+    return activities
+
+
+def make_credentials(athlete_id: int):
+    return {
+        "strava_data": {"access_token": f"token{athlete_id}", "refresh_token": "r", "expires_at": time.time() + 86400,
+                        "athlete": {"id": athlete_id, "firstname": f"Athlete{athlete_id}", "lastname": "L", "profile_medium": ""}},
+        "constants": {"rules": {"Ride": 60, "Run": 30, "WeightTraining": 60, "Hike": 60, "Walk": 60, "Swim": 30, "Workout": 60},
+                      "points_required": 3, "price_per_week": 5, "spazi": 3, "walking_limit": 1, "hit_required": 2,
+                      "hit_min_time": 15, "min_duration_multi_day": 360, "start_week": 1},
+        "vars": {"joker": 1, "joker_weeks": [], "week_results": []},
+        "discord_user_id": str(athlete_id),
+    }
+
+
+class MockStrava:
+    """
+    Serves the activity list endpoint of Strava from the generated activities, on an event loop of its own thread
+    like a remote server.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.activities = {athlete_id: make_activities(athlete_id) for athlete_id in range(1, ATHLETES + 1)}
+        self.requests = 0
+        self.port = None
+
+    async def list_activities(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        athlete_id = int(request.headers["Authorization"].rsplit("token", 1)[1])
+        after = float(request.query.get("after", 0))
+        before = float(request.query.get("before", 1e12))
+        page, per_page = int(request.query.get("page", 1)), int(request.query.get("per_page", 30))
+        selected = [activity for activity in self.activities[athlete_id]
+                    if after < activities_data_controller.start_timestamp(activity) < before]
+        headers = {"X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": f"{self.requests},{self.requests}"}
+        return web.json_response(selected[(page - 1) * per_page: page * per_page], headers=headers)
+
+    def start(self):
+        ready = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = web.Application()
+            app.router.add_get("/api/v3/athlete/activities", self.list_activities)
+            runner = web.AppRunner(app)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+
+
+async def run_commands(mode: str, week: int):
+    if mode == "threads":
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[loop.run_in_executor(None, WeekCommand(week).excecute_week_command) for _ in range(COMMANDS)])
+    if mode == "async":
+        return await asyncio.gather(*[WeekCommand(week).excecute_week_command_async() for _ in range(COMMANDS)])
+    flights = AsyncSingleFlight()
+    results = await asyncio.gather(*[flights.do(("week", week, YEAR), WeekCommand(week).excecute_week_command_async) for _ in range(COMMANDS)])
+    return [embed for embed, _ in results]
+
+
+async def main(mode: str, warm: bool, latency: float):
+    mock = MockStrava(latency)
+    mock.start()
+    athlete_model.ACTIVITIES_URL = f"http://127.0.0.1:{mock.port}/api/v3/athlete/activities"
+    week = last_week()
+    if warm:
+        await run_commands("coalesced", week)
+        mock.requests = 0
+
+    peak_threads = [threading.active_count()]
+    lag = [0.0]
+
+    def watch_threads():
+        while True:
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.005)
+
+    async def watch_loop():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag[0] = max(lag[0], time.perf_counter() - before - 0.01)
+
+    threading.Thread(target=watch_threads, daemon=True).start()
+    watcher = asyncio.ensure_future(watch_loop())
+    start = time.perf_counter()
+    embeds = await run_commands(mode, week)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    await async_http_client.close()
+
+    distinct = len({str([(field.name, field.value) for field in embed.fields[:-2]]) for embed in embeds})
+    print(f"{mode} {'warm' if warm else 'cold'}: {COMMANDS} x /week {week} in {elapsed:.2f} s, {mock.requests} requests, "
+          f"peak {peak_threads[0]} threads, max loop lag {lag[0] * 1000:.0f} ms, {distinct} distinct embed(s)")
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--warm"]
+    if not arguments or arguments[0] not in ("threads", "async", "coalesced"):
+        sys.exit(__doc__)
+    with tempfile.TemporaryDirectory() as directory:
+        storage_backend.backend = JsonBackend(directory)
+        activities_data_controller.ACTIVITIES_PATH = os.path.join(directory, "activities")
+        api_calls.cache_store = CacheStore(os.path.join(directory, "api_cache.sqlite3"))
+        storage_backend.backend.save_athletes(YEAR, [make_credentials(athlete_id) for athlete_id in range(1, ATHLETES + 1)])
+        asyncio.run(main(arguments[0], "--warm" in sys.argv, float(arguments[1]) if len(arguments) > 1 else 0.2))
@@ -8,9 +8,10 @@ Author: Julian Friedl
 """
 
 import os
+import datetime
 from dotenv import load_dotenv
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
 import logging
@@ -25,6 +26,9 @@ from src.bot.commands.total_command import TotalCommand
 from src.bot.commands.week_command import WeekCommand
 from src.shared.config.log_config import setup_logging
 from src.shared.services.athlete_data_controller import clear_week_results
+from src.shared.services.token_refresher import token_refresher
+from src.shared.services.week_precompute import precompute_week
+from src.shared.services.single_flight import AsyncSingleFlight
 
 
 setup_logging()
@@ -37,22 +41,47 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 DISCORD_ADMIN_ID = os.getenv("DISCORD_ADMIN_ID")
 
+YEAR = int(os.getenv("YEAR", datetime.date.today().year))
+
+# Local time on Mondays at which the previous week is precomputed
+PRECOMPUTE_TIME = datetime.time.fromisoformat(os.getenv("PRECOMPUTE_TIME", "00:15")).replace(tzinfo=datetime.datetime.now().astimezone().tzinfo)
+
 # Get the Client object from discord.py. Client is synonymous with Bot
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='/', intents=intents)
 
+# Identical commands (same command, week and year) that are typed while one is running share its run and embed
+command_flights = AsyncSingleFlight()
+
 @bot.event
 async def on_ready():
     """
     Event listener for when the bot has switched from offline to online.
     It starts up the Webserver that is used for retrieving Strava auth
+    and the background thread that refreshes the Strava tokens before they expire.
+    It also schedules the precomputation of the previous week.
     """
     await bot.tree.sync()
     start_flask() 
+    token_refresher.start()
+    if not precompute_last_week.is_running():
+        precompute_last_week.start()
     logger.info(f'{bot.user} is now running!')
 
 
+@tasks.loop(time=PRECOMPUTE_TIME)
+async def precompute_last_week():
+    """
+    Scores the previous week of all athletes every Monday shortly after midnight,
+    so the /week commands of the morning only have to read the stored results.
+    """
+    if datetime.date.today().weekday() != 0:
+        return
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, precompute_week)
+
+
 @bot.tree.error
 async def on_application_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
     """Global error handler for application commands."""
@@ -99,21 +128,31 @@ async def strava_auth_command(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     await interaction.followup.send(embed=strava_auth(discord_user_id), ephemeral= True)
 
+async def execute_week_command(week: int):
+    """Runs the week command, identical commands share the run through command_flights."""
+    return await WeekCommand(week).excecute_week_command_async()
+
+async def execute_total_command():
+    """Runs the total command, identical commands share the run through command_flights."""
+    return await TotalCommand().get_yearly_payments_async()
+
 @bot.tree.command(name="week", description="Returns the people who need to pay in the specified calendar week")
 @app_commands.describe(week_parameter='*Parameter:* Week (an integer in range 1-52)')
 async def week_command(interaction: discord.Interaction, week_parameter:app_commands.Range[int, 1, 52]):
     """Slash Command Implementation of the week_command"""
     await interaction.response.defer()
-    loop = asyncio.get_event_loop()
-    embed_result = await loop.run_in_executor(None, WeekCommand(week_parameter).excecute_week_command)
+    embed_result, shared = await command_flights.do(("week", week_parameter, YEAR), execute_week_command, week_parameter)
+    if shared:
+        logger.info(f"Week Command {week_parameter} joined the run that was already in progress.")
     await interaction.followup.send(embed=embed_result)
 
 @bot.tree.command(name="total", description="Returns all challenge members and the amount they have to pay.")
 async def total_command(interaction: discord.Interaction):
     """Slash Command Implementation of the total_command"""
     await interaction.response.defer()
-    loop = asyncio.get_event_loop()
-    embed_result = await loop.run_in_executor(None, TotalCommand().get_yearly_payments)
+    embed_result, shared = await command_flights.do(("total", YEAR), execute_total_command)
+    if shared:
+        logger.info("Total Command joined the run that was already in progress.")
     await interaction.followup.send(embed=embed_result)
 
 @bot.tree.command(name="joker", description="Allows you to skip a week.")
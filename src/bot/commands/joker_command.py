@@ -11,8 +11,8 @@ import json
 import discord
 import logging
 
-from src.shared.services.athlete_data_controller import load_athletes, update_athlete_vars
-from src.shared.models.athlete import Athlete
+from src.shared.services.athlete_data_controller import load_athlete_by_discord_id
+from src.shared.models.athlete import Athlete, flush_athletes
 from src.shared.config.log_config import setup_logging
 
 
@@ -29,26 +29,33 @@ class JokerCommand:
 
     def joker(self):
         logger.info("Joker Command called.")
-        creds = load_athletes()
-        athlete = None
-        if creds:
-            for cred in creds:
-                if cred.get("discord_user_id", None) == self.discord_user_id:
-                    athlete = Athlete(cred)
-                    break
-        
-        if athlete is None:
+        cred = load_athlete_by_discord_id(self.discord_user_id)
+
+        if cred is None:
             embed = discord.Embed(
                 title="Registration Required",
                 description=f"Discord User with ID `{self.discord_user_id}` is not registered.\nPlease use `/strava_auth` to register.",
                 color=discord.Color.red()
             )
             return embed
-        
+
+        athlete = Athlete(cred)
+        try:
+            return self.use_joker(athlete)
+        finally:
+            # Save the refreshed token and the changed jokers with one write
+            flush_athletes([athlete])
+
+    def use_joker(self, athlete: Athlete):
+        """
+        Uses the joker of the athlete for the current week, or removes it if it was already used.
+        """
+        cred = athlete.credentials
         if self.week in athlete.joker_weeks:
             cred['vars']['joker_weeks'].remove(self.week)
             cred['vars']['joker'] += 1
-            update_athlete_vars(cred)
+            athlete.mark_dirty("joker_weeks")
+            athlete.mark_dirty("joker")
             embed = discord.Embed(
                 title="Joker Removed",
                 description=f"Joker usage for week {self.week} removed.",
@@ -68,7 +75,8 @@ class JokerCommand:
 
         cred['vars']['joker_weeks'].append(self.week)
         cred['vars']['joker'] -= 1
-        update_athlete_vars(cred)
+        athlete.mark_dirty("joker_weeks")
+        athlete.mark_dirty("joker")
 
         embed = discord.Embed(
             title="Joker Used",
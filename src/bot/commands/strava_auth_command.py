@@ -6,7 +6,6 @@ This module contains functions for handling the strava_auth command
 Author: Julian Friedl
 """
 
-import requests
 from urllib.parse import urlencode
 import os
 from dotenv import load_dotenv
@@ -14,6 +13,7 @@ import discord
 import logging
 
 import src.shared.services.athlete_data_controller as athlete_data_controller
+import src.shared.api.http_client as http_client
 from src.shared.config.log_config import setup_logging
 
 
@@ -63,7 +63,7 @@ def exchange_code(code:str, discord_user_id:str):
         'code': code,
         'grant_type': 'authorization_code'
     }
-    response = requests.post('https://www.strava.com/oauth/token', data=data)
+    response = http_client.post('https://www.strava.com/oauth/token', data=data)
     
     if(response.status_code != 200):
         raise Exception(f"Failed to get token: Status code {response.status_code}, Response: {response.text}")
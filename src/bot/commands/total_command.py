@@ -6,15 +6,21 @@ This module contains classes and functions for handling the total command.
 Author: Julian Friedl
 """
 
+import asyncio
 import datetime
 import discord
 import logging
 import os
+import time
+from threading import Lock
 from dotenv import load_dotenv
 
 import src.shared.services.athlete_data_controller as athlete_data_controller
-from src.bot.commands.week_command import WeekCommand
-from src.shared.models.athlete import Athlete
+import src.shared.services.scoring_engine as scoring_engine
+from src.shared.models.athlete import Athlete, flush_athletes
+from src.shared.models.week_result import PAY
+from src.shared.services.fetch_engine import map_athletes, gather_athletes
+from src.shared.api.rate_governor import governor
 from src.shared.config.log_config import setup_logging
 
 
@@ -34,14 +40,62 @@ MULTIPLIER_ON = RULES["MULTIPLIER_ON"]
 class TotalCommand:
     num_of_API_requests = 0
     num_of_retrieve_Cache = 0
+    count_lock = Lock()  # the athletes are processed concurrently
+    elapsed_time = 0
 
-    
     def get_yearly_payments(self):
         """
         Check yearly payments for each athlete and return a message indicating
         whether they need to pay or not for the current year. 
         """
         logger.info("Total Command Called.")
+        start_time = time.perf_counter()
+        self.set_last_week()
+
+        loaded_creds = athlete_data_controller.load_athletes()
+
+        if loaded_creds is None:
+            return self.no_athletes_embed()
+
+        # Calculate the amounts of all athletes concurrently
+        self.athletes = []  # athletes of the command, the changed ones are saved at the end
+        try:
+            amounts = dict(map_athletes(self.process_athlete, loaded_creds))
+        finally:
+            # Save refreshed tokens and new week results of all athletes with one write
+            flush_athletes(self.athletes)
+        self.elapsed_time = time.perf_counter() - start_time
+
+        return self.create_payment_embed(amounts, YEAR)
+
+    async def get_yearly_payments_async(self):
+        """
+        The asyncio version of get_yearly_payments that the bot awaits, the athletes are processed
+        as coroutines on the event loop of the bot, at most FETCH_CONCURRENCY at the same time.
+        """
+        logger.info("Total Command Called.")
+        start_time = time.perf_counter()
+        self.set_last_week()
+
+        # reading and writing the athletes file would block the event loop
+        loaded_creds = await asyncio.to_thread(athlete_data_controller.load_athletes)
+
+        if loaded_creds is None:
+            return self.no_athletes_embed()
+
+        self.athletes = []
+        try:
+            amounts = dict(await gather_athletes(self.process_athlete_async, loaded_creds))
+        finally:
+            await asyncio.to_thread(flush_athletes, self.athletes)
+        self.elapsed_time = time.perf_counter() - start_time
+
+        return self.create_payment_embed(amounts, YEAR)
+
+    def set_last_week(self):
+        """
+        Sets the last week that is included in the total, the week before the current week or the last week of a past year.
+        """
         current_date = datetime.date.today()
         current_year = current_date.year
         current_week = current_date.isocalendar()[1]
@@ -58,73 +112,88 @@ class TotalCommand:
                 # Fallback or corrective action if needed
                 week_before_current_week = 52  # A safe assumption for most years
 
-        start_date = datetime.date.fromisocalendar(YEAR, 1, 1)  # Always start from the first week
-        end_date = datetime.date.fromisocalendar(YEAR, week_before_current_week, 7) + datetime.timedelta(days=1)
+        self.last_week = week_before_current_week
+        # end_date is exclusive in the Strava API so use the next day at 00:00:00 time
+        self.end_date = datetime.date.fromisocalendar(YEAR, week_before_current_week, 7) + datetime.timedelta(days=1)
 
-        loaded_creds = athlete_data_controller.load_athletes()
+    def no_athletes_embed(self):
+        embed = discord.Embed(title="No Athletes Registered",
+                              description="There are no authenticated athletes. Please use the /strava_auth command.",
+                              color=discord.Color.red())
+        return embed
 
-        if loaded_creds is None:
-            embed = discord.Embed(title="No Athletes Registered",
-                                  description="There are no authenticated athletes. Please use the /strava_auth command.",
-                                  color=discord.Color.red())
-            return embed
-
-        amounts = {}
-
-        for cred in loaded_creds:
-            athlete = Athlete(cred)
-            
-            # Parse week_results into a dictionary for easier access
-            week_results_dict = {int(w.split('_')[0]): int(w.split('_')[1]) for w in athlete.week_results}
-
-            # Determine the range of weeks to potentially fetch
-            weeks_to_fetch = [week for week in range(CHALLENGE_START_WEEK, week_before_current_week + 1)
-                            if week not in week_results_dict]
-            
-            
-            if weeks_to_fetch:  # Check if the list is not empty
-                start_date = datetime.date.fromisocalendar(YEAR, weeks_to_fetch[0], 1)
-                # Fetch activities for the needed weeks 
-                activities, api_requests, chache_retrieves = athlete.fetch_athlete_activities(start_date, end_date, cache=True)
+    def process_athlete(self, cred: dict):
+        """
+        Calculates the amount a single athlete has to pay for the year.
+
+        This method is run concurrently for all athletes by the fetch engine.
+        It returns a tuple of the username and the amount.
+        """
+        athlete = Athlete(cred)
+        with self.count_lock:
+            self.athletes.append(athlete)
+
+        weeks_to_fetch = self.find_weeks_to_fetch(athlete)
+
+        points_by_week = {}
+        if weeks_to_fetch:  # Check if the list is not empty
+            start_date = datetime.date.fromisocalendar(YEAR, weeks_to_fetch[0], 1)
+            # Fetch activities for the needed weeks
+            activities, api_requests, chache_retrieves = athlete.fetch_athlete_activities(start_date, self.end_date, cache=True)
+            # Score all missing weeks in one pass, this also updates the streak table
+            points_by_week = scoring_engine.score_weeks(activities, athlete, weeks_to_fetch)
+
+        return self.calculate_amount(athlete, weeks_to_fetch, points_by_week)
+
+    async def process_athlete_async(self, cred: dict):
+        """
+        The asyncio version of process_athlete, run concurrently for all athletes by gather_athletes.
+        """
+        athlete = await Athlete.create(cred)
+        with self.count_lock:
+            self.athletes.append(athlete)
+
+        weeks_to_fetch = self.find_weeks_to_fetch(athlete)
+
+        points_by_week = {}
+        if weeks_to_fetch:
+            start_date = datetime.date.fromisocalendar(YEAR, weeks_to_fetch[0], 1)
+            activities, api_requests, chache_retrieves = await athlete.fetch_athlete_activities_async(start_date, self.end_date, cache=True)
+            # the scoring reads and writes the local files, it runs in a thread so it doesn't hold up the event loop
+            points_by_week = await asyncio.to_thread(scoring_engine.score_weeks, activities, athlete, weeks_to_fetch)
+
+        return self.calculate_amount(athlete, weeks_to_fetch, points_by_week)
+
+    def find_weeks_to_fetch(self, athlete: Athlete):
+        """
+        Returns the weeks up to the last week of the total that weren't scored yet.
+        """
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        return [week for week in range(CHALLENGE_START_WEEK, self.last_week + 1)
+                if streak_table.result(week) is None]
+
+    def calculate_amount(self, athlete: Athlete, weeks_to_fetch: list, points_by_week: dict):
+        """
+        Adds up the prices of the missed weeks of an athlete and returns a tuple of the username and the amount.
+        """
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        with self.count_lock:
             self.num_of_API_requests += len(weeks_to_fetch)
-            self.num_of_retrieve_Cache += len(week_results_dict)
-            
-            amount_to_pay = 0
-            price_multiplier = 0  # Used for tracking how much the price has to be multiplied based on missed weeks
-            
-            for week in range(CHALLENGE_START_WEEK, week_before_current_week + 1):
-                result = week_results_dict.get(week, None)
-                if result == 2:  # Joker week, skip payment calculation
-                    continue
-                elif result == 1:  # Passed week, reset multiplier
-                    price_multiplier = 0
-                    continue
-                elif result == 0:
-                    if MULTIPLIER_ON:
-                        amount_to_pay += athlete.price_per_week * (MULTIPLIER ** price_multiplier)
-                    else:
-                        amount_to_pay += athlete.price_per_week
-                    price_multiplier += 1
-                
-                # If week is not in week_results_dict, calculate payment
-                if result is None:
-                    points_in_week = WeekCommand(week).get_points(activities, athlete)
-                    # Assuming get_points method or similar logic determines the result for the week
-                    
-                    if points_in_week < athlete.points_required:
-                        logger.info(f"{athlete.username} has to pay for week {week}. Reason: Only earned {points_in_week}/{athlete.points_required} points.")
-                        if MULTIPLIER_ON:
-                            amount_to_pay += athlete.price_per_week * (MULTIPLIER ** price_multiplier)
-                        else:
-                            amount_to_pay += athlete.price_per_week
-                        price_multiplier += 1
-                    else:
-                        week_results_dict[week] = 1  # Update week as passed
-                        price_multiplier = 0
-
-            amounts[athlete.username] = amount_to_pay
+            self.num_of_retrieve_Cache += self.last_week + 1 - CHALLENGE_START_WEEK - len(weeks_to_fetch)
+
+        amount_to_pay = 0
+        for week in range(CHALLENGE_START_WEEK, self.last_week + 1):
+            if streak_table.result(week) != PAY:  # Passed or joker week, nothing to pay
+                continue
+            if week in points_by_week:
+                logger.info(f"{athlete.username} has to pay for week {week}. Reason: Only earned {points_by_week[week]}/{athlete.points_required} points.")
+            if MULTIPLIER_ON:
+                # the streak includes this week, the price is multiplied by the weeks missed before it
+                amount_to_pay += athlete.price_per_week * (MULTIPLIER ** (streak_table.streak(week) - 1))
+            else:
+                amount_to_pay += athlete.price_per_week
 
-        return self.create_payment_embed(amounts, YEAR)
+        return (athlete.username, amount_to_pay)
 
 
     def create_payment_embed(self, amounts: dict, year: int):
@@ -152,7 +221,9 @@ class TotalCommand:
                 embed.add_field(name=username, value=f"muas {amount}€ zoin.{emoji}", inline=False)
             else:
                 embed.add_field(name=username, value=f"muas nix zoin.", inline=False)
-        embed.add_field(name="Api requests", value=f"{self.num_of_API_requests} Weeks requested from the strava API. \n{self.num_of_retrieve_Cache} Weeks retrieved from cache.\n", inline=False)
+        embed.add_field(name="Api requests", value=f"{self.num_of_API_requests} Weeks requested from the strava API. \n{self.num_of_retrieve_Cache} Weeks retrieved from cache.\n"
+                                                   f"Took {self.elapsed_time:.2f}s.\n", inline=False)
+        embed.add_field(name="Rate limit", value=governor.summary(), inline=False)
 
 
         return embed
@@ -6,16 +6,21 @@ This module contains classes and functions for handling Strava challenge data.
 Author: Julian Friedl
 """
 
+import asyncio
 import datetime
 import discord
 import logging
 import os
+import time
+from threading import Lock
 from dotenv import load_dotenv
 
 import src.shared.services.athlete_data_controller as athlete_data_controller
-import src.shared.services.routes_data_controller as routes_data_controller
-from src.shared.models.athlete import Athlete
-from src.shared.models.activity import Activity
+import src.shared.services.scoring_engine as scoring_engine
+from src.shared.services.fetch_engine import map_athletes, gather_athletes
+from src.shared.models.athlete import Athlete, flush_athletes
+from src.shared.models.week_result import PASS
+from src.shared.api.rate_governor import governor
 from src.shared.config.log_config import setup_logging
 
 setup_logging()
@@ -27,6 +32,7 @@ YEAR = int(os.getenv("YEAR", datetime.date.today().year))
 
 RULES = athlete_data_controller.load_global_rules()
 
+CHALLENGE_START_WEEK = RULES["CHALLENGE_START_WEEK"]
 MULTIPLIER = RULES["MULTIPLIER"]
 MULTIPLIER_ON = RULES["MULTIPLIER_ON"]
 
@@ -50,6 +56,8 @@ class WeekCommand:
         self.end_date = datetime.date.fromisocalendar(self.year, week, 7) + datetime.timedelta(days=1)
         self.num_of_API_requests = 0
         self.num_of_retrieve_Cache = 0
+        self.count_lock = Lock()  # the athletes are processed concurrently
+        self.athletes = []  # athletes of the command, the changed ones are saved at the end
 
     def excecute_week_command(self):
         """
@@ -59,7 +67,47 @@ class WeekCommand:
         It returns a Discord embed message with the payment details for the week.
         """
         logger.info(f"Week Command called, week:{self.week}.")
+        start_time = time.perf_counter()
         loaded_creds = athlete_data_controller.load_athletes()
+        error_embed = self.check_request(loaded_creds)
+        if error_embed is not None:
+            return error_embed
+
+        # Collect data and points for each athlete concurrently
+        try:
+            athlete_data = map_athletes(self.process_athlete, loaded_creds)
+        finally:
+            # Save refreshed tokens and new week results of all athletes with one write
+            flush_athletes(self.athletes)
+
+        return self.create_week_embed(athlete_data, start_time)
+
+    async def excecute_week_command_async(self):
+        """
+        The asyncio version of excecute_week_command that the bot awaits.
+
+        The athletes are processed as coroutines on the event loop of the bot, at most FETCH_CONCURRENCY at
+        the same time, and the requests to Strava don't block it. No thread is used per command.
+        """
+        logger.info(f"Week Command called, week:{self.week}.")
+        start_time = time.perf_counter()
+        # reading and writing the athletes file would block the event loop
+        loaded_creds = await asyncio.to_thread(athlete_data_controller.load_athletes)
+        error_embed = self.check_request(loaded_creds)
+        if error_embed is not None:
+            return error_embed
+
+        try:
+            athlete_data = await gather_athletes(self.process_athlete_async, loaded_creds)
+        finally:
+            await asyncio.to_thread(flush_athletes, self.athletes)
+
+        return self.create_week_embed(athlete_data, start_time)
+
+    def check_request(self, loaded_creds: list):
+        """
+        Returns an error embed if the command can't be executed, otherwise None.
+        """
         if loaded_creds is None:
             embed = discord.Embed(title="No Athletes Registered",
                                   description="There are no authenticated athletes. Please use the /strava_auth command.",
@@ -71,29 +119,17 @@ class WeekCommand:
                                   description="Error: The entered date exceeds the current date. Please enter a valid week number.",
                                   color=discord.Color.red())
             return embed
+        return None
 
+    def create_week_embed(self, athlete_data: list, start_time: float):
+        """
+        Creates the embed with the placements of the athletes and the amounts they have to pay.
+        """
         embed = discord.Embed(
             title=f"Woche {self.week}. *({self.start_date} - {self.end_date - datetime.timedelta(days=1)})*",
             color=discord.Color.blue()
         )
 
-        # Initialize a list to hold athlete data and points
-        athlete_data = []
-
-        # Collect data and points for each athlete
-        for cred in loaded_creds:
-            athlete = Athlete(cred)
-            activities, num_of_API_requests, num_of_retrieve_Cache = athlete.fetch_athlete_activities(self.start_date, self.end_date)
-            points = self.get_points(activities, athlete)
-            self.num_of_API_requests += num_of_API_requests
-            self.num_of_retrieve_Cache += num_of_retrieve_Cache
-
-            # Calculate the amount if required
-            amount = athlete.price_per_week * self.get_price_multiplier(athlete) if points < athlete.points_required else 0
-
-            # Append athlete data including calculated amount or flag for Joker status
-            athlete_data.append((athlete.username, points, athlete.points_required, amount, self.week in athlete.joker_weeks))
-
         # Sort the list by points in descending order
         sorted_athlete_data = sorted(athlete_data, key=lambda x: x[1], reverse=True)
 
@@ -131,82 +167,74 @@ class WeekCommand:
             embed.add_field(name=username, value=value, inline=False)
 
         # Add API request information
-        embed.add_field(name="Api requests", value=f"{self.num_of_API_requests} requests to the strava API. {self.num_of_retrieve_Cache} retrieved from cache.\n", inline=False)
+        elapsed_time = time.perf_counter() - start_time
+        embed.add_field(name="Api requests", value=f"{self.num_of_API_requests} requests to the strava API. {self.num_of_retrieve_Cache} retrieved from cache.\n"
+                                                   f"Took {elapsed_time:.2f}s.\n", inline=False)
+        embed.add_field(name="Rate limit", value=governor.summary(), inline=False)
 
         return embed
 
+    def process_athlete(self, cred: dict):
+        """
+        Fetches the activities of a single athlete and calculates the points and the amount for the week.
+
+        This method is run concurrently for all athletes by the fetch engine.
+        It returns a tuple with the athlete data that is needed for the embed.
+        """
+        athlete = Athlete(cred)
+        with self.count_lock:
+            self.athletes.append(athlete)
+        activities, num_of_API_requests, num_of_retrieve_Cache = athlete.fetch_athlete_activities(self.start_date, self.end_date)
+        points = self.get_points(activities, athlete)
+        self.add_request_counts(num_of_API_requests, num_of_retrieve_Cache)
+
+        # Calculate the amount if required
+        amount = athlete.price_per_week * self.get_price_multiplier(athlete) if points < athlete.points_required else 0
+
+        # Return athlete data including calculated amount or flag for Joker status
+        return (athlete.username, points, athlete.points_required, amount, self.week in athlete.joker_weeks)
+
+    async def process_athlete_async(self, cred: dict):
+        """
+        The asyncio version of process_athlete, run concurrently for all athletes by gather_athletes.
+        """
+        athlete = await Athlete.create(cred)
+        with self.count_lock:
+            self.athletes.append(athlete)
+        activities, num_of_API_requests, num_of_retrieve_Cache = await athlete.fetch_athlete_activities_async(self.start_date, self.end_date)
+        # the scoring reads and writes the local files, it runs in a thread so it doesn't hold up the event loop
+        points = await asyncio.to_thread(self.get_points, activities, athlete)
+        self.add_request_counts(num_of_API_requests, num_of_retrieve_Cache)
+
+        amount = athlete.price_per_week * await self.get_price_multiplier_async(athlete) if points < athlete.points_required else 0
+
+        return (athlete.username, points, athlete.points_required, amount, self.week in athlete.joker_weeks)
+
+    def add_request_counts(self, num_of_API_requests: int, num_of_retrieve_Cache: int):
+        """
+        Adds the request counts of a fetch to the totals of the command.
+        """
+        with self.count_lock:
+            self.num_of_API_requests += num_of_API_requests
+            self.num_of_retrieve_Cache += num_of_retrieve_Cache
+
     # in week_command.py file, inside WeekCommand class
-    def get_points(self, activities: dict, athlete: Athlete):
+    def get_points(self, activities: list, athlete: Athlete):
         """
         Calculates the total points earned for the activities within the week.
 
-        This method iterates over the activities and calculates the points earned based on HIT workouts and activity duration.
+        This method scores the week with the scoring engine, which also updates the week result of the athlete.
         It returns the total points earned.
         """
-        
-        points = 0
-        hit_counter = 0
-        activities_done_set = set()
-        # reverse it because strava orders the most recent one on top
-        for activity_data in reversed(activities):
-            activity = Activity(activity_data)
-            if activity.is_in_week(self.week):
-                routes_data_controller.save_routes(activity, athlete) # save the map data for later usage
-                hit_counter = activity.count_hit_workouts(
-                    hit_counter, activities_done_set, athlete)
-                if hit_counter == athlete.hit_required:
-                    points += 1
-                    activities_done_set.add((activity.type, activity.date))
-                    hit_counter = 0
-                    logger.debug(
-                        f"{athlete.username} Added 1 point for hit_counter: {hit_counter}\n"
-                        f"Total points now: {points}\n"
-                        f"Date: {activity.date}, Type: {activity.type}, Duration: {activity.duration}")
-                else:
-                    points_from_activity = activity.calculate_points(
-                        activities_done_set, athlete)
-                    points += points_from_activity
-                    logger.debug(
-                        f"{athlete.username} Added {points_from_activity} point/s from activity\n"
-                        f"Total points now: {points}\n"
-                        f"Date: {activity.start_date}, Type: {activity.type}, Duration: {activity.duration}")
-        
-        # Insert week into week_results
-        existing_weeks = set(int(week_result.split("_")[0]) for week_result in athlete.week_results)
-
-        if self.week not in existing_weeks:
-            # Week does not exist, insert new result
-            insert_pos = self.week - 1  # Assuming week numbers are 1-based and list is 0-based
-            if self.week in athlete.joker_weeks:
-                athlete.week_results.insert(insert_pos, f"{self.week}_2")
-            elif points < athlete.points_required:
-                athlete.week_results.insert(insert_pos, f"{self.week}_0")
-            else:
-                athlete.week_results.insert(insert_pos, f"{self.week}_1")
-        else:
-            # Week exists, replace the result
-            for i, week_result in enumerate(athlete.week_results):
-                week_num = int(week_result.split("_")[0])
-                if week_num == self.week:
-                    if self.week in athlete.joker_weeks:
-                        athlete.week_results[i] = f"{self.week}_2"
-                    elif points < athlete.points_required:
-                        athlete.week_results[i] = f"{self.week}_0"
-                    else:
-                        athlete.week_results[i] = f"{self.week}_1"
-                    break  # Exit the loop once the week is found and updated
-
-        # Update athlete credentials with the new week results
-        athlete.credentials["vars"]["week_results"] = athlete.week_results
-
-        # Call the function to update the athlete's vars in storage or database
-        athlete_data_controller.update_athlete_vars(athlete.credentials)
-
-        return points
+        return scoring_engine.score_weeks(activities, athlete, [self.week])[self.week]
 
     def get_price_multiplier(self, athlete: Athlete):
         """
         Calculates the price multiplier for an athlete based on the number of weeks missed.
+
+        The missed weeks are looked up in the streak table of the athlete. Only if a week before this one
+        wasn't scored yet (and the last week wasn't passed, which resets the streak anyway) the missing weeks
+        are fetched first.
     
         Parameters:
         - athlete (Athlete): The athlete object containing week results and other relevant data.
@@ -216,22 +244,42 @@ class WeekCommand:
         """
         if not MULTIPLIER_ON:
             return 1
-        
-        self.get_missing_weeks(athlete)#get any weeks that are missing for the calculation
-        missed_weeks_count = 0
-        for week_result in reversed(athlete.week_results):
-            week = int(week_result.split("_")[0])
-            result = int(week_result.split("_")[1])
-            if week >= self.week:
-                continue
-            if result == 1:
-                break
-            elif result == 0:
-                missed_weeks_count += 1
-            elif result == 2:  # joker
-                continue
-        
-        return MULTIPLIER**(missed_weeks_count)
+
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        if self.needs_missing_weeks(streak_table):
+            self.get_missing_weeks(athlete)  # get any weeks that are missing for the calculation
+
+        return MULTIPLIER**(streak_table.missed_before(self.week))
+
+    async def get_price_multiplier_async(self, athlete: Athlete):
+        """
+        The asyncio version of get_price_multiplier, the missing weeks are fetched without blocking the event loop.
+        """
+        if not MULTIPLIER_ON:
+            return 1
+
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        if self.needs_missing_weeks(streak_table):
+            weeks_missing = self.find_missing_weeks(athlete)
+            if weeks_missing != []:
+                await self.missing_weeks_api_request_async(weeks_missing, athlete)
+
+        return MULTIPLIER**(streak_table.missed_before(self.week))
+
+    def needs_missing_weeks(self, streak_table):
+        """
+        Returns True if the weeks before this one have to be scored for the multiplier. A passed last week
+        resets the streak anyway, otherwise every week before this one needs a result.
+        """
+        return streak_table.result(self.week - 1) != PASS and not streak_table.is_complete(self.week)
+
+    def find_missing_weeks(self, athlete: Athlete):
+        """
+        Returns the weeks up to this one that weren't scored yet, the latest week first.
+        """
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        return [week for week in reversed(range(CHALLENGE_START_WEEK, self.week + 1))
+                if streak_table.result(week) is None]
 
     def get_missing_weeks(self, athlete: Athlete):
         """
@@ -244,22 +292,8 @@ class WeekCommand:
         Returns:
         - None: This function does not return a value but updates the athlete's records with fetched activities for missing weeks.
         """
-        
-        # check if past weeks data is complete for the price multiplier calculation
-        weeks_missing = []
-        week_number = self.week
-
-        # Parse the week results into a dictionary {week: result}
-        week_results_dict = {int(result.split("_")[0]): int(result.split("_")[1]) for result in athlete.week_results}
-
-        # If all results are 1 or there are no results, no missing weeks are considered
-        if week_results_dict.get(self.week-1) == 1:
-            return
-
-        # Iterate through all weeks from 1 to the current week
-        for week in reversed(range(1, week_number + 1)):
-            if week not in week_results_dict.keys():
-                weeks_missing.append(week)
+        # Iterate through all weeks from the start of the challenge to the current week
+        weeks_missing = self.find_missing_weeks(athlete)
         if weeks_missing != []:
             self.missing_weeks_api_request(weeks_missing, athlete)
 
@@ -279,8 +313,18 @@ class WeekCommand:
         end_date = datetime.date.fromisocalendar(
             self.year, weeks_missing[0], 7) + datetime.timedelta(days=1)
         activities, num_of_API_requests, num_of_retrieve_Cache  = athlete.fetch_athlete_activities(start_date, end_date, cache=False)
-        self.num_of_API_requests += num_of_API_requests
-        self.num_of_retrieve_Cache += num_of_retrieve_Cache
+        self.add_request_counts(num_of_API_requests, num_of_retrieve_Cache)
+
+        # plus 1 because in range isn't inclusive
+        scoring_engine.score_weeks(activities, athlete, list(range(weeks_missing[len(weeks_missing)-1], weeks_missing[0]+1)))
+
+    async def missing_weeks_api_request_async(self, weeks_missing: list, athlete: Athlete):
+        """
+        The asyncio version of missing_weeks_api_request.
+        """
+        start_date = datetime.date.fromisocalendar(self.year, weeks_missing[-1], 1)
+        end_date = datetime.date.fromisocalendar(self.year, weeks_missing[0], 7) + datetime.timedelta(days=1)
+        activities, num_of_API_requests, num_of_retrieve_Cache = await athlete.fetch_athlete_activities_async(start_date, end_date, cache=False)
+        self.add_request_counts(num_of_API_requests, num_of_retrieve_Cache)
 
-        for week in range(weeks_missing[len(weeks_missing)-1], weeks_missing[0]+1): # plus 1 because in range isn't inclusive
-            WeekCommand(week).get_points(activities, athlete)
\ No newline at end of file
+        await asyncio.to_thread(scoring_engine.score_weeks, activities, athlete, list(range(weeks_missing[-1], weeks_missing[0] + 1)))
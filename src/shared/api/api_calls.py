@@ -6,14 +6,20 @@ This module contains a function for making API requests and handling HTTP errors
 Author: Julian Friedl
 """
 
+import asyncio
 import hashlib
 import os
-import pickle
+import aiohttp
 import requests
 import discord
 from enum import Enum
 
 from src.shared.api.custom_api_error import CustomAPIError
+from src.shared.api.cache_store import CacheStore
+import src.shared.api.http_client as http_client
+import src.shared.api.async_http_client as async_http_client
+from src.shared.services.single_flight import SingleFlight, AsyncSingleFlight
+from src.shared.api.rate_governor import governor, Priority, RateLimitExceeded, RATE_LIMIT_MAX_WAIT
 class API_CALL_TYPE(Enum):
     Cache = 1
     API = 2
@@ -23,7 +29,12 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(o
 CACHE_PATH = os.path.join(PROJECT_ROOT, 'cache')
 os.makedirs(CACHE_PATH, exist_ok=True)  # make sure the directory exists
 
-def api_request(url:str, headers:dict, params:dict, username:str, user_id:str, cache:bool = True):
+cache_store = CacheStore(os.path.join(CACHE_PATH, 'api_cache.sqlite3'))
+request_flights = SingleFlight()  # identical requests of the fetch threads
+async_request_flights = AsyncSingleFlight()  # identical requests on the event loop
+
+def api_request(url:str, headers:dict, params:dict, username:str, user_id:str, cache:bool = True, ttl:float = None,
+                priority:Priority = Priority.INTERACTIVE, max_wait:float = RATE_LIMIT_MAX_WAIT):
     """
     Makes a GET request to the specified URL and handles HTTP errors.
 
@@ -36,63 +47,153 @@ def api_request(url:str, headers:dict, params:dict, username:str, user_id:str, c
         headers (dict, optional): The headers for the request.
         params (dict, optional): The parameters for the request.
         username (str): The username for the request.
-        id(str): the id of the user, used for encoding the cache with a unique filename
+        id(str): the id of the user, used for encoding the cache key and for invalidating the cache of a user
+        cache (bool): if the cache should be used for the request
+        ttl (float, optional): seconds until the cached response expires, None caches it for good
+        priority (Priority): interactive requests get the rate limit budget before background requests
+        max_wait (float, optional): seconds to wait for rate limit budget, None waits as long as needed
 
     Returns:
         response (dict or None): The JSON response if the request was successful, otherwise None.
         API_CALL_TYPE (Cache = 1 API = 2, Error = 3): Cache if the cache is used and API if the api is used and Error if error occurs
+
+    An identical request (same url, params and user) that is already running is joined instead of sent again,
+    the joined request counts as Cache because it didn't reach Strava either.
     """
-       #check if the cache dir exists
-    if not os.path.exists(CACHE_PATH):
-        os.makedirs(CACHE_PATH)
-        
+    cache_key = request_cache_key(url, params, user_id)
     if cache:
-    # Create a hash of the url, headers and params to uniquely identify the request
-        req_hash = hashlib.sha256() 
-        req_hash.update(url.encode('utf-8'))
-        #req_hash.update(str(headers).encode('utf-8'))
-        #I am leaving out the headers because the auth token changes every 6 hours, so that would mean the cache expires at the same rate
-        #But to still be able to uniquely identify each cache file i will include the uid in the hash
-        req_hash.update(str(user_id).encode('utf-8'))
-        req_hash.update(str(params).encode('utf-8'))
-        cache_file = os.path.join(CACHE_PATH, req_hash.hexdigest())
-        # If the cache file exists, load the cached response
-        if os.path.exists(cache_file):
-            with open(cache_file, 'rb') as f:
-                return pickle.load(f), API_CALL_TYPE.Cache
-        
+        # If there is a valid cache entry, return the cached response
+        cached = cache_store.get(cache_key)
+        if cached is not None:
+            return cached, API_CALL_TYPE.Cache
+
+    data, shared = request_flights.do(cache_key, send_request, url, headers, params, username, user_id,
+                                      cache_key if cache else None, ttl, priority, max_wait)
+    return data, API_CALL_TYPE.Cache if shared else API_CALL_TYPE.API
+
+
+def send_request(url:str, headers:dict, params:dict, username:str, user_id:str, cache_key:str, ttl:float,
+                 priority:Priority, max_wait:float):
+    """
+    Sends the request of api_request to Strava and caches the response under cache_key (unless it is None).
+    """
     try:
-        response = requests.get(url, headers=headers, params=params)
+        # the budget is taken for every attempt, the retries after 5xx count against the windows too
+        response = http_client.get(url, headers=headers, params=params, acquire=lambda: governor.acquire(priority, max_wait))
+        governor.update_from_headers(response.headers)
         response.raise_for_status()  # Raises a HTTPError if the status is 4xx, 5xx
         
-        if cache:
+        data = response.json()
+        if cache_key is not None:
             # Cache the response
-            with open(cache_file, 'wb') as f:
-                pickle.dump(response.json(), f)
+            cache_store.set(cache_key, user_id, data, ttl)
 
-        return response.json(), API_CALL_TYPE.API
+        return data
+    except RateLimitExceeded as e:
+        raise rate_limit_error(e, username) from e
     except requests.exceptions.HTTPError as e:
-        status_code = response.status_code
-
-        # Customize the error messages for different status codes
-        if status_code == 400:
-            message = f"Bad Request for user {username}: The request was unacceptable, often due to a missing parameter."
-        elif status_code == 401:
-            message = f"Unauthorized for user {username}: Access token was missing or invalid."
-        elif status_code == 403:
-            message = f"Forbidden for user {username}: The request is understood, but it has been refused by the Strava API."
-        elif status_code == 404:
-            message = f"Not Found for user {username}: The requested resource could not be found."
-        elif status_code == 429:
-            message = f"Too Many Requests for user {username}: Rate limit exceeded, Wait 15 min."
-        elif status_code == 500:
-            message = f"Internal Server Error for user {username}: Strava had an error, try again later."
-        else:
-            message = f"An error occurred while making the API request for user {username}. Status code: {status_code}"
-
-        error_embed = discord.Embed(title="HTTP Error", description=message, color=discord.Color.red())
-        raise CustomAPIError(message, error_embed) from e
+        raise http_error(response.status_code, username) from e
     except requests.exceptions.RequestException as e:
         message = f"An error occurred while making the API request for user {username}: {str(e)}"
         error_embed = discord.Embed(title="Request Error", description=message, color=discord.Color.red())
         raise CustomAPIError(message, error_embed) from e
+
+
+async def async_api_request(url:str, headers:dict, params:dict, username:str, user_id:str, cache:bool = True, ttl:float = None,
+                            priority:Priority = Priority.INTERACTIVE, max_wait:float = RATE_LIMIT_MAX_WAIT):
+    """
+    The asyncio version of api_request for the commands that run on the event loop of the bot.
+
+    It shares the response cache and the rate governor with api_request, waiting for rate limit budget
+    and the request itself don't block the event loop. The arguments and return values are the same,
+    identical requests that are already running on the event loop are joined as well.
+    """
+    cache_key = request_cache_key(url, params, user_id)
+    if cache:
+        cached = cache_store.get(cache_key)
+        if cached is not None:
+            return cached, API_CALL_TYPE.Cache
+
+    data, shared = await async_request_flights.do(cache_key, send_request_async, url, headers, params, username, user_id,
+                                                  cache_key if cache else None, ttl, priority, max_wait)
+    return data, API_CALL_TYPE.Cache if shared else API_CALL_TYPE.API
+
+
+async def send_request_async(url:str, headers:dict, params:dict, username:str, user_id:str, cache_key:str, ttl:float,
+                             priority:Priority, max_wait:float):
+    """
+    The asyncio version of send_request.
+    """
+    try:
+        response = await async_http_client.get(url, headers=headers, params=params,
+                                               acquire=lambda: governor.acquire_async(priority, max_wait))
+    except RateLimitExceeded as e:
+        raise rate_limit_error(e, username) from e
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        message = f"An error occurred while making the API request for user {username}: {e!r}"
+        error_embed = discord.Embed(title="Request Error", description=message, color=discord.Color.red())
+        raise CustomAPIError(message, error_embed) from e
+
+    governor.update_from_headers(response.headers)
+    if response.status_code >= 400:
+        raise http_error(response.status_code, username)
+
+    data = response.json()
+    if cache_key is not None:
+        cache_store.set(cache_key, user_id, data, ttl)
+    return data
+
+
+def coalescing_stats():
+    """
+    Returns how many requests are running and how many were joined instead of sent, for the metrics.
+    """
+    return {"threads": request_flights.stats(), "event_loop": async_request_flights.stats()}
+
+
+def request_cache_key(url:str, params:dict, user_id:str):
+    """
+    Creates a hash of the url, user id and params to uniquely identify the request in the cache.
+    """
+    req_hash = hashlib.sha256() 
+    req_hash.update(url.encode('utf-8'))
+    #req_hash.update(str(headers).encode('utf-8'))
+    #I am leaving out the headers because the auth token changes every 6 hours, so that would mean the cache expires at the same rate
+    #But to still be able to uniquely identify each cache file i will include the uid in the hash
+    req_hash.update(str(user_id).encode('utf-8'))
+    req_hash.update(str(params).encode('utf-8'))
+    return req_hash.hexdigest()
+
+
+def rate_limit_error(error:RateLimitExceeded, username:str):
+    """
+    Returns the CustomAPIError for a request that didn't get rate limit budget in time.
+    """
+    message = f"Too Many Requests for user {username}: Rate limit reached, try again in {int(error.retry_after // 60) + 1} min."
+    error_embed = discord.Embed(title="Rate Limit", description=message, color=discord.Color.red())
+    return CustomAPIError(message, error_embed)
+
+
+def http_error(status_code:int, username:str):
+    """
+    Returns the CustomAPIError with the error message for a 4xx or 5xx status code.
+    """
+    # Customize the error messages for different status codes
+    if status_code == 400:
+        message = f"Bad Request for user {username}: The request was unacceptable, often due to a missing parameter."
+    elif status_code == 401:
+        message = f"Unauthorized for user {username}: Access token was missing or invalid."
+    elif status_code == 403:
+        message = f"Forbidden for user {username}: The request is understood, but it has been refused by the Strava API."
+    elif status_code == 404:
+        message = f"Not Found for user {username}: The requested resource could not be found."
+    elif status_code == 429:
+        governor.mark_exhausted()
+        message = f"Too Many Requests for user {username}: Rate limit exceeded, try again in {int(governor.seconds_until_reset() // 60) + 1} min."
+    elif status_code == 500:
+        message = f"Internal Server Error for user {username}: Strava had an error, try again later."
+    else:
+        message = f"An error occurred while making the API request for user {username}. Status code: {status_code}"
+
+    error_embed = discord.Embed(title="HTTP Error", description=message, color=discord.Color.red())
+    return CustomAPIError(message, error_embed)
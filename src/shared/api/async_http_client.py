@@ -0,0 +1,129 @@
+"""
+async_http_client.py
+
+This module contains the asyncio counterpart of http_client for the commands that run on the event loop of the bot.
+It keeps one pooled aiohttp.ClientSession per event loop, uses the same timeouts, retries and jittered backoff as
+http_client and records the latency in the same statistics, so the metrics cover both clients.
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+
+from src.shared.api.http_client import (latency_stats, backoff_delay, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+                                        HTTP_MAX_RETRIES, HTTP_POOL_SIZE)
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+sessions = {}  # event loop -> aiohttp.ClientSession, a session can only be used on the loop it was created on
+
+
+class AsyncResponse:
+    """
+    The already read response of a request, with the attributes of requests.Response the callers use.
+    """
+
+    def __init__(self, status_code: int, headers, body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+
+def get_session():
+    """
+    Returns the session of the running event loop and creates it on the first call.
+    The connector limits the open connections to HTTP_POOL_SIZE, further requests wait for a free connection.
+    """
+    loop = asyncio.get_running_loop()
+    session = sessions.get(loop)
+    if session is None or session.closed:
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE), timeout=timeout)
+        sessions[loop] = session
+    return session
+
+
+async def close():
+    """
+    Closes the session of the running event loop.
+    """
+    session = sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def request(method: str, url: str, max_retries: int = HTTP_MAX_RETRIES, acquire=None, **kwargs):
+    """
+    Sends a request over the session of the running event loop.
+
+    5xx responses, connection errors and timeouts are retried up to max_retries times. The response of the last
+    attempt is returned, so the callers still handle the status codes themselves.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL to make the request to.
+        max_retries (int): How often a failed request is retried.
+        acquire (callable, optional): Called before every attempt, e.g. to take rate limit budget for it, so the
+            retries are counted as well. It has to return an awaitable.
+        **kwargs: Passed on to aiohttp, e.g. headers, params or data.
+
+    Returns:
+        AsyncResponse: The response of the request.
+    """
+    if kwargs.get("params"):
+        # aiohttp only accepts strings and integers as query values
+        kwargs["params"] = {key: str(value) for key, value in kwargs["params"].items()}
+    if isinstance(kwargs.get("data"), dict):
+        # requests leaves out form fields that are None, aiohttp would fail on them
+        kwargs["data"] = {key: value for key, value in kwargs["data"].items() if value is not None}
+    attempt = 0
+    while True:
+        if acquire is not None:
+            await acquire()
+        start_time = time.perf_counter()
+        try:
+            async with get_session().request(method, url, **kwargs) as raw_response:
+                response = AsyncResponse(raw_response.status, raw_response.headers, await raw_response.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            latency_stats.record(time.perf_counter() - start_time, error=True)
+            if attempt >= max_retries:
+                raise
+            logger.warning(f"{method} {url} failed: {e!r}. Retrying ({attempt + 1}/{max_retries}).")
+        else:
+            elapsed = time.perf_counter() - start_time
+            latency_stats.record(elapsed, error=response.status_code >= 500)
+            logger.debug(f"{method} {url} {response.status_code} took {elapsed * 1000:.0f}ms.")
+            if response.status_code < 500 or attempt >= max_retries:
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}. Retrying ({attempt + 1}/{max_retries}).")
+
+        latency_stats.record_retry()
+        await asyncio.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+async def get(url: str, **kwargs):
+    """
+    Sends a GET request over the session of the running event loop.
+    """
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs):
+    """
+    Sends a POST request over the session of the running event loop.
+    """
+    return await request("POST", url, **kwargs)
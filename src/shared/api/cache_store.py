@@ -0,0 +1,165 @@
+"""
+cache_store.py
+
+This module contains an indexed cache store for API responses, backed by a single SQLite file.
+Entries can expire after a TTL, the store is bounded in size by evicting the least recently used
+entries and all entries of an athlete can be invalidated at once.
+
+Author: Julian Friedl
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+from dotenv import load_dotenv
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CACHE_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB", 256)) * 1024 * 1024)
+
+
+class CacheStore:
+
+    def __init__(self, path: str, max_bytes: int = CACHE_MAX_BYTES):
+        """
+        Opens (or creates) the cache database at the given path.
+
+        Args:
+            path (str): Path of the SQLite file.
+            max_bytes (int): Upper bound for the summed size of all cached values, older entries get evicted.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = Lock()  # one connection is shared between the threads
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_id ON entries (user_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, key: str):
+        """
+        Returns the cached value for the key, or None if there is no valid entry.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, size, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, user_id: str, value, ttl: float = None):
+        """
+        Stores a JSON serializable value.
+
+        Args:
+            key (str): The unique key of the request.
+            user_id (str): The athlete the entry belongs to, used for invalidation.
+            value: The value to cache.
+            ttl (float, optional): Seconds until the entry expires. None keeps the entry until it is evicted.
+        """
+        now = time.time()
+        serialized = json.dumps(value, separators=(',', ':'))
+        size = len(serialized)
+        expires_at = now + ttl if ttl is not None else None
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, user_id, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, str(user_id), serialized, size, expires_at, now))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries and then the least recently used ones until the store fits into max_bytes.
+        Has to be called while holding the lock.
+        """
+        now = time.time()
+        expired = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).fetchone()
+        if expired[0]:
+            self.conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self.total_bytes -= expired[1]
+            self.expirations += expired[0]
+
+        if self.total_bytes <= self.max_bytes:
+            return
+        keys = []
+        freed = 0
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            keys.append((key,))
+            freed += size
+            if self.total_bytes - freed <= self.max_bytes:
+                break
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+        self.total_bytes -= freed
+        self.evictions += len(keys)
+        logger.debug(f"Evicted {len(keys)} entries from the cache.")
+
+    def invalidate_user(self, user_id: str):
+        """
+        Removes every cached entry of an athlete.
+        """
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE user_id = ?", (str(user_id),)).fetchone()
+            self.conn.execute("DELETE FROM entries WHERE user_id = ?", (str(user_id),))
+            self.total_bytes -= size
+        logger.info(f"Invalidated {count} cache entries of user {user_id}.")
+        return count
+
+    def clear(self):
+        """
+        Removes every cached entry.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.total_bytes = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction counters and the current size of the store.
+        """
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
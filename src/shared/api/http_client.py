@@ -0,0 +1,148 @@
+"""
+http_client.py
+
+This module contains the shared HTTP client for all calls to Strava. It keeps one pooled requests.Session,
+so connections are kept alive and reused, adds timeouts, retries failed calls with a jittered exponential
+backoff and measures the latency of every call.
+
+Author: Julian Friedl
+"""
+
+import logging
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from dotenv import load_dotenv
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))  # seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 8))  # seconds
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))  # connections kept alive per host
+
+
+class LatencyStats:
+    """
+    Thread safe counters for the latency of the HTTP calls.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, error: bool = False):
+        with self.lock:
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if error:
+                self.errors += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "errors": self.errors,
+                "avg_ms": round(self.total_time / self.calls * 1000, 1) if self.calls else 0,
+                "max_ms": round(self.max_time * 1000, 1),
+            }
+
+
+def create_session():
+    """
+    Creates a requests.Session with a connection pool that is big enough for the concurrent fetches.
+    """
+    new_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    return new_session
+
+
+session = create_session()
+latency_stats = LatencyStats()
+
+
+def backoff_delay(attempt: int):
+    """
+    Returns the delay before the next retry, exponential in the attempt with full jitter.
+    """
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method: str, url: str, max_retries: int = HTTP_MAX_RETRIES, acquire=None, **kwargs):
+    """
+    Sends a request over the shared session.
+
+    5xx responses, connection errors and timeouts are retried up to max_retries times. The response of the last
+    attempt is returned, so the callers still handle the status codes themselves.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL to make the request to.
+        max_retries (int): How often a failed request is retried.
+        acquire (callable, optional): Called before every attempt, e.g. to take rate limit budget for it, so the
+            retries are counted as well.
+        **kwargs: Passed on to requests, e.g. headers, params or data.
+
+    Returns:
+        requests.Response: The response of the request.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    attempt = 0
+    while True:
+        if acquire is not None:
+            acquire()
+        start_time = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            latency_stats.record(time.perf_counter() - start_time, error=True)
+            if attempt >= max_retries:
+                raise
+            logger.warning(f"{method} {url} failed: {e}. Retrying ({attempt + 1}/{max_retries}).")
+        else:
+            elapsed = time.perf_counter() - start_time
+            latency_stats.record(elapsed, error=response.status_code >= 500)
+            logger.debug(f"{method} {url} {response.status_code} took {elapsed * 1000:.0f}ms.")
+            if response.status_code < 500 or attempt >= max_retries:
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}. Retrying ({attempt + 1}/{max_retries}).")
+
+        latency_stats.record_retry()
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+def get(url: str, **kwargs):
+    """
+    Sends a GET request over the shared session.
+    """
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    """
+    Sends a POST request over the shared session.
+    """
+    return request("POST", url, **kwargs)
@@ -0,0 +1,276 @@
+"""
+rate_governor.py
+
+This module contains the process wide governor for the Strava rate limits. Strava allows a fixed number of
+requests per 15 minutes (the windows reset at 0, 15, 30 and 45 minutes past the hour) and per day (reset at
+midnight UTC) and reports the current usage in the X-RateLimit headers of every response.
+The governor tracks both windows, lets requests wait until there is budget left and prefers interactive
+requests over background backfills.
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+import time
+from enum import IntEnum
+from threading import Condition
+from dotenv import load_dotenv
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Read limits of Strava, they are updated from the response headers
+RATE_LIMIT_SHORT = int(os.getenv("RATE_LIMIT_SHORT", 100))
+RATE_LIMIT_DAILY = int(os.getenv("RATE_LIMIT_DAILY", 1000))
+# Requests of the 15 minute window that are kept free for interactive commands
+RATE_LIMIT_RESERVE = int(os.getenv("RATE_LIMIT_RESERVE", 10))
+# Seconds a request waits for budget before it fails
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 60))
+# Seconds between two checks of a request that waits for budget on the event loop
+RATE_LIMIT_POLL = float(os.getenv("RATE_LIMIT_POLL", 0.5))
+
+SHORT_WINDOW = 15 * 60  # seconds
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+def short_window_start(now: float):
+    """
+    Returns the start of the 15 minute window the timestamp is in.
+    """
+    return now - now % SHORT_WINDOW
+
+
+def daily_window_start(now: float):
+    """
+    Returns the start of the UTC day the timestamp is in.
+    """
+    return now - now % 86400
+
+
+def parse_rate_limit_header(value: str):
+    """
+    Parses a header in the format "<15 minute value>,<daily value>".
+
+    Returns:
+        tuple (int, int) or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        short, daily = value.split(",")[:2]
+        return int(short), int(daily)
+    except ValueError:
+        return None
+
+
+class RateGovernor:
+
+    def __init__(self, short_limit: int = RATE_LIMIT_SHORT, daily_limit: int = RATE_LIMIT_DAILY, reserve: int = RATE_LIMIT_RESERVE):
+        self.condition = Condition()
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.reserve = reserve
+        now = time.time()
+        self.short_start = short_window_start(now)
+        self.daily_start = daily_window_start(now)
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.waiting = {Priority.INTERACTIVE: 0, Priority.BACKGROUND: 0}
+        self.throttled = 0  # requests that had to wait
+        self.rejected = 0  # requests that failed because the wait would have been too long
+
+    def roll_windows(self, now: float):
+        """
+        Resets the usage of the windows that are over. Has to be called while holding the condition.
+        """
+        if now >= self.short_start + SHORT_WINDOW:
+            self.short_start = short_window_start(now)
+            self.short_usage = 0
+        if now >= self.daily_start + 86400:
+            self.daily_start = daily_window_start(now)
+            self.daily_usage = 0
+
+    def can_send(self, priority: Priority):
+        """
+        Checks if a request with the priority may be sent now. Has to be called while holding the condition.
+        """
+        short_limit = self.short_limit
+        if priority == Priority.BACKGROUND:
+            if self.waiting[Priority.INTERACTIVE]:
+                return False
+            short_limit -= self.reserve
+        return self.short_usage < short_limit and self.daily_usage < self.daily_limit
+
+    def next_reset(self):
+        """
+        Returns the timestamp at which the blocking window resets. Has to be called while holding the condition.
+        """
+        if self.daily_usage >= self.daily_limit:
+            return self.daily_start + 86400
+        return self.short_start + SHORT_WINDOW
+
+    def acquire(self, priority: Priority = Priority.INTERACTIVE, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        """
+        Blocks until the request may be sent and counts it against both windows.
+
+        Args:
+            priority (Priority): Interactive requests are served before background requests.
+            max_wait (float, optional): Seconds to wait at most. None waits until there is budget.
+
+        Raises:
+            RateLimitExceeded: If there is no budget left within max_wait.
+        """
+        with self.condition:
+            deadline = time.time() + max_wait if max_wait is not None else None
+            reset = self.try_take(priority, deadline, False)
+            if reset is None:
+                return
+            # only a request that couldn't be sent right away counts as waiting
+            self.waiting[priority] += 1
+            try:
+                while reset is not None:
+                    # wake up at the window reset or when another request changes the state
+                    self.condition.wait(timeout=max(reset - time.time(), 0.05))
+                    reset = self.try_take(priority, deadline, True)
+            finally:
+                self.stop_waiting(priority)
+
+    async def acquire_async(self, priority: Priority = Priority.INTERACTIVE, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        """
+        Like acquire, but waits with asyncio.sleep, so the event loop keeps running while there is no budget.
+        The waiting coroutines don't get notified, they check again every RATE_LIMIT_POLL seconds at most.
+
+        Raises:
+            RateLimitExceeded: If there is no budget left within max_wait.
+        """
+        deadline = time.time() + max_wait if max_wait is not None else None
+        with self.condition:
+            reset = self.try_take(priority, deadline, False)
+            if reset is None:
+                return
+            self.waiting[priority] += 1
+        try:
+            while reset is not None:
+                await asyncio.sleep(min(max(reset - time.time(), 0.05), RATE_LIMIT_POLL))
+                with self.condition:
+                    reset = self.try_take(priority, deadline, True)
+                    if reset is None:
+                        # in the same critical section as the take, so no request sees it waiting after it was sent
+                        self.stop_waiting(priority)
+        finally:
+            if reset is not None:
+                # cancelled or rejected while waiting
+                with self.condition:
+                    self.stop_waiting(priority)
+
+    def stop_waiting(self, priority: Priority):
+        """
+        Removes a request from the waiting ones. Has to be called while holding the condition.
+        """
+        self.waiting[priority] -= 1
+        self.condition.notify_all()
+
+    def try_take(self, priority: Priority, deadline: float, waited: bool):
+        """
+        Counts the request against both windows if it may be sent now. Has to be called while holding the condition.
+
+        Returns:
+            float or None: None if the request may be sent, otherwise the timestamp of the next window reset.
+
+        Raises:
+            RateLimitExceeded: If the window doesn't reset before the deadline.
+        """
+        now = time.time()
+        self.roll_windows(now)
+        if self.can_send(priority):
+            self.short_usage += 1
+            self.daily_usage += 1
+            if waited:
+                self.throttled += 1
+            return None
+        reset = self.next_reset()
+        if deadline is not None and reset > deadline:
+            self.rejected += 1
+            raise RateLimitExceeded("Strava rate limit reached.", reset - now)
+        return reset
+
+    def update_from_headers(self, headers):
+        """
+        Updates the limits and the usage with the values Strava reported in the response headers.
+        The read limits are preferred because the bot only reads from the API.
+        """
+        limit = parse_rate_limit_header(headers.get("X-ReadRateLimit-Limit")) or parse_rate_limit_header(headers.get("X-RateLimit-Limit"))
+        usage = parse_rate_limit_header(headers.get("X-ReadRateLimit-Usage")) or parse_rate_limit_header(headers.get("X-RateLimit-Usage"))
+        with self.condition:
+            self.roll_windows(time.time())
+            if limit:
+                self.short_limit, self.daily_limit = limit
+            if usage:
+                # requests that are still in flight are only counted locally, so keep the higher value
+                self.short_usage = max(self.short_usage, usage[0])
+                self.daily_usage = max(self.daily_usage, usage[1])
+            self.condition.notify_all()
+
+    def mark_exhausted(self):
+        """
+        Marks the 15 minute window as used up, e.g. after Strava answered with 429.
+        """
+        with self.condition:
+            self.roll_windows(time.time())
+            self.short_usage = max(self.short_usage, self.short_limit)
+
+    def seconds_until_reset(self):
+        """
+        Returns the seconds until the blocking window resets.
+        """
+        with self.condition:
+            return max(self.next_reset() - time.time(), 0)
+
+    def state(self):
+        """
+        Returns the current state of the governor.
+        """
+        with self.condition:
+            self.roll_windows(time.time())
+            return {
+                "short_usage": self.short_usage,
+                "short_limit": self.short_limit,
+                "short_reset": datetime.datetime.fromtimestamp(self.short_start + SHORT_WINDOW, datetime.timezone.utc).isoformat(),
+                "daily_usage": self.daily_usage,
+                "daily_limit": self.daily_limit,
+                "daily_reset": datetime.datetime.fromtimestamp(self.daily_start + 86400, datetime.timezone.utc).isoformat(),
+                "reserve": self.reserve,
+                "waiting_interactive": self.waiting[Priority.INTERACTIVE],
+                "waiting_background": self.waiting[Priority.BACKGROUND],
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+            }
+
+    def summary(self):
+        """
+        Returns a short description of the usage for the command embeds.
+        """
+        state = self.state()
+        return (f"15 min: {state['short_usage']}/{state['short_limit']}, "
+                f"daily: {state['daily_usage']}/{state['daily_limit']}")
+
+
+governor = RateGovernor()
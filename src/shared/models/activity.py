@@ -18,29 +18,41 @@ logger = logging.getLogger(__name__)
 
 class Activity:
 
+    # Thousands of activities are created for every command, slots keep them small and fast to create.
+    # Only the fields the scoring and the routes use are kept, not the raw activity.
+    __slots__ = ("id", "type", "duration", "date", "start_date", "elapsed_time",
+                 "name", "suffer_score", "kudos", "map", "distance", "elev_gain")
+
     def __init__(self, activity_data: dict):
         """
         Initializes an Activity object with the provided activity data.
 
         This method extracts the necessary information from the activity data and sets the corresponding attributes.
+        The start date is parsed once, the day of the activity is derived from it.
         """
         self.id = activity_data.get("id")
         self.type = activity_data.get("type")
-        self.duration = activity_data.get("moving_time", 0) / 60  
-        self.date = datetime.datetime.strptime(activity_data.get("start_date_local", "1900-01-01")[:10], "%Y-%m-%d")
-            
-        # Handling start_date with a default date if not present
-        start_date_local = activity_data.get("start_date_local", "1900-01-01T00:00:00Z")
-        self.start_date = datetime.datetime.strptime(start_date_local, "%Y-%m-%dT%H:%M:%SZ")
+        self.duration = activity_data.get("moving_time", 0) / 60
+
+        # Handling start_date with a default date if not present, [:19] strips the trailing Z
+        self.start_date = datetime.datetime.fromisoformat(activity_data.get("start_date_local", "1900-01-01T00:00:00Z")[:19])
+        self.date = datetime.datetime(self.start_date.year, self.start_date.month, self.start_date.day)
         self.elapsed_time = datetime.timedelta(seconds=int(activity_data.get("elapsed_time", 0)))
-            
+
         # For routes
         self.name = activity_data.get("name", "")
-        self.suffer_score = self.suffer_score = activity_data.get("suffer_score", 0)
-        self.kudos = activity_data.get("kudos_count", 0) 
-        self.map = activity_data.get("map", {})  
-        self.distance = activity_data.get("distance", 0) / 1000  
-        self.elev_gain = activity_data.get("total_elevation_gain", 0) 
+        self.suffer_score = activity_data.get("suffer_score", 0)
+        self.kudos = activity_data.get("kudos_count", 0)
+        self.map = activity_data.get("map", {})  # with the summary_polyline of the route
+        self.distance = activity_data.get("distance", 0) / 1000
+        self.elev_gain = activity_data.get("total_elevation_gain", 0)
+
+    @classmethod
+    def from_page(cls, page: list):
+        """
+        Creates the Activity objects of a page of raw activities.
+        """
+        return list(map(cls, page))
 
     def is_in_week(self, week : int):
         """
@@ -6,28 +6,58 @@ This module contains the model for athletes.
 Author: Julian Friedl
 """
 
+import asyncio
 import datetime
+import os
 import time
-import json
 import logging
+from dotenv import load_dotenv
 
 
 import src.shared.services.auth_refresh as auth_refresh
 import src.shared.services.athlete_data_controller as athlete_data_controller
-from src.shared.api.api_calls import api_request, API_CALL_TYPE
+import src.shared.services.activities_data_controller as activities_data_controller
+from src.shared.api.api_calls import api_request, async_api_request, API_CALL_TYPE
+from src.shared.api.rate_governor import Priority
+from src.shared.models.week_result import StreakTable, load_week_cache, parse_week_results
+from src.shared.services.fetch_engine import iter_pages, aiter_pages
+from src.shared.services.single_flight import AsyncSingleFlight
 from src.shared.config.log_config import setup_logging
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+
+YEAR = int(os.getenv("YEAR", datetime.date.today().year))
+
+# Seconds until cached pages of a week that isn't over yet expire
+CURRENT_WEEK_TTL = int(os.getenv("CURRENT_WEEK_TTL", 900))
+# Days before the high-water mark that every sync asks Strava for again, activities that were uploaded late
+# (e.g. from a device that synced days later) start before the mark and would be missed otherwise
+SYNC_OVERLAP_DAYS = float(os.getenv("SYNC_OVERLAP_DAYS", 7))
+# If the activities are pushed by the Strava webhook, the commands only read the activity store
+WEBHOOK_INGEST = os.getenv("WEBHOOK_INGEST", "false").lower() == "true"
+
+ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
+PER_PAGE = 200  # the api can send a max of 200 activities per request
+
+sync_flights = AsyncSingleFlight()  # syncs of the same athlete by commands that run at the same time
+
 class Athlete:
-    def __init__(self, credentials: dict):
+    def __init__(self, credentials: dict, refresh: bool = True, old_access_token: str = None):
         """
         Initializes an Athlete object with the provided credentials.
 
-        This method refreshes the access token if need be, saves the updated credentials, and sets the username and access token.
+        This method refreshes the access token if need be and sets the username and access token.
+        The credentials aren't saved here, if the token was refreshed the athlete is marked as dirty
+        and saved together with the other changed athletes with flush_athletes.
+        With refresh=False the token was already refreshed by the caller (see create), old_access_token
+        is the token from before that refresh.
         """
-        self.credentials = auth_refresh.refresh_token(credentials)
+        if old_access_token is None:
+            old_access_token = credentials['strava_data']["access_token"]
+        self.credentials = auth_refresh.refresh_token(credentials) if refresh else credentials
         self.username = self.credentials['strava_data']["athlete"]["firstname"] + " " + self.credentials['strava_data']["athlete"]["lastname"]
         self.access_token = self.credentials['strava_data']["access_token"]
         self.img = self.credentials['strava_data']["athlete"]["profile_medium"]
@@ -46,50 +76,183 @@ class Athlete:
         self.joker = self.credentials.get('vars', {}).get('joker', 0)
         self.joker_weeks = self.credentials.get('vars', {}).get('joker_weeks', [])
         self.week_results = self.credentials.get('vars', {}).get('week_results', [])
+        self.week_cache = load_week_cache(self.credentials.get('vars', {}))  # {week: WeekResult}
+        self.streak_table = None  # created on the first lookup, see get_streak_table
 
         self.discord_id = self.credentials.get('discord_user_id', 0)
 
-        athlete_data_controller.save_strava_athletes(json.dumps(self.credentials))
+        # only the changed athletes have to be saved
+        self.dirty = self.access_token != old_access_token
+        self.changed_vars = {}  # {key: changed weeks or None if the whole var changed}, see mark_dirty
+
+    @classmethod
+    async def create(cls, credentials: dict):
+        """
+        Creates an Athlete on the event loop, the access token is refreshed without blocking it.
+        """
+        old_access_token = credentials['strava_data']["access_token"]
+        await auth_refresh.refresh_token_async(credentials)
+        return cls(credentials, refresh=False, old_access_token=old_access_token)
+
+    def get_streak_table(self, start_week: int):
+        """
+        Returns the table with the consecutive missed weeks of the athlete from start_week on.
+        It is built from the week results once and then kept up to date by set_week_result.
+        """
+        if self.streak_table is None or self.streak_table.start_week != start_week:
+            self.streak_table = StreakTable(start_week, parse_week_results(self.week_results))
+        return self.streak_table
 
-    def fetch_athlete_activities(self, start_date : datetime, end_date : datetime, cache:bool = True):
+    def mark_dirty(self, key: str = None, weeks: list = None):
         """
-        Fetch all the activities in a year. The api can send a max of 200 Activities per request. 
-        By iterating over the page parameter until I either get an error or the returned data is null,
-        I get all the activities and append them to a list.
+        Marks the athlete as changed, e.g. after new week results were added.
+
+        key is the var that changed. For week_results and week_cache, weeks are the weeks that changed, only they
+        are saved, so the weeks saved by someone else in the meantime are kept. Without weeks the whole var is saved.
+        """
+        self.dirty = True
+        if key is None:
+            return
+        if weeks is None or self.changed_vars.get(key, ()) is None:
+            self.changed_vars[key] = None
+        else:
+            self.changed_vars[key] = self.changed_vars.get(key, set()) | set(weeks)
+
+    def fetch_athlete_activities(self, start_date : datetime, end_date : datetime, cache:bool = True, priority:Priority = Priority.INTERACTIVE):
+        """
+        Returns the activities of the athlete that started in the range [start_date, end_date).
+
+        The activities are streamed from the local activity store, which is synced with Strava first
+        (unless WEBHOOK_INGEST is set and the store is kept up to date by the webhook worker).
+        Backfills pass Priority.BACKGROUND, so interactive commands get the rate limit budget first.
 
         Returns:
-        activities (list of activities)
-        error_embed (discord.Embed or None): None if the request was successful, otherwise a Discord embed with the error message.
-        
+        activities (iterator of activities, the oldest one first)
+        num_of_API_requests (int): the number of requests that were sent to Strava during the sync
+        num_of_retrieve_Cache (int): the number of requests that were answered from the cache during the sync
         """
-        start_date_seconds = time.mktime(start_date.timetuple())
-        end_date_seconds = time.mktime(end_date.timetuple())
-        activities = []
-        page = 1
-        PER_PAGE = 200
-        per_page = PER_PAGE
-        end_of_results = False
-
-        num_of_API_requests = 0
-        num_of_retrieve_Cache = 0
-        while not end_of_results:
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            params = {"before": end_date_seconds, "after": start_date_seconds, "page": page, "per_page": per_page}
-            
-            data, api_call_type = api_request("https://www.strava.com/api/v3/athlete/activities", headers, params, self.username, self.user_id, cache=cache)
-            if api_call_type == API_CALL_TYPE.API:
-                num_of_API_requests += 1
-            elif api_call_type == API_CALL_TYPE.Cache:
-                num_of_retrieve_Cache += 1
-            if not data:
-                end_of_results = True
-            else:
-                activities.extend(data)
-
-                page += 1
-            
-            #check if the response is smaller than the Per_page limit, meaning that all results were retrieved
-            if len(activities) < PER_PAGE:
-                end_of_results = True
+        if WEBHOOK_INGEST and activities_data_controller.get_high_water_mark(self.user_id) is not None:
+            # the store is kept up to date by the webhook worker, only the first sync of an athlete is needed
+            num_of_API_requests, num_of_retrieve_Cache = 0, 0
+        else:
+            num_of_API_requests, num_of_retrieve_Cache = self.sync_activities(cache=cache, priority=priority)
+        activities = activities_data_controller.iter_activities(self.user_id, start_date, end_date)
         return (activities, num_of_API_requests, num_of_retrieve_Cache)
-       
\ No newline at end of file
+
+    async def fetch_athlete_activities_async(self, start_date : datetime, end_date : datetime, cache:bool = True, priority:Priority = Priority.INTERACTIVE):
+        """
+        The asyncio version of fetch_athlete_activities, the sync with Strava doesn't block the event loop.
+        Commands that fetch the same athlete at the same time share one sync.
+        """
+        if WEBHOOK_INGEST and activities_data_controller.get_high_water_mark(self.user_id) is not None:
+            num_of_API_requests, num_of_retrieve_Cache = 0, 0
+        else:
+            # concurrent commands would save the same pages to the store again, they wait for the running sync instead
+            (num_of_API_requests, num_of_retrieve_Cache), shared = await sync_flights.do(
+                (self.user_id, cache), self.sync_activities_async, cache=cache, priority=priority)
+            if shared:
+                # the requests are counted by the command that did the sync
+                num_of_API_requests, num_of_retrieve_Cache = 0, 0
+        activities = activities_data_controller.iter_activities(self.user_id, start_date, end_date)
+        return (activities, num_of_API_requests, num_of_retrieve_Cache)
+
+    def sync_activities(self, cache:bool = True, priority:Priority = Priority.INTERACTIVE):
+        """
+        Fetches the activities that started after the high-water mark of the local activity store (minus an overlap
+        of SYNC_OVERLAP_DAYS, see sync_range) and saves them. On the first sync all activities of the challenge year
+        are fetched.
+
+        The api can send a max of 200 Activities per request, so the pages are requested with iter_pages until a page
+        is not full anymore. If the first page is full the following pages are prefetched in parallel. The pages are cached for CURRENT_WEEK_TTL seconds, so repeated syncs within that time
+        don't reach Strava. With cache=False the sync always asks Strava.
+
+        Returns:
+        num_of_API_requests (int): the number of requests that were sent to Strava
+        num_of_retrieve_Cache (int): the number of requests that were answered from the cache
+        """
+        after, before, ttl = self.sync_range()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        def fetch_page(page):
+            params = {"after": after, "before": before, "page": page, "per_page": PER_PAGE}
+            return api_request(ACTIVITIES_URL, headers, params, self.username, self.user_id, cache=cache, ttl=ttl, priority=priority)
+
+        counts = SyncCounts()
+        # the pages arrive in order, so the high-water mark never skips a page that failed
+        for page, data, api_call_type in iter_pages(fetch_page, PER_PAGE):
+            counts.add(self, data, api_call_type)
+        return counts.result(self)
+
+    async def sync_activities_async(self, cache:bool = True, priority:Priority = Priority.INTERACTIVE):
+        """
+        The asyncio version of sync_activities, the pages are requested with aiter_pages and async_api_request.
+        """
+        after, before, ttl = self.sync_range()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        async def fetch_page(page):
+            params = {"after": after, "before": before, "page": page, "per_page": PER_PAGE}
+            return await async_api_request(ACTIVITIES_URL, headers, params, self.username, self.user_id, cache=cache, ttl=ttl, priority=priority)
+
+        counts = SyncCounts()
+        async for page, data, api_call_type in aiter_pages(fetch_page, PER_PAGE):
+            # saving rewrites the activity store, it runs in a thread so it doesn't hold up the event loop
+            await asyncio.to_thread(counts.add, self, data, api_call_type)
+        return counts.result(self)
+
+    def sync_range(self):
+        """
+        Returns the after and before timestamps of the next sync and the ttl of its cached pages.
+
+        The sync starts SYNC_OVERLAP_DAYS before the high-water mark (but not before the challenge year), so an
+        activity that was uploaded after a newer one was already synced is still fetched. The activities of the
+        overlap that are already stored are replaced by their id, they aren't stored twice.
+        """
+        year_start = datetime.date.fromisocalendar(YEAR, 1, 1)
+        year_end = datetime.date.fromisocalendar(YEAR + 1, 1, 1)
+        high_water_mark = activities_data_controller.get_high_water_mark(self.user_id)
+        after = time.mktime(year_start.timetuple())
+        if high_water_mark is not None:
+            after = max(after, high_water_mark - SYNC_OVERLAP_DAYS * 24 * 60 * 60)
+        before = time.mktime(year_end.timetuple())
+        # once the challenge year is over nothing changes anymore, so the pages are cached for good
+        ttl = None if year_end <= datetime.date.today() - datetime.timedelta(days=1) else CURRENT_WEEK_TTL
+        return after, before, ttl
+
+
+class SyncCounts:
+    """
+    Counts the requests of a sync and saves the synced pages.
+    """
+
+    def __init__(self):
+        self.num_of_API_requests = 0
+        self.num_of_retrieve_Cache = 0
+        self.new_activities = 0
+
+    def add(self, athlete: Athlete, data: list, api_call_type: API_CALL_TYPE):
+        if api_call_type == API_CALL_TYPE.API:
+            self.num_of_API_requests += 1
+        elif api_call_type == API_CALL_TYPE.Cache:
+            self.num_of_retrieve_Cache += 1
+        if data:
+            self.new_activities += activities_data_controller.save_activities(athlete.user_id, data)
+
+    def result(self, athlete: Athlete):
+        if self.new_activities:
+            logger.info(f"Synced {self.new_activities} new activities of {athlete.username}.")
+        return (self.num_of_API_requests, self.num_of_retrieve_Cache)
+
+
+def flush_athletes(athletes: list):
+    """
+    Saves all changed athletes with a single write and resets their dirty flag.
+    """
+    dirty_athletes = [athlete for athlete in athletes if athlete.dirty]
+    if not dirty_athletes:
+        return
+    athlete_data_controller.save_changed_athletes([athlete.credentials for athlete in dirty_athletes],
+                                                  [athlete.changed_vars for athlete in dirty_athletes])
+    for athlete in dirty_athletes:
+        athlete.dirty = False
+        athlete.changed_vars = {}
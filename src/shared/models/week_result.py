@@ -0,0 +1,184 @@
+"""
+file: week_result.py
+
+description: This module contains the model for the scored result of a week. Besides the "<week>_<result>"
+strings in the week_results of an athlete, every scored week is cached with its points and a fingerprint of the
+activities and rules that produced it, so a week only has to be scored again if one of them changed.
+
+Author: Julian Friedl
+"""
+
+PAY = 0  # not enough points, the athlete has to pay
+PASS = 1  # enough points
+JOKER = 2  # the athlete used a joker for the week
+
+
+class WeekResult:
+
+    def __init__(self, week: int, points: int, result: int, fingerprint: str):
+        self.week = week
+        self.points = points
+        self.result = result
+        self.fingerprint = fingerprint
+
+    def __eq__(self, other):
+        return isinstance(other, WeekResult) and self.to_dict() == other.to_dict() and self.week == other.week
+
+    def to_dict(self):
+        return {"points": self.points, "result": self.result, "fingerprint": self.fingerprint}
+
+    @classmethod
+    def from_dict(cls, week: int, data: dict):
+        return cls(week, data.get("points", 0), data.get("result", PAY), data.get("fingerprint"))
+
+
+def load_week_cache(athlete_vars: dict):
+    """
+    Returns the cached week results of the vars of an athlete as {week: WeekResult}.
+    """
+    return {int(week): WeekResult.from_dict(int(week), data) for week, data in athlete_vars.get("week_cache", {}).items()}
+
+
+def dump_week_cache(week_cache: dict):
+    """
+    Returns the cached week results in the format they are stored in the vars of an athlete.
+    """
+    return {str(week): week_result.to_dict() for week, week_result in sorted(week_cache.items())}
+
+
+def parse_week_results(week_results: list):
+    """
+    Parses the "<week>_<result>" strings of an athlete into a dictionary {week: result}.
+    """
+    results = {}
+    for week_result in week_results:
+        week, result = week_result.split("_")
+        results[int(week)] = int(result)
+    return results
+
+
+def format_week_result(week: int, result: int):
+    """
+    Formats a result the way it is stored in the week_results of an athlete.
+    """
+    return f"{week}_{result}"
+
+
+class StreakTable:
+    """
+    The number of consecutive missed weeks of an athlete after every week from start_week on.
+    A passed week resets the streak, a missed week increases it, joker weeks and weeks without a result keep it.
+
+    The table is updated incrementally when a result changes, so the price multiplier of a week is a single lookup.
+    """
+
+    def __init__(self, start_week: int, results: dict):
+        self.start_week = start_week
+        self.results = {week: result for week, result in results.items() if week >= start_week}
+        self.streaks = []  # streaks[i] is the streak after the week start_week + i
+        self.recalculate(start_week)
+
+    def recalculate(self, week: int):
+        """
+        Recalculates the streaks from the week on. The streak of a week only depends on the streak before it
+        and on its result, so the calculation stops at the first week whose streak didn't change.
+        """
+        last_week = max(self.results, default=self.start_week - 1)
+        week = min(week, self.start_week + len(self.streaks))
+        streak = self.streaks[week - self.start_week - 1] if week > self.start_week else 0
+        for current_week in range(week, last_week + 1):
+            result = self.results.get(current_week)
+            if result == PASS:
+                streak = 0
+            elif result == PAY:
+                streak += 1
+            index = current_week - self.start_week
+            if index < len(self.streaks):
+                if self.streaks[index] == streak and current_week > week:
+                    break
+                self.streaks[index] = streak
+            else:
+                self.streaks.append(streak)
+
+    def update(self, week: int, result: int):
+        """
+        Sets the result of the week and updates the streaks that depend on it.
+        """
+        if week < self.start_week or self.results.get(week) == result:
+            return
+        self.results[week] = result
+        self.recalculate(week)
+
+    def streak(self, week: int):
+        """
+        Returns the number of consecutive missed weeks up to and including the week.
+        """
+        index = week - self.start_week
+        if index < 0 or not self.streaks:
+            return 0
+        return self.streaks[min(index, len(self.streaks) - 1)]
+
+    def missed_before(self, week: int):
+        """
+        Returns the number of consecutive missed weeks right before the week, the exponent of its price multiplier.
+        """
+        return self.streak(week - 1)
+
+    def result(self, week: int):
+        """
+        Returns the result of the week, or None if the week wasn't scored yet.
+        """
+        return self.results.get(week)
+
+    def is_complete(self, week: int):
+        """
+        Returns True if every week from start_week up to (excluding) the week has a result.
+        """
+        return all(current_week in self.results for current_week in range(self.start_week, week))
+
+
+def replace_week_result(week_results: list, week: int, result: int):
+    """
+    Inserts or replaces the result of the week in the "<week>_<result>" strings of an athlete.
+
+    Returns:
+        bool: True if the week_results changed.
+    """
+    week_result = format_week_result(week, result)
+    for i, existing in enumerate(week_results):
+        if int(existing.split("_")[0]) == week:
+            # Week exists, replace the result
+            changed = week_results[i] != week_result
+            week_results[i] = week_result
+            return changed
+    # Week does not exist, insert new result
+    insert_pos = week - 1  # Assuming week numbers are 1-based and list is 0-based
+    week_results.insert(insert_pos, week_result)
+    return True
+
+
+def merge_week_results(stored: list, week_results: list, weeks):
+    """
+    Returns the stored week_results with the results of the given weeks taken from week_results.
+    The results of the other weeks are kept as they are stored, they might have been saved by someone else.
+    """
+    results = parse_week_results(week_results)
+    merged = list(stored)
+    for week in sorted(weeks):
+        if week in results:
+            replace_week_result(merged, week, results[week])
+    return merged
+
+
+def merge_week_cache(stored: dict, week_cache: dict, weeks):
+    """
+    Returns the stored week_cache (as it is stored in the vars) with the entries of the given weeks taken from
+    week_cache, the entries of the other weeks are kept.
+    """
+    merged = dict(stored)
+    for week in weeks:
+        if str(week) in week_cache:
+            merged[str(week)] = week_cache[str(week)]
+        else:
+            merged.pop(str(week), None)
+    return {week: merged[week] for week in sorted(merged, key=int)}
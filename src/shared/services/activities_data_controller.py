@@ -0,0 +1,178 @@
+"""
+file: activities_data_controller.py
+
+description: This module handles the local activity store. Every athlete has one file with their raw Strava
+activities and a high-water mark, the start time of the newest activity that was synced, so only the activities
+from shortly before the mark on have to be requested from Strava. The first line of the file holds the high-water mark and every following line
+one activity, oldest first, so the activities of a date range can be streamed without loading the whole file.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import json
+import os
+from dotenv import load_dotenv
+import logging
+
+from threading import Lock
+
+from src.shared.config.log_config import setup_logging
+
+file_lock = Lock()  # locking mechanism for threading
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+YEAR = int(os.getenv("YEAR", datetime.date.today().year))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DATA_PATH = os.path.join(PROJECT_ROOT, 'data')
+YEAR_PATH = os.path.join(DATA_PATH, str(YEAR))
+ACTIVITIES_PATH = os.path.join(YEAR_PATH, 'activities')
+
+
+def activities_file(athlete_id):
+    return os.path.join(ACTIVITIES_PATH, f"{athlete_id}.json")
+
+
+def start_timestamp(activity: dict):
+    """
+    Returns the UTC start of an activity as a unix timestamp, the same format Strava uses for the after parameter.
+    """
+    start_date = datetime.datetime.strptime(activity.get("start_date", "1900-01-01T00:00:00Z"), "%Y-%m-%dT%H:%M:%SZ")
+    return start_date.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def load_store(athlete_id):
+    """
+    Loads the activity store of an athlete. Has to be called while holding the lock.
+    """
+    path = activities_file(athlete_id)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'r') as file:
+            header = json.loads(file.readline())
+            if "activities" in header:
+                # older stores were a single JSON document
+                return header
+            activities = {}
+            for line in file:
+                activity = json.loads(line)
+                activities[str(activity["id"])] = activity
+            return {"high_water_mark": header["high_water_mark"], "activities": activities}
+    return {"high_water_mark": None, "activities": {}}
+
+
+def write_store(athlete_id, store: dict):
+    """
+    Writes the activity store of an athlete. Has to be called while holding the lock.
+
+    The file is replaced atomically, so streams that are reading the old file aren't affected.
+    """
+    os.makedirs(ACTIVITIES_PATH, exist_ok=True)
+    path = activities_file(athlete_id)
+    activities = sorted(store["activities"].values(), key=lambda activity: activity.get("start_date_local", ""))
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps({"high_water_mark": store["high_water_mark"]}) + "\n")
+        for activity in activities:
+            f.write(json.dumps(activity, separators=(',', ':')) + "\n")
+    os.replace(path + '.tmp', path)
+
+
+def get_high_water_mark(athlete_id):
+    """
+    Returns the start timestamp of the newest synced activity of the athlete, or None if nothing was synced yet.
+    """
+    path = activities_file(athlete_id)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'r') as file:
+        return json.loads(file.readline())["high_water_mark"]
+
+
+def save_activities(athlete_id, activities: list, advance_hwm: bool = True):
+    """
+    Inserts or replaces the activities in the store of the athlete and moves the high-water mark forward.
+
+    Only the syncs with Strava may move the mark, since the mark says that everything before it was synced.
+    Single activities pushed by the webhook are saved with advance_hwm=False, otherwise a webhook event that
+    arrives before the first sync of the year would make it look like the year was synced already.
+
+    Returns:
+        int: The number of activities that weren't in the store before.
+    """
+    if not activities:
+        return 0
+    with file_lock:
+        store = load_store(athlete_id)
+        stored = store["activities"]
+        new_activities = 0
+        high_water_mark = store["high_water_mark"]
+        for activity in activities:
+            key = str(activity["id"])
+            if key not in stored:
+                new_activities += 1
+            stored[key] = activity
+            if not advance_hwm:
+                continue
+            timestamp = start_timestamp(activity)
+            if high_water_mark is None or timestamp > high_water_mark:
+                high_water_mark = timestamp
+        store["high_water_mark"] = high_water_mark
+        write_store(athlete_id, store)
+    logger.debug(f"Stored {new_activities} new activities of athlete {athlete_id}.")
+    return new_activities
+
+
+def get_activity(athlete_id, activity_id):
+    """
+    Returns the stored activity, or None if it isn't in the store of the athlete.
+    """
+    with file_lock:
+        return load_store(athlete_id)["activities"].get(str(activity_id))
+
+
+def delete_activity(athlete_id, activity_id):
+    """
+    Removes an activity from the store of the athlete, the high-water mark stays where it is.
+
+    Returns:
+        dict: The removed activity, or None if it wasn't in the store.
+    """
+    with file_lock:
+        store = load_store(athlete_id)
+        activity = store["activities"].pop(str(activity_id), None)
+        if activity is not None:
+            write_store(athlete_id, store)
+    return activity
+
+
+def iter_activities(athlete_id, start_date: datetime.date, end_date: datetime.date):
+    """
+    Generator that yields the stored activities of the athlete that started (local time) in the range
+    [start_date, end_date), the oldest one first.
+
+    The activities are read from the file line by line, so only the activity that is currently processed
+    is in memory. No lock is needed since the file is only ever replaced, never changed in place.
+    """
+    start = start_date.isoformat()
+    end = end_date.isoformat()
+    path = activities_file(athlete_id)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'r') as file:
+        header = json.loads(file.readline())
+        if "activities" in header:
+            # older stores were a single JSON document
+            activities = sorted(header["activities"].values(), key=lambda activity: activity.get("start_date_local", ""))
+        else:
+            activities = map(json.loads, file)
+        for activity in activities:
+            date = activity.get("start_date_local", "1900-01-01")[:10]
+            if date < start:
+                continue
+            if date >= end:
+                break
+            yield activity
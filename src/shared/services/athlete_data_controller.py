@@ -15,8 +15,11 @@ import logging
 from threading import Lock
 
 from src.shared.config.log_config import setup_logging
+from src.shared.models.week_result import merge_week_results, merge_week_cache
+from src.shared.storage.backend import get_backend
 
 file_lock = Lock()  # locking mechanism for threading
+write_count = 0  # number of writes to the storage backend, exposed in the metrics
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -28,7 +31,6 @@ YEAR = int(os.getenv("YEAR", datetime.date.today().year))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 DATA_PATH = os.path.join(PROJECT_ROOT, 'data')
 YEAR_PATH = os.path.join(DATA_PATH, str(YEAR))
-ATHLETES = os.path.join(YEAR_PATH, 'athletes.json')
 RULES_TEMPLATE = os.path.join(PROJECT_ROOT, 'rules_template.json')
 GLOBAL_RULES_FILE = os.path.join(YEAR_PATH, 'global_rules.json')  # Path to the global_rules.json
 
@@ -38,6 +40,7 @@ def load_global_rules():
     if not os.path.exists(GLOBAL_RULES_FILE) or os.path.getsize(GLOBAL_RULES_FILE) == 0:
         with open(RULES_TEMPLATE, 'r') as template_file:
             rules_data = json.load(template_file)
+        os.makedirs(YEAR_PATH, exist_ok=True)
         with open(GLOBAL_RULES_FILE, 'w') as global_rules_file:
             json.dump(rules_data, global_rules_file, indent=4)
         data = rules_data
@@ -46,23 +49,23 @@ def load_global_rules():
             data = json.load(global_rules_file)
     return data['constants']
 
-# Load the constants from the rules_preset.json
-constants = load_global_rules()
-
 # Example usage in save_strava_athletes function
 def save_strava_athletes(response: json = None, discord_user_id: str = None):
     """
-    Saves user athletes to a file.
+    Saves user athletes to the storage backend.
 
-    This function takes a JSON string containing user athletes, 
-    checks if a file for the user already exists, and either appends to or overwrites the file.
+    This function takes a JSON string containing user athletes,
+    checks if the athlete already exists, and either adds the athlete or updates their Strava data.
     """
     #clear_week_results()
+    global write_count
     with file_lock:
         logger.info("Saving Credentials.")
         if response:
             json_response = json.loads(response)
 
+        # the rules are read when an athlete registers, importing this module doesn't touch the data directory
+        constants = load_global_rules()
         athlete_constants = {
             "rules": constants['RULES'],
             "points_required": constants['POINTS_REQUIRED'],
@@ -90,93 +93,116 @@ def save_strava_athletes(response: json = None, discord_user_id: str = None):
         athlete['vars'] = athlete_vars
         athlete['discord_user_id'] = discord_user_id
 
-        data = load_or_create_athletes_dir()
-
-        # Update or append the new athletes
-        for existing_cred in data:
+        # Update the existing athlete or add the new one
+        for existing_cred in get_backend().load_athletes(YEAR):
             if existing_cred['strava_data']['athlete']['id'] == athlete['strava_data']['athlete']['id']:
                 existing_cred['strava_data'] = athlete['strava_data']
                 if athlete['discord_user_id']:
                     existing_cred['discord_user_id'] = athlete['discord_user_id']
+                athlete = existing_cred
                 break
-        else:
-            data.append(athlete)
 
-        with open(ATHLETES, 'w') as f:
-            json.dump(data, f, default=serialize, indent=4)
+        get_backend().save_athlete(YEAR, athlete)
+        write_count += 1
 
 
 def update_athlete_vars(athlete: dict):
+    global write_count
     with file_lock:
-        data = load_or_create_athletes_dir()
-        for existing_cred in data:
+        for existing_cred in get_backend().load_athletes(YEAR):
             if existing_cred['strava_data']['athlete']['id'] == athlete['strava_data']['athlete']['id']:
                 if athlete['vars']:
                     existing_cred['vars'] = athlete['vars']
+                get_backend().save_athlete(YEAR, existing_cred)
+                write_count += 1
                 break
-        with open(ATHLETES, 'w') as f:
-            json.dump(data, f, default=serialize, indent=4)
+
+
+def merge_vars(existing_vars: dict, athlete_vars: dict, changed_vars: dict):
+    """
+    Copies the changed vars of an athlete into the stored ones. For the keys with changed weeks only those weeks
+    of week_results and week_cache are copied, everything else that is stored is kept.
+    """
+    for key, weeks in changed_vars.items():
+        if key not in athlete_vars:
+            continue
+        if weeks is None:
+            existing_vars[key] = athlete_vars[key]
+        elif key == "week_results":
+            existing_vars[key] = merge_week_results(existing_vars.get(key, []), athlete_vars[key], weeks)
+        elif key == "week_cache":
+            existing_vars[key] = merge_week_cache(existing_vars.get(key, {}), athlete_vars[key], weeks)
+
+
+def save_changed_athletes(athletes: list, changed_vars: list = None):
+    """
+    Saves the Strava data and the vars of multiple athletes with a single write.
+
+    This function is used to flush all athletes that were changed during a command at once,
+    e.g. because their token was refreshed or new week results were added.
+    changed_vars holds the changed vars of every athlete (see Athlete.mark_dirty), only they are merged into
+    the stored vars, so the changes of another command in the meantime aren't overwritten.
+    """
+    global write_count
+    if not athletes:
+        return
+    if changed_vars is None:
+        changed_vars = [{} for _ in athletes]
+    with file_lock:
+        existing_creds = {cred['strava_data']['athlete']['id']: cred for cred in get_backend().load_athletes(YEAR)}
+        changed_creds = []
+        for athlete, athlete_changed_vars in zip(athletes, changed_vars):
+            existing_cred = existing_creds.get(athlete['strava_data']['athlete']['id'])
+            if existing_cred is None:
+                continue
+            # never replace a token with an older one, it might have been refreshed in the background
+            if athlete['strava_data']['expires_at'] >= existing_cred['strava_data']['expires_at']:
+                existing_cred['strava_data'] = athlete['strava_data']
+            if athlete.get('vars') and athlete_changed_vars:
+                merge_vars(existing_cred.setdefault('vars', {}), athlete['vars'], athlete_changed_vars)
+            changed_creds.append(existing_cred)
+        if changed_creds:
+            get_backend().save_athletes(YEAR, changed_creds)
+            write_count += 1
+    logger.info(f"Saved {len(changed_creds)} changed athletes.")
+
 
 def clear_week_results():
     """
-    Resets the week_results.
+    Resets the week_results and the cached week results, so every week is scored again.
     """
+    global write_count
     with file_lock:
-        data = load_or_create_athletes_dir()
+        data = get_backend().load_athletes(YEAR)
         for existing_cred in data:
             existing_cred["vars"]["week_results"] = []
-        with open(ATHLETES, 'w') as f:
-            json.dump(data, f, default=serialize, indent=4)
-
-
-def load_or_create_athletes_dir():
-    # Create the data directory if it doesn't exist
-    if not os.path.exists(DATA_PATH):
-        os.makedirs(DATA_PATH)
-    
-    if not os.path.exists(YEAR_PATH):
-        os.makedirs(YEAR_PATH)
-
-    # Load existing data or initialize it
-    if os.path.exists(ATHLETES) and os.path.getsize(ATHLETES) > 0:
-        with open(ATHLETES, 'r') as file:
-            data = json.load(file)
-    else:
-        data = []
-
-    return data
+            existing_cred["vars"]["week_cache"] = {}
+        get_backend().save_athletes(YEAR, data)
+        write_count += 1
 
 
 def load_athletes():
     """
-    Loads user athletes from a file.
+    Loads user athletes from the storage backend.
 
-    This function checks if a file with user athletes exists, and if so, loads and returns the athletes.
+    This function returns the athletes, or None if there are no athletes registered.
     """
     with file_lock:
-        if os.path.exists(ATHLETES) and os.path.getsize(ATHLETES) != 0:
-            with open(ATHLETES, 'r') as f:
-                athletes = json.load(f)
-            return athletes
-        return None
+        athletes = get_backend().load_athletes(YEAR)
+    return athletes or None
 
 
-def serialize(obj):
+def load_athlete_ids():
+    """
+    Returns the Strava ids of the registered athletes.
     """
-    Serializes an object to be saved to a file.
+    with file_lock:
+        return {cred['strava_data']['athlete']['id'] for cred in get_backend().load_athletes(YEAR)}
+
 
-    This function converts set and bytes objects to lists and strings respectively, 
-    and recursively applies itself to elements of dictionaries, lists, and tuples.
+def load_athlete_by_discord_id(discord_user_id: str):
     """
-    if isinstance(obj, set):
-        return list(obj)
-    elif isinstance(obj, bytes):
-        return obj.decode('utf-8')
-    elif isinstance(obj, dict):
-        return {str(k): serialize(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple)):
-        return [serialize(i) for i in obj]
-    elif isinstance(obj, datetime.datetime):
-        return obj.isoformat()
-    else:
-        return obj
+    Loads the athlete with the discord id from the storage backend, or returns None if they aren't registered.
+    """
+    with file_lock:
+        return get_backend().load_athlete_by_discord_id(YEAR, discord_user_id)
@@ -1,9 +1,12 @@
+import asyncio
 import os
-import requests
 import time
 import logging
+from threading import Lock
 
 from dotenv import load_dotenv
+import src.shared.api.http_client as http_client
+import src.shared.api.async_http_client as async_http_client
 from src.shared.config.log_config import setup_logging
 
 
@@ -14,51 +17,108 @@ load_dotenv()
 STRAVA_CLIENT_ID = os.getenv('STRAVA_CLIENT_ID')
 STRAVA_CLIENT_SECRETE = os.getenv('STRAVA_CLIENT_SECRETE')
 
-def refresh_token(cred:dict):
-    # Get the access token, refresh token and expiration date from the credential dictionary
-    refresh_token = cred['strava_data']['refresh_token']
-    expires_at = cred['strava_data']['expires_at']
+locks_lock = Lock()
+athlete_locks = {}  # one lock per athlete id, so a token is never refreshed twice at the same time
+latest_tokens = {}  # the newest access token, refresh token and expiration date per athlete id
 
-    # Get the current time in seconds
-    current_time = time.time()
+def get_athlete_lock(athlete_id: int):
+    """
+    Returns the lock that serializes the token refreshes of an athlete.
+    """
+    with locks_lock:
+        return athlete_locks.setdefault(athlete_id, Lock())
 
+def refresh_token(cred:dict, margin:int = 60):
+    """
+    Refreshes the access token of the credentials if it expires within margin seconds.
+
+    The refreshes of an athlete are serialized, if the token was already refreshed by someone else
+    (e.g. the background token refresher) the newer token is taken over instead of refreshing it again.
+    """
+    athlete_id = cred['strava_data']['athlete']['id']
+    with get_athlete_lock(athlete_id):
+        latest = latest_tokens.get(athlete_id)
+        if latest and latest['expires_at'] > cred['strava_data']['expires_at']:
+            cred['strava_data'].update(latest)
+        return refresh_locked(cred, athlete_id, margin)
+
+async def refresh_token_async(cred:dict, margin:int = 60):
+    """
+    The asyncio version of refresh_token. The lock of the athlete is shared with refresh_token, it is polled
+    instead of waited for, so a refresh in another thread doesn't block the event loop.
+    """
+    athlete_id = cred['strava_data']['athlete']['id']
+    lock = get_athlete_lock(athlete_id)
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(0.05)
+    try:
+        latest = latest_tokens.get(athlete_id)
+        if latest and latest['expires_at'] > cred['strava_data']['expires_at']:
+            cred['strava_data'].update(latest)
+        if not expires_soon(cred, margin):
+            logger.info("Token is still valid.")
+            return cred
+        logger.info("Refreshing token...")
+        response = await async_http_client.post('https://www.strava.com/oauth/token', data=refresh_data(cred))
+        return apply_refresh_response(cred, athlete_id, response)
+    finally:
+        lock.release()
+
+def expires_soon(cred:dict, margin:int):
+    """
+    Returns True if the access token is expired or will expire within margin seconds.
+    """
+    return time.time() > cred['strava_data']['expires_at'] - margin
+
+def refresh_data(cred:dict):
+    """
+    Returns the form data of the request that refreshes the access token.
+    """
+    return {
+        'client_id': STRAVA_CLIENT_ID,
+        'client_secret': STRAVA_CLIENT_SECRETE,
+        'grant_type': 'refresh_token',
+        'refresh_token': cred['strava_data']['refresh_token']
+    }
+
+def refresh_locked(cred:dict, athlete_id:int, margin:int):
     # Check if the access token is expired or will expire soon
-    if current_time > expires_at - 60:
+    if expires_soon(cred, margin):
         # The access token is expired or will expire soon, so we need to refresh it
         logger.info("Refreshing token...")
 
-        # Set up the data for the api call
-        data = {
-            'client_id': STRAVA_CLIENT_ID,
-            'client_secret': STRAVA_CLIENT_SECRETE,
-            'grant_type': 'refresh_token',
-            'refresh_token': refresh_token
-        }
-
         # Make the api call to get a new access token
-        response = requests.post('https://www.strava.com/oauth/token', data=data)
-
-        # Check if the response is successful
-        if response.status_code == 200:
-            # Parse the response data as a dictionary
-            data = response.json()
-
-            # Get the new access token, refresh token and expiration date from the response data
-            new_access_token = data['access_token']
-            new_refresh_token = data['refresh_token']
-            new_expires_at = data['expires_at']
-
-            # Update the credential dictionary with the new values
-            cred['strava_data']['access_token'] = new_access_token
-            cred['strava_data']['refresh_token'] = new_refresh_token
-            cred['strava_data']['expires_at'] = new_expires_at
-
-            logger.info("Token refreshed successfully.")
-        else:
-            # Handle unsuccessful response
-            logger.error(f"Error: Could not refresh token. Status code: {response.status_code}")
+        response = http_client.post('https://www.strava.com/oauth/token', data=refresh_data(cred))
+        apply_refresh_response(cred, athlete_id, response)
     else:
         # The access token is still valid, so we don't need to refresh it
         logger.info("Token is still valid.")
 
     return cred
+
+def apply_refresh_response(cred:dict, athlete_id:int, response):
+    """
+    Takes the new tokens of a successful refresh response over into the credentials.
+    """
+    # Check if the response is successful
+    if response.status_code == 200:
+        # Parse the response data as a dictionary
+        data = response.json()
+
+        # Get the new access token, refresh token and expiration date from the response data
+        new_access_token = data['access_token']
+        new_refresh_token = data['refresh_token']
+        new_expires_at = data['expires_at']
+
+        # Update the credential dictionary with the new values
+        cred['strava_data']['access_token'] = new_access_token
+        cred['strava_data']['refresh_token'] = new_refresh_token
+        cred['strava_data']['expires_at'] = new_expires_at
+        latest_tokens[athlete_id] = {'access_token': new_access_token, 'refresh_token': new_refresh_token, 'expires_at': new_expires_at}
+
+        logger.info("Token refreshed successfully.")
+    else:
+        # Handle unsuccessful response
+        logger.error(f"Error: Could not refresh token. Status code: {response.status_code}")
+
+    return cred
@@ -0,0 +1,156 @@
+"""
+file: fetch_engine.py
+
+description: This module runs the per-athlete work of a command (token refresh, activity fetching, scoring)
+concurrently on a bounded thread pool, and pages through paginated Strava endpoints with speculative prefetching.
+The commands on the event loop of the bot use the asyncio versions, which are bounded by a semaphore instead.
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Maximum number of athletes that are processed at the same time
+FETCH_CONCURRENCY = max(int(os.getenv("FETCH_CONCURRENCY", 8)), 1)
+# Number of pages that are requested in parallel once the first page of a paginated request came back full
+PAGE_PREFETCH = max(int(os.getenv("PAGE_PREFETCH", 3)), 1)
+
+
+def map_athletes(worker, creds: list, max_workers: int = FETCH_CONCURRENCY):
+    """
+    Runs worker(cred) for every credential on a bounded thread pool.
+
+    The results are returned in the same order as the credentials. If a worker raises an exception
+    (e.g. a CustomAPIError with its error embed) it is re-raised here, so the callers keep the same
+    error handling as with the sequential loop.
+
+    Args:
+        worker (callable): Function that takes a single credential dict.
+        creds (list): The loaded athlete credentials.
+        max_workers (int): Upper bound for the number of concurrently processed athletes.
+
+    Returns:
+        list: The results of the worker for each credential.
+    """
+    if not creds:
+        return []
+    workers = min(max_workers, len(creds))
+    logger.debug(f"Processing {len(creds)} athletes with {workers} workers.")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor:
+        futures = [executor.submit(worker, cred) for cred in creds]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            # don't start the remaining athletes if one of them already failed
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def iter_pages(fetch_page, per_page: int, prefetch: int = PAGE_PREFETCH):
+    """
+    Generator that yields the pages of a paginated request in order, until the last page was reached.
+
+    The first page is requested alone. If it came back full, the next prefetch pages are requested in
+    parallel, and so on until a page is not full anymore. That page is the last one, the pages that were
+    requested speculatively after it are empty and dropped. The pages are yielded as soon as they (and all
+    pages before them) arrived, so the caller can process them while the rest is still loading. If a page
+    fails the exception is raised after the pages before it were yielded.
+
+    Args:
+        fetch_page (callable): Function that takes the page number (starting at 1) and returns (data, info),
+            where data is the list of entries of the page and info is passed through to the caller.
+        per_page (int): The requested page size, a page with fewer entries is the last one.
+        prefetch (int): Max number of pages that are requested at the same time.
+
+    Yields:
+        tuple: (page, data, info) for every page up to and including the last one.
+    """
+    data, info = fetch_page(1)
+    yield 1, data, info
+    if not data or len(data) < per_page:
+        return
+
+    next_page = 2
+    with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="page") as executor:
+        futures = []
+        try:
+            while True:
+                futures = [(page, executor.submit(fetch_page, page)) for page in range(next_page, next_page + prefetch)]
+                next_page += prefetch
+                for page, future in futures:
+                    data, info = future.result()
+                    yield page, data, info
+                    if not data or len(data) < per_page:
+                        return
+        finally:
+            # the speculative requests after the last (or a failed) page aren't needed anymore
+            for _, future in futures:
+                future.cancel()
+
+
+async def gather_athletes(worker, creds: list, max_concurrency: int = FETCH_CONCURRENCY):
+    """
+    The asyncio version of map_athletes: awaits worker(cred) for every credential, with at most
+    max_concurrency athletes in progress at the same time.
+
+    The results are returned in the same order as the credentials. If a worker raises an exception
+    the other workers are cancelled and the exception is re-raised.
+    """
+    if not creds:
+        return []
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(cred):
+        async with semaphore:
+            return await worker(cred)
+
+    tasks = [asyncio.ensure_future(bounded(cred)) for cred in creds]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # don't continue with the remaining athletes if one of them already failed
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def aiter_pages(fetch_page, per_page: int, prefetch: int = PAGE_PREFETCH):
+    """
+    The asyncio version of iter_pages, fetch_page is a coroutine function here.
+    The speculative pages are requested as tasks on the event loop instead of on a thread pool.
+
+    Yields:
+        tuple: (page, data, info) for every page up to and including the last one.
+    """
+    data, info = await fetch_page(1)
+    yield 1, data, info
+    if not data or len(data) < per_page:
+        return
+
+    next_page = 2
+    tasks = []
+    try:
+        while True:
+            tasks = [(page, asyncio.ensure_future(fetch_page(page))) for page in range(next_page, next_page + prefetch)]
+            next_page += prefetch
+            for page, task in tasks:
+                data, info = await task
+                yield page, data, info
+                if not data or len(data) < per_page:
+                    return
+    finally:
+        # the speculative requests after the last (or a failed) page aren't needed anymore
+        for _, task in tasks:
+            task.cancel()
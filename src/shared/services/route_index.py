@@ -0,0 +1,162 @@
+"""
+file: route_index.py
+
+description: This module contains the spatial index of the routes. Every route gets a bounding box when it is
+saved, the routes of a year are put into a grid of ROUTE_GRID_SIZE degree cells by their bounding box. A query
+for the routes that intersect a viewport only looks at the cells the viewport covers, so zooming into a small
+area doesn't go through all routes of the year. Routes that would cover more than ROUTE_INDEX_MAX_CELLS cells,
+e.g. a flight recorded as an activity, aren't put into the grid but checked by every query.
+
+The index of a year is built on the first query and kept in memory until the routes of the year change.
+
+Author: Julian Friedl
+"""
+
+import math
+import os
+import logging
+from threading import Lock
+from dotenv import load_dotenv
+
+import src.shared.services.route_lod as route_lod
+from src.shared.storage.backend import get_backend
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+ROUTE_GRID_SIZE = float(os.getenv("ROUTE_GRID_SIZE", 0.1))  # edge length of a grid cell in degrees
+ROUTE_INDEX_MAX_CELLS = int(os.getenv("ROUTE_INDEX_MAX_CELLS", 400))  # max grid cells of a single route
+
+
+def bounding_box(points: list):
+    """
+    Returns the bounding box [west, south, east, north] of (lat, lng) points, or None if there are none.
+    """
+    if not points:
+        return None
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    return [min(lngs), min(lats), max(lngs), max(lats)]
+
+
+def intersects(a: list, b: list):
+    """
+    Returns True if the bounding boxes [west, south, east, north] overlap (touching counts).
+    """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def parse_bbox(value: str):
+    """
+    Parses a "west,south,east,north" parameter in degrees.
+
+    Raises:
+        ValueError: If the value isn't four numbers with west <= east and south <= north.
+    """
+    bbox = [float(part) for part in value.split(",")]
+    if len(bbox) != 4 or not all(math.isfinite(part) for part in bbox) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError(f"Invalid bounding box: {value}")
+    return bbox
+
+
+class RouteIndex:
+    """
+    Grid index over the routes of one year, in the format of routes.json.
+    """
+
+    def __init__(self, year_data: dict, cell_size: float = ROUTE_GRID_SIZE, max_cells: int = ROUTE_INDEX_MAX_CELLS):
+        self.data = year_data
+        self.cell_size = cell_size
+        self.cells = {}  # (column, row) -> list of (athlete key, route position)
+        self.boxes = {}  # (athlete key, route position) -> bounding box
+        self.oversized = []  # routes that cover more than max_cells cells, every query checks them
+        for athlete_key, athlete_data in year_data.get("athletes", {}).items():
+            for position, route in enumerate(athlete_data.get("routes", [])):
+                bbox = route.get("bbox")
+                if bbox is None and "bbox" not in route:
+                    # routes saved before the bounding boxes existed
+                    bbox = bounding_box(route_lod.decode((route.get("map") or {}).get("summary_polyline")))
+                if bbox is None:
+                    continue
+                entry = (athlete_key, position)
+                self.boxes[entry] = bbox
+                if self.cell_count(bbox) > max_cells:
+                    self.oversized.append(entry)
+                    continue
+                for cell in self.cells_of(bbox):
+                    self.cells.setdefault(cell, []).append(entry)
+
+    def cell_count(self, bbox: list):
+        """
+        Returns the number of grid cells the bounding box covers.
+        """
+        west, south, east, north = (math.floor(value / self.cell_size) for value in bbox)
+        return (east - west + 1) * (north - south + 1)
+
+    def cells_of(self, bbox: list):
+        """
+        Returns the grid cells the bounding box covers.
+        """
+        west, south, east, north = (math.floor(value / self.cell_size) for value in bbox)
+        return ((column, row) for column in range(west, east + 1) for row in range(south, north + 1))
+
+    def query(self, bbox: list):
+        """
+        Returns the positions of the routes that intersect the bounding box as {athlete key: [route positions]}.
+        """
+        west, south, east, north = (math.floor(value / self.cell_size) for value in bbox)
+        if self.cell_count(bbox) > len(self.cells):
+            # the viewport covers more cells than there are filled ones, go through the filled ones instead
+            cells = [(cell, entries) for cell, entries in self.cells.items()
+                     if west <= cell[0] <= east and south <= cell[1] <= north]
+        else:
+            cells = [(cell, self.cells[cell]) for cell in self.cells_of(bbox) if cell in self.cells]
+
+        matches = {}
+        if sum(len(entries) for _, entries in cells) > len(self.boxes) // 4:
+            # large viewports: checking every route once is faster than going through a large share of them per cell
+            for entry, box in self.boxes.items():
+                if intersects(box, bbox):
+                    matches.setdefault(entry[0], []).append(entry[1])
+            cells = []
+        else:
+            for entry in self.oversized:
+                if intersects(self.boxes[entry], bbox):
+                    matches.setdefault(entry[0], []).append(entry[1])
+        for cell, entries in cells:
+            for entry in entries:
+                box = self.boxes[entry]
+                if not intersects(box, bbox):
+                    continue
+                # a route is in every cell it covers, it is only reported in the cell of the south west
+                # corner of its overlap with the viewport
+                if (math.floor(max(box[0], bbox[0]) / self.cell_size), math.floor(max(box[1], bbox[1]) / self.cell_size)) == cell:
+                    matches.setdefault(entry[0], []).append(entry[1])
+        for positions in matches.values():
+            positions.sort()  # keep the order of the routes
+        return matches
+
+
+index_lock = Lock()
+indexes = {}  # year -> (routes version, RouteIndex)
+
+
+def get_index(year: int):
+    """
+    Returns the index of the routes of the year, it is built again if the routes changed since the last query.
+    """
+    version = get_backend().routes_version(year)
+    with index_lock:
+        cached = indexes.get(year)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    index = RouteIndex(get_backend().load_routes(year))
+    logger.info(f"Built the route index of {year} with {len(index.boxes)} routes in {len(index.cells)} cells "
+                f"({len(index.oversized)} too large for the grid).")
+    with index_lock:
+        indexes[year] = (version, index)
+    return index
@@ -0,0 +1,176 @@
+"""
+file: route_lod.py
+
+description: This module creates the level-of-detail tiers of the route polylines. When a route is saved its
+summary polyline is decoded once and simplified with the Douglas-Peucker algorithm at the tolerances of the tiers,
+the simplified polylines are stored with the route. The map API sends the tier that fits the zoom level of the
+map instead of the full polyline of every route.
+
+decode_many decodes the polylines of many routes at once with NumPy, for the heatmap tiles.
+
+Author: Julian Friedl
+"""
+
+import math
+import logging
+import polyline
+import numpy as np
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Max distance in meters between a simplified polyline and the original one
+LOD_TOLERANCES = {"low": 50, "medium": 10}
+DETAIL_LEVELS = ("low", "medium", "full")
+
+METERS_PER_DEGREE = 111320  # length of a degree of latitude
+
+
+def simplify(points: list, tolerance: float):
+    """
+    Simplifies a line with the Douglas-Peucker algorithm.
+
+    The points are projected onto a plane around the first point (longitude scaled by the cosine of the
+    latitude), which is accurate enough for the length of an activity. The first and the last point are kept.
+
+    Args:
+        points (list): (lat, lng) tuples.
+        tolerance (float): Max distance in meters between the simplified and the original line.
+
+    Returns:
+        list: The kept points, in their original order.
+    """
+    if len(points) < 3:
+        return list(points)
+
+    lng_scale = math.cos(math.radians(points[0][0]))
+    xs = [lng * lng_scale * METERS_PER_DEGREE for _, lng in points]
+    ys = [lat * METERS_PER_DEGREE for lat, _ in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, len(points) - 1)]
+    # iterative instead of recursive, long activities would exceed the recursion limit
+    while stack:
+        first, last = stack.pop()
+        x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        max_distance_sq, index = -1.0, first
+        for i in range(first + 1, last):
+            if length_sq == 0:
+                distance_sq = (xs[i] - x1) ** 2 + (ys[i] - y1) ** 2
+            else:
+                # squared distance to the segment, not the infinite line, so loops back to the start are kept
+                t = max(0.0, min(1.0, ((xs[i] - x1) * dx + (ys[i] - y1) * dy) / length_sq))
+                distance_sq = (xs[i] - x1 - t * dx) ** 2 + (ys[i] - y1 - t * dy) ** 2
+            if distance_sq > max_distance_sq:
+                max_distance_sq, index = distance_sq, i
+        if max_distance_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def decode(summary_polyline: str):
+    """
+    Decodes a polyline into (lat, lng) tuples, an invalid polyline gives no points.
+    """
+    try:
+        return polyline.decode(summary_polyline or "")
+    except (ValueError, IndexError, TypeError) as e:
+        logger.warning(f"Could not decode a polyline: {e}")
+        return []
+
+
+def decode_each(summary_polylines: list):
+    """
+    Decodes the polylines one by one, in the format of decode_many.
+    """
+    decoded = [decode(value) for value in summary_polylines]
+    points = np.array([point for path in decoded for point in path], dtype=np.float64).reshape(-1, 2)
+    return points, np.repeat(np.arange(len(decoded)), [len(path) for path in decoded])
+
+
+def decode_many(summary_polylines: list):
+    """
+    Decodes many polylines at once with NumPy, much faster than decoding them one by one.
+
+    Returns:
+        tuple: ((n, 2) array of the (lat, lng) points of all polylines, one after the other,
+        array of the index of the polyline of every point). Invalid polylines give no points.
+    """
+    summary_polylines = [value or "" for value in summary_polylines]
+    try:
+        data = np.frombuffer("".join(summary_polylines).encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        data = None
+    lengths = np.array([len(value) for value in summary_polylines], dtype=np.int64)
+    ends = np.cumsum(lengths)
+
+    if data is None or len(data) == 0 or data.min() < 0 or data.max() > 63 or not (data[ends[lengths > 0] - 1] < 0x20).all():
+        # not ascii, outside of the alphabet or a cut off value, find the invalid ones one by one
+        return decode_each(summary_polylines)
+
+    # every value is a run of 5 bit chunks, the last chunk of a value has the continuation bit 0x20 unset
+    last_chunk = data < 0x20
+    value_starts = np.flatnonzero(np.concatenate(([True], last_chunk[:-1])))
+    chunk = np.arange(len(data)) - np.repeat(value_starts, np.diff(np.append(value_starts, len(data))))
+    values = np.add.reduceat((data & 0x1f) << (5 * chunk), value_starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)  # zigzag encoded signs
+
+    # the values of a polyline alternate between latitude and longitude deltas
+    value_polyline = np.searchsorted(ends, value_starts, side="right")
+    counts = np.bincount(value_polyline, minlength=len(summary_polylines))
+    if (counts % 2).any():
+        return decode_each(summary_polylines)
+    deltas = values.reshape(-1, 2)
+    point_polyline = value_polyline[::2]
+    totals = np.cumsum(deltas, axis=0)
+    # the deltas start again at 0 with every polyline
+    first = np.searchsorted(point_polyline, np.arange(len(summary_polylines)))
+    before = np.vstack(([0, 0], totals))[first]
+    points = (totals - np.repeat(before, counts // 2, axis=0)) / 1e5
+    return points, point_polyline
+
+
+def build_tiers(points: list):
+    """
+    Returns the simplified polylines of all tiers as {tier: encoded polyline}.
+    The full tier is the summary polyline itself, it isn't stored twice.
+    """
+    return {tier: polyline.encode(simplify(points, tolerance)) for tier, tolerance in LOD_TOLERANCES.items()}
+
+
+def route_at_detail(route: dict, detail: str):
+    """
+    Returns a copy of the route as it is sent to the map, with the polyline of the detail level and without the
+    tiers, the bounding box and the statistics.
+    Routes that were saved before the tiers existed are simplified here.
+    """
+    route = dict(route)
+    tiers = route.pop("lod", None)
+    route.pop("bbox", None)  # only used by the spatial index
+    route.pop("stats", None)  # only used by the leaderboards
+    if detail != "full":
+        if tiers is None:
+            tiers = build_tiers(decode((route.get("map") or {}).get("summary_polyline")))
+        if detail in tiers:
+            route["map"] = dict(route.get("map") or {}, summary_polyline=tiers[detail])
+    return route
+
+
+def detail_for_zoom(zoom: float):
+    """
+    Returns the detail level for a zoom level of the web map. At zoom 11 a pixel is about 75 m
+    and at zoom 14 about 10 m (at the equator, less further north), so the error of a tier is about a pixel at most.
+    """
+    if zoom <= 11:
+        return "low"
+    if zoom <= 14:
+        return "medium"
+    return "full"
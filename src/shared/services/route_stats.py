@@ -0,0 +1,193 @@
+"""
+file: route_stats.py
+
+description: This module precomputes the statistics of a route when it is saved, from the polyline that is decoded
+once for the level-of-detail tiers and the bounding box anyway: the start and end point, the point furthest from
+the start, the straight-line span (the distance from the start to that point) and the coarse grid cells of
+COVERAGE_CELL_SIZE degrees the route passes through. They are stored with the route as "stats".
+
+The leaderboards (unique cells visited, explored area and furthest from home) are computed from the stored
+statistics with NumPy, without decoding a polyline. They are kept in memory until the routes of the year change.
+
+Author: Julian Friedl
+"""
+
+import base64
+import logging
+import zlib
+from threading import Lock
+
+import numpy as np
+
+import src.shared.services.route_lod as route_lod
+from src.shared.storage.backend import get_backend
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8  # mean radius in meters
+COVERAGE_CELL_SIZE = 0.01  # degrees, about 1.1 km north-south. Stored cell ids depend on it, don't change it
+COVERAGE_COLUMNS = round(360 / COVERAGE_CELL_SIZE)
+METERS_PER_DEGREE = 111320  # length of a degree of latitude
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Returns the great-circle distance in meters between points in degrees, for scalars or NumPy arrays.
+    It is within 0.5 % of the geodesic distance on the ellipsoid, which is plenty for the statistics.
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def cell_ids(lats: np.ndarray, lngs: np.ndarray):
+    """
+    Returns the ids of the coverage cells of points (row * COVERAGE_COLUMNS + column).
+    """
+    rows = np.floor((np.asarray(lats) + 90) / COVERAGE_CELL_SIZE).astype(np.int64)
+    columns = np.floor((np.asarray(lngs) + 180) / COVERAGE_CELL_SIZE).astype(np.int64) % COVERAGE_COLUMNS
+    return rows * COVERAGE_COLUMNS + columns
+
+
+def cell_area(cells: np.ndarray):
+    """
+    Returns the area of coverage cells in km², the cells get narrower towards the poles.
+    """
+    center_lats = (np.asarray(cells) // COVERAGE_COLUMNS + 0.5) * COVERAGE_CELL_SIZE - 90
+    side = COVERAGE_CELL_SIZE * METERS_PER_DEGREE / 1000
+    return side * side * np.cos(np.radians(center_lats))
+
+
+def coverage(points: np.ndarray):
+    """
+    Returns the sorted ids of the cells a line of (lat, lng) points passes through, including the cells a segment
+    only crosses between two points of the polyline. Every segment is split where it crosses a grid line, the
+    middle of every piece lies in one of the cells.
+    """
+    if len(points) < 2:
+        return np.unique(cell_ids(points[:, 0], points[:, 1]))
+    # in cell units, the grid lines are at the integers
+    u = (points[:, 1] + 180) / COVERAGE_CELL_SIZE
+    v = (points[:, 0] + 90) / COVERAGE_CELL_SIZE
+
+    segments = np.arange(len(points) - 1)
+    pieces = [(segments, np.zeros(len(segments))), (segments, np.ones(len(segments)))]
+    for start, end in ((u[:-1], u[1:]), (v[:-1], v[1:])):
+        # the grid lines between the start and the end of every segment
+        first, last = np.floor(np.minimum(start, end)) + 1, np.floor(np.maximum(start, end))
+        crossings = np.maximum(last - first + 1, 0).astype(np.int64)
+        segment = np.repeat(segments, crossings)
+        line = np.repeat(first, crossings) + np.arange(len(segment)) - np.repeat(np.cumsum(crossings) - crossings, crossings)
+        pieces.append((segment, (line - start[segment]) / (end - start)[segment]))
+    segment = np.concatenate([piece[0] for piece in pieces])
+    t = np.concatenate([piece[1] for piece in pieces])
+    order = np.lexsort((t, segment))
+    segment, t = segment[order], t[order]
+
+    same = segment[1:] == segment[:-1]
+    middle, segment = ((t[1:] + t[:-1]) / 2)[same], segment[:-1][same]
+    lats = points[segment, 0] + middle * (points[segment + 1, 0] - points[segment, 0])
+    lngs = points[segment, 1] + middle * (points[segment + 1, 1] - points[segment, 1])
+    return np.unique(np.concatenate((cell_ids(lats, lngs), cell_ids(points[:, 0], points[:, 1]))))
+
+
+def pack_cells(cells: np.ndarray):
+    """
+    Packs sorted cell ids into a short string: the first id and the differences between the ids (mostly small
+    numbers) as 32 bit integers, compressed and base64 encoded. A list of ids would make routes.json several times
+    larger and slower to write.
+    """
+    return base64.b64encode(zlib.compress(np.diff(cells, prepend=0).astype("<u4").tobytes(), 9)).decode("ascii")
+
+
+def unpack_cells(packed: str):
+    """
+    Returns the cell ids of a string of pack_cells.
+    """
+    return np.cumsum(np.frombuffer(zlib.decompress(base64.b64decode(packed)), dtype="<u4"), dtype=np.int64)
+
+
+def build_stats(points: list):
+    """
+    Returns the statistics of a route from its decoded (lat, lng) points, or None if it has no points.
+    The points are rounded to the precision of the polyline, the cells are packed into a string with pack_cells.
+    """
+    if not points:
+        return None
+    points = np.asarray(points, dtype=np.float64)
+    distances = haversine(points[0, 0], points[0, 1], points[:, 0], points[:, 1])
+    furthest = int(np.argmax(distances))
+    return {
+        "start": [round(value, 5) for value in points[0].tolist()],
+        "end": [round(value, 5) for value in points[-1].tolist()],
+        "far": [round(value, 5) for value in points[furthest].tolist()],
+        "span": int(round(distances[furthest])),
+        "cells": pack_cells(coverage(points)),
+    }
+
+
+def route_stats(route: dict):
+    """
+    Returns the stored statistics of a route, routes saved before they existed are decoded here.
+    """
+    if "stats" in route:
+        return route["stats"]
+    return build_stats(route_lod.decode((route.get("map") or {}).get("summary_polyline")))
+
+
+def build_leaderboards(year_data: dict, blacklist: frozenset = frozenset()):
+    """
+    Computes the leaderboards of a year, in the format of routes.json, from the statistics of the routes.
+    The activities in the blacklist are left out.
+
+    Returns:
+        dict: {leaderboard: [{"user_id", "user_name", "value"}, ...]} sorted from the highest value, with
+        unique_cells (number of cells visited), explored_area (km² of the cells visited) and
+        furthest_from_home (km from the most common start cell to the furthest point of a route).
+    """
+    boards = {"unique_cells": [], "explored_area": [], "furthest_from_home": []}
+    for athlete_data in year_data.get("athletes", {}).values():
+        routes = [route for route in athlete_data.get("routes", []) if route.get("activity_id") not in blacklist]
+        stats = [value for value in map(route_stats, routes) if value is not None]
+        if not stats:
+            continue
+        entry = {"user_id": athlete_data.get("user_id"), "user_name": athlete_data.get("user_name")}
+
+        cells = np.unique(np.concatenate([unpack_cells(value["cells"]) for value in stats]))
+        boards["unique_cells"].append(dict(entry, value=int(len(cells))))
+        boards["explored_area"].append(dict(entry, value=round(float(cell_area(cells).sum()), 2)))
+
+        # home is the center of the starts in the cell most routes start from
+        starts = np.array([value["start"] for value in stats])
+        start_cells = cell_ids(starts[:, 0], starts[:, 1])
+        values, counts = np.unique(start_cells, return_counts=True)
+        home = starts[start_cells == values[np.argmax(counts)]].mean(axis=0)
+        points = np.array([value[key] for value in stats for key in ("start", "end", "far")])
+        furthest = haversine(home[0], home[1], points[:, 0], points[:, 1]).max()
+        boards["furthest_from_home"].append(dict(entry, value=round(float(furthest) / 1000, 2)))
+
+    for board in boards.values():
+        board.sort(key=lambda entry: entry["value"], reverse=True)
+    return boards
+
+
+leaderboard_lock = Lock()
+leaderboards = {}  # (year, blacklist) -> (routes version, leaderboards)
+
+
+def get_leaderboards(year: int, blacklist: frozenset = frozenset()):
+    """
+    Returns the leaderboards of the year, they are computed again if the routes changed since the last call.
+    """
+    version = get_backend().routes_version(year)
+    with leaderboard_lock:
+        cached = leaderboards.get((year, blacklist))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    boards = build_leaderboards(get_backend().load_routes(year), blacklist)
+    with leaderboard_lock:
+        leaderboards[(year, blacklist)] = (version, boards)
+    return boards
@@ -7,20 +7,22 @@ Author: Julian Friedl
 """
 
 import datetime
-import json
 import os
 from dotenv import load_dotenv
 import logging
-import polyline
-from geopy.distance import geodesic
 
 from src.shared.config.log_config import setup_logging
+from src.shared.storage.backend import get_backend
+import src.shared.services.route_lod as route_lod
+import src.shared.services.route_index as route_index
+import src.shared.services.route_stats as route_stats
 from threading import Lock
 
 from src.shared.models.activity import Activity
 from src.shared.models.athlete import Athlete
 
 file_lock = Lock()  # locking mechanism for threading
+write_count = 0  # number of writes to the storage backend, exposed in the metrics
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -29,16 +31,14 @@ load_dotenv()
 
 YEAR = int(os.getenv("YEAR", datetime.date.today().year))
 
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-DATA_PATH = os.path.join(PROJECT_ROOT, 'data')
-YEAR_PATH = os.path.join(DATA_PATH, str(YEAR))
-ROUTES = os.path.join(YEAR_PATH, 'routes.json')
 
-
-def save_routes(activity:Activity, user:Athlete):
+def build_route(activity:Activity):
+    """
+    Creates the route entry of an activity, or returns None if the activity has no map data to show.
+    """
     # Construct the URL for the activity
     activity_url = f"https://www.strava.com/activities/{activity.id}"
-    
+
     new_route = {
         "activity_id": activity.id,
         "name": activity.name,
@@ -53,84 +53,67 @@ def save_routes(activity:Activity, user:Athlete):
         "url": activity_url
     }
 
-    if new_route["map"]["summary_polyline"] == "":
-        return
-    
+    if not (new_route["map"] or {}).get("summary_polyline"):
+        return None
+
     if new_route["type"] == "VirtualRide":
+        return None
+
+    # the polyline is decoded once here, the simplified polylines, the bounding box and the statistics for the
+    # map and the leaderboards are calculated from it instead of on every request
+    points = route_lod.decode(new_route["map"]["summary_polyline"])
+    new_route["lod"] = route_lod.build_tiers(points)
+    new_route["bbox"] = route_index.bounding_box(points)
+    new_route["stats"] = route_stats.build_stats(points)
+    return new_route
+
+
+def save_routes(activity:Activity, user:Athlete):
+    save_routes_batch([activity], user)
+
+
+def save_routes_batch(activities:list, user:Athlete):
+    """
+    Saves the routes of multiple activities of an athlete with a single write.
+
+    The routes are upserted by their activity id, so a route that already exists is replaced
+    instead of appended again. The metadata totals are updated by the storage backend.
+    """
+    write_routes([route for route in map(build_route, activities) if route is not None], user)
+
+def write_routes(new_routes:list, user:Athlete):
+    """
+    Saves route entries that were created with build_route with a single write.
+    """
+    if not new_routes:
         return
 
+    global write_count
+    user_data = {"user_id": user.user_id, "discord_user_id": user.discord_id, "user_name": user.username}
+    with file_lock:
+        get_backend().save_routes(YEAR, user_data, new_routes)
+        write_count += 1
+
+def delete_route(activity_id:int, user_id:int):
+    """
+    Removes the route of a deleted activity.
+    """
+    global write_count
     with file_lock:
-        if os.path.exists(ROUTES) and os.path.getsize(ROUTES) > 0:
-            with open(ROUTES, 'r') as file:
-                data = json.load(file)
-        else:
-            data = {"metadata": {"total_moving_time": 0, "total_distance": 0, "total_elevation_gain": 0}, "athletes": {}}
-
-        # Ensure athlete structure exists
-        athlete_data = data["athletes"].setdefault(str(user.user_id), {
-            "user_id": user.user_id,
-            "discord_user_id": user.discord_id,
-            "user_name": user.username,
-            "metadata": {"total_moving_time": 0, "total_distance": 0, "total_elevation_gain": 0},
-            "routes": []
-        })
-
-        # Check for existing route to replace
-        existing_route = next((route for route in athlete_data["routes"] if route["activity_id"] == new_route["activity_id"]), None)
-
-        if existing_route:
-            for metric, meta_key in [("moving_time", "total_moving_time"), ("distance", "total_distance"), ("total_elevation_gain", "total_elevation_gain")]:
-                data["metadata"][meta_key] -= existing_route.get(metric, 0)
-                athlete_data["metadata"][meta_key] -= existing_route.get(metric, 0)
-
-        # Correctly mapping new_route's keys to metadata keys when adding
-        for metric, meta_key in [("moving_time", "total_moving_time"), ("distance", "total_distance"), ("total_elevation_gain", "total_elevation_gain")]:
-            value = new_route.get(metric, 0)
-            data["metadata"][meta_key] += value
-            athlete_data["metadata"][meta_key] += value
-
-
-        # Append the new or updated route
-        athlete_data["routes"].append(new_route)
-
-        with open(ROUTES, 'w') as f:
-            json.dump(data, f, default=serialize, indent=4)
+        get_backend().delete_route(YEAR, user_id, activity_id)
+        write_count += 1
 
 def load_routes(years:str):
     all_data = {}
     for year in years.split(','):
-        YEAR_PATH = os.path.join(DATA_PATH, str(year))
-        ROUTES = os.path.join(YEAR_PATH, 'routes.json')
-        if os.path.exists(ROUTES) and os.path.getsize(ROUTES) > 0:
-            with open(ROUTES) as file:
-                data = json.load(file)
-            all_data[str(year)] = data
-        else:
-            all_data[str(year)] = {}  
+        all_data[str(year)] = get_backend().load_routes(int(year)) if year.strip().isdigit() else {}
     return all_data
 
-def available_years():
-    years = [name for name in os.listdir(DATA_PATH) 
-                if os.path.isdir(os.path.join(DATA_PATH, name)) 
-                and name.isdigit()]  # Ensure directory names are digits
-    return sorted(years)  # Return sorted list of years
-
-def serialize(obj):
+def routes_version(year:int):
     """
-    Serializes an object to be saved to a file.
-
-    This function converts set and bytes objects to lists and strings respectively, 
-    and recursively applies itself to elements of dictionaries, lists, and tuples.
+    Returns a value that changes whenever the routes of the year change.
     """
-    if isinstance(obj, set):
-        return list(obj)
-    elif isinstance(obj, bytes):
-        return obj.decode('utf-8')
-    elif isinstance(obj, dict):
-        return {str(k): serialize(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple)):
-        return [serialize(i) for i in obj]
-    elif isinstance(obj, datetime.datetime):
-        return obj.isoformat()
-    else:
-        return obj
+    return get_backend().routes_version(year)
+
+def available_years():
+    return get_backend().available_years()
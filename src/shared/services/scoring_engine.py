@@ -0,0 +1,206 @@
+"""
+file: scoring_engine.py
+
+description: This module scores the activities of an athlete. The activities are streamed oldest first and
+grouped by their calendar week, so any number of weeks can be scored in one pass while only the activities of
+one week are in memory. The routes of the scored weeks are saved with a single write.
+
+The points are calculated with the Activity objects, or with the NumPy backend in vector_scoring if the
+SCORING_BACKEND environment variable is set to "numpy". Every scored week is cached on the athlete with a
+fingerprint of its activities and of the rules that apply to them, a week whose fingerprint didn't change
+isn't scored again.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import logging
+from itertools import groupby
+from dotenv import load_dotenv
+
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.vector_scoring as vector_scoring
+from src.shared.models.athlete import Athlete
+from src.shared.models.activity import Activity
+from src.shared.models.week_result import WeekResult, PAY, PASS, JOKER, dump_week_cache, replace_week_result
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SCORING_BACKEND = os.getenv("SCORING_BACKEND", "object")  # "object" or "numpy"
+
+# Part of every fingerprint, has to be increased when the scoring itself changes so all cached weeks are scored again
+SCORING_VERSION = 1
+
+
+def activity_week(activity_data: dict):
+    """
+    Returns the calendar week of a raw activity without creating the Activity object.
+    """
+    return datetime.date.fromisoformat(activity_data.get("start_date_local", "1900-01-01")[:10]).isocalendar()[1]
+
+
+def iter_weeks(activities):
+    """
+    Generator that groups the raw activities by their calendar week.
+
+    Args:
+        activities (iterable): The raw activities, the oldest one first.
+
+    Yields:
+        tuple: (week, iterator of the raw activities of the week in chronological order)
+    """
+    return groupby(activities, key=activity_week)
+
+
+def score_week(activities: list, athlete: Athlete):
+    """
+    Calculates the total points earned with the activities of one week.
+
+    The points are calculated based on HIT workouts and activity duration.
+
+    Args:
+        activities (list): The Activity objects of the week in chronological order.
+        athlete (Athlete): The athlete the activities belong to.
+
+    Returns:
+        int: The points earned in the week.
+    """
+    points = 0
+    hit_counter = 0
+    activities_done_set = set()
+    for activity in activities:
+        hit_counter = activity.count_hit_workouts(
+            hit_counter, activities_done_set, athlete)
+        if hit_counter == athlete.hit_required:
+            points += 1
+            activities_done_set.add((activity.type, activity.date))
+            hit_counter = 0
+            logger.debug(
+                f"{athlete.username} Added 1 point for hit_counter: {hit_counter}\n"
+                f"Total points now: {points}\n"
+                f"Date: {activity.date}, Type: {activity.type}, Duration: {activity.duration}")
+        else:
+            points_from_activity = activity.calculate_points(
+                activities_done_set, athlete)
+            points += points_from_activity
+            logger.debug(
+                f"{athlete.username} Added {points_from_activity} point/s from activity\n"
+                f"Total points now: {points}\n"
+                f"Date: {activity.start_date}, Type: {activity.type}, Duration: {activity.duration}")
+    return points
+
+
+def fingerprint(activities: list, athlete: Athlete):
+    """
+    Returns a hash of everything the points of a week depend on: the scored fields of the raw activities,
+    the rules of the activity types in the week and the other rule constants of the athlete.
+    A changed rule of a type only changes the fingerprints of the weeks that have activities of that type.
+    """
+    types = sorted({str(activity.get("type")) for activity in activities})
+    data = {
+        "version": SCORING_VERSION,
+        "activities": [[activity.get("id"), activity.get("type"), activity.get("start_date_local"),
+                        activity.get("moving_time", 0), activity.get("elapsed_time", 0)] for activity in activities],
+        "rules": {activity_type: athlete.rules.get(activity_type) for activity_type in types},
+        "constants": [athlete.points_required, athlete.spazi, athlete.walking_limit, athlete.hit_required,
+                      athlete.hit_min_time, athlete.min_duration_multi_day],
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def week_result_of(athlete: Athlete, week: int, points: int):
+    """
+    Returns the result of the week: JOKER for a joker week, PAY if the athlete has to pay and PASS otherwise.
+    """
+    if week in athlete.joker_weeks:
+        return JOKER
+    elif points < athlete.points_required:
+        return PAY
+    return PASS
+
+
+def set_week_result(athlete: Athlete, week: int, points: int):
+    """
+    Inserts or replaces the result of the week in the week_results of the athlete.
+    The result is 2 for a joker week, 0 if the athlete has to pay and 1 otherwise.
+
+    Returns:
+        bool: True if the week_results changed.
+    """
+    result_code = week_result_of(athlete, week, points)
+    if athlete.streak_table is not None:
+        athlete.streak_table.update(week, result_code)
+    return replace_week_result(athlete.week_results, week, result_code)
+
+
+def score_weeks(activities, athlete: Athlete, weeks: list):
+    """
+    Scores all given weeks in one pass over the activities and saves the routes with one write.
+    The week results are only updated on the athlete, which is marked as dirty and has to be saved with flush_athletes.
+
+    Args:
+        activities (iterable): The raw activities, the oldest one first.
+        athlete (Athlete): The athlete the activities belong to.
+        weeks (list): The calendar weeks to score.
+
+    Returns:
+        dict: {week: points} for every week in weeks.
+    """
+    weeks = sorted(weeks)
+    points_by_week = {week: 0 for week in weeks}
+    fingerprints = {}
+    vectorized = SCORING_BACKEND == "numpy" and vector_scoring.supports(athlete)
+    scored_activities = []  # raw activities of the scored weeks for the NumPy backend
+    routes = []
+    for week, week_activities in iter_weeks(activities):
+        if weeks and week > weeks[-1]:
+            # the activities are ordered, so nothing that follows is needed anymore
+            break
+        if week not in points_by_week:
+            continue
+        week_activities = list(week_activities)
+        fingerprints[week] = fingerprint(week_activities, athlete)
+        cached = athlete.week_cache.get(week)
+        if cached is not None and cached.fingerprint == fingerprints[week]:
+            # nothing changed since the week was scored, its routes were saved back then
+            logger.debug(f"Using the cached result of week {week} of {athlete.username}.")
+            points_by_week[week] = cached.points
+            continue
+        # only the activities of the weeks that are scored are created
+        activity_objects = Activity.from_page(week_activities)
+        if vectorized:
+            scored_activities.extend(week_activities)
+        else:
+            points_by_week[week] = score_week(activity_objects, athlete)
+        # keep the map data of the week for later usage
+        routes.extend(route for route in map(routes_data_controller.build_route, activity_objects) if route is not None)
+
+    if scored_activities:
+        points_by_week.update(vector_scoring.score_weeks(scored_activities, athlete))
+
+    changed_results, changed_cache = [], []
+    for week in weeks:
+        if set_week_result(athlete, week, points_by_week[week]):
+            changed_results.append(week)
+        week_result = WeekResult(week, points_by_week[week], week_result_of(athlete, week, points_by_week[week]),
+                                 fingerprints.get(week) or fingerprint([], athlete))
+        if athlete.week_cache.get(week) != week_result:
+            athlete.week_cache[week] = week_result
+            changed_cache.append(week)
+
+    routes_data_controller.write_routes(routes, athlete)
+
+    if changed_results or changed_cache:
+        # Update athlete credentials with the new week results, only the changed weeks are saved
+        athlete.credentials["vars"]["week_results"] = athlete.week_results
+        athlete.credentials["vars"]["week_cache"] = dump_week_cache(athlete.week_cache)
+        athlete.mark_dirty("week_results", changed_results)
+        athlete.mark_dirty("week_cache", changed_cache)
+    return points_by_week
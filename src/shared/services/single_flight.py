@@ -0,0 +1,93 @@
+"""
+file: single_flight.py
+
+description: This module deduplicates identical work that runs at the same time. The first caller of a key does
+the work, callers that arrive with the same key while it is still running wait for it and get the same result (or
+the same exception). Nothing is kept once the work is done, so a later call with the key does the work again.
+SingleFlight is for threads (e.g. the requests of the fetch threads), AsyncSingleFlight for coroutines on the
+event loop of the bot (e.g. identical slash commands).
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import logging
+from concurrent.futures import Future
+from threading import Lock
+
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.flights = {}  # key -> Future of the running call
+        self.shared = 0  # calls that got the result of another call
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs), unless a call with the same key is already running.
+
+        Returns:
+            tuple: (result, shared), shared is True if the result came from the call of another thread.
+        """
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    def stats(self):
+        with self.lock:
+            return {"running": len(self.flights), "shared": self.shared}
+
+
+class AsyncSingleFlight:
+
+    def __init__(self):
+        self.flights = {}  # key -> Task of the running call
+        self.shared = 0  # calls that got the result of another call
+
+    async def do(self, key, coroutine_function, *args, **kwargs):
+        """
+        Awaits coroutine_function(*args, **kwargs), unless a call with the same key is already running.
+
+        The call runs as a task of its own, so it isn't cancelled if one of the waiting callers is cancelled.
+
+        Returns:
+            tuple: (result, shared), shared is True if the result came from the call of another caller.
+        """
+        task = self.flights.get(key)
+        if task is not None:
+            self.shared += 1
+            logger.debug(f"Joining the running call {key}.")
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+        self.flights[key] = task
+        task.add_done_callback(lambda _: self.flights.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def stats(self):
+        return {"running": len(self.flights), "shared": self.shared}
@@ -0,0 +1,87 @@
+"""
+file: token_refresher.py
+
+description: This module refreshes the Strava tokens of all athletes in a background thread before they expire,
+so the commands don't have to wait for the OAuth requests. Athlete still refreshes an expired token itself
+as a fallback, e.g. right after the bot was started.
+
+Author: Julian Friedl
+"""
+
+import os
+import time
+import logging
+from threading import Event, Lock, Thread
+from dotenv import load_dotenv
+
+import src.shared.services.auth_refresh as auth_refresh
+import src.shared.services.athlete_data_controller as athlete_data_controller
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TOKEN_REFRESH_INTERVAL = int(os.getenv("TOKEN_REFRESH_INTERVAL", 600))  # seconds between two checks
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 1800))  # tokens expiring within this many seconds are refreshed
+
+
+class TokenRefresher:
+    """
+    Daemon thread that periodically refreshes the tokens that are about to expire.
+    """
+
+    def __init__(self, interval: int = TOKEN_REFRESH_INTERVAL, margin: int = TOKEN_REFRESH_MARGIN):
+        self.interval = interval
+        self.margin = margin
+        self.stop_event = Event()
+        self.start_lock = Lock()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the thread, calling it again while the thread is running does nothing.
+        """
+        with self.start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = Thread(target=self.run, name="token-refresher", daemon=True)
+            self.thread.start()
+            logger.info(f"Token refresher started (interval {self.interval}s, margin {self.margin}s).")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_expiring()
+            except Exception as e:
+                logger.error(f"Token refresh failed: {e}")
+            self.stop_event.wait(self.interval)
+
+    def refresh_expiring(self):
+        """
+        Refreshes the tokens that expire within the margin and saves the refreshed athletes with a single write.
+        Returns the number of refreshed tokens.
+        """
+        deadline = time.time() + self.margin
+        refreshed = []
+        for cred in athlete_data_controller.load_athletes() or []:
+            if cred['strava_data']['expires_at'] > deadline:
+                continue
+            old_expires_at = cred['strava_data']['expires_at']
+            cred = auth_refresh.refresh_token(cred, self.margin)
+            if cred['strava_data']['expires_at'] != old_expires_at:
+                # only the Strava data is saved, the vars might have been changed by a command in the meantime
+                refreshed.append({'strava_data': cred['strava_data']})
+
+        if refreshed:
+            athlete_data_controller.save_changed_athletes(refreshed)
+            logger.info(f"Refreshed the tokens of {len(refreshed)} athletes ahead of time.")
+        return len(refreshed)
+
+
+token_refresher = TokenRefresher()
@@ -0,0 +1,150 @@
+"""
+file: vector_scoring.py
+
+description: This module contains the NumPy scoring backend. The activities are loaded into columnar arrays
+(type code, start, moving time, elapsed time) and the eligibility of every activity, the HIT workouts and the
+multi-day credit are computed for all activities at once. What is left of the rules is resolved per day: the
+first HIT completion or the first regular activity that counts ends the day, which only needs one pass over
+the days instead of one over the activities with a growing set of done days.
+
+It gives the same points as the object-based scoring in scoring_engine.score_week, the backend is chosen with
+the SCORING_BACKEND environment variable.
+
+Author: Julian Friedl
+"""
+
+import logging
+
+import numpy as np
+
+from src.shared.models.athlete import Athlete
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+HIT_TYPES = ("Workout", "WeightTraining")
+
+
+def supports(athlete: Athlete):
+    """
+    Returns True if the rules of the athlete can be scored with this backend. With hit_required below 1
+    the object-based scoring gives points for every activity, that corner case is left to it.
+    """
+    return isinstance(athlete.hit_required, int) and athlete.hit_required >= 1
+
+
+class ActivityTable:
+    """
+    The activities of an athlete as columnar arrays, in the order they were passed (oldest first).
+    """
+
+    def __init__(self, activities: list):
+        self.types = {}  # type name -> type code
+        self.type_code = np.array([self.types.setdefault(activity.get("type"), len(self.types)) for activity in activities], dtype=np.int64)
+        # [:19] strips the trailing Z, like Activity the local start time is used
+        self.start = np.array([activity.get("start_date_local", "1900-01-01T00:00:00Z")[:19] for activity in activities], dtype="datetime64[s]")
+        self.moving_time = np.array([activity.get("moving_time", 0) for activity in activities], dtype=np.float64)
+        self.elapsed_time = np.array([int(activity.get("elapsed_time", 0)) for activity in activities], dtype=np.int64)
+        self.day = self.start.astype("datetime64[D]")
+
+    def __len__(self):
+        return len(self.type_code)
+
+    def per_type(self, values: dict, default):
+        """
+        Returns an array that maps every type code to its value in values.
+        """
+        return np.array([values.get(name, default) for name in self.types], dtype=np.float64)
+
+    def iso_weeks(self):
+        """
+        Returns the ISO calendar week of every activity and the Thursday of that week, which identifies the week across years.
+        """
+        days = self.day.astype(np.int64)  # days since 1970-01-01, which was a Thursday
+        weekday = (days + 3) % 7  # Monday = 0
+        thursday = days - weekday + 3
+        jan_first = thursday.astype("datetime64[D]").astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+        return (thursday - jan_first) // 7 + 1, thursday
+
+
+def score_weeks(activities: list, athlete: Athlete):
+    """
+    Calculates the points of every calendar week that has activities.
+
+    Args:
+        activities (list): The raw activities, the oldest one first.
+        athlete (Athlete): The athlete the activities belong to, supports(athlete) has to be True.
+
+    Returns:
+        dict: {week: points} for every week with at least one activity.
+    """
+    table = ActivityTable(activities)
+    n = len(table)
+    if n == 0:
+        return {}
+
+    # Eligibility of every activity
+    duration = table.moving_time / 60
+    threshold = table.per_type(athlete.rules, np.inf)[table.type_code] - athlete.spazi
+    eligible = duration >= threshold
+    is_walk = table.type_code == table.types.get("Walk", -1)
+    is_hit_type = np.isin(table.type_code, [table.types[name] for name in HIT_TYPES if name in table.types])
+    hit = is_hit_type & (athlete.hit_min_time < duration) & (duration < 60 - athlete.spazi)
+
+    # Multi-day credit, one point for every day the activity touches unless it ends too early on the last day
+    end = table.start + table.elapsed_time.astype("timedelta64[s]")
+    end_day = end.astype("datetime64[D]")
+    days = (end_day - table.day).astype(np.int64) + 1
+    end_minutes = (end - end_day).astype("timedelta64[m]").astype(np.int64)
+    credit = days - ((days > 1) & (end_minutes < athlete.min_duration_multi_day))
+
+    # Group the activities by day
+    weeks, week_keys = table.iso_weeks()
+    day_number = table.day.astype(np.int64)
+    day_starts = np.flatnonzero(np.r_[True, day_number[1:] != day_number[:-1]])
+    day_ends = np.r_[day_starts[1:], n]
+
+    # First regular activity of each day that counts, with and without walks (n if there is none)
+    index = np.arange(n)
+    first_any = np.minimum.reduceat(np.where(eligible, index, n), day_starts)
+    first_no_walk = np.minimum.reduceat(np.where(eligible & ~is_walk, index, n), day_starts)
+
+    # HIT workouts of each day, and how many of them come before (or are) the first regular activity
+    hit_index = np.flatnonzero(hit)
+    hits_start = np.searchsorted(hit_index, day_starts)
+    hits_count = np.searchsorted(hit_index, day_ends) - hits_start
+    hits_any = np.where(first_any < n, np.searchsorted(hit_index, first_any, side="right") - hits_start, hits_count)
+    hits_no_walk = np.where(first_no_walk < n, np.searchsorted(hit_index, first_no_walk, side="right") - hits_start, hits_count)
+
+    # Resolve the days in order, the HIT counter and the walk count carry over from day to day within a week
+    points_by_week = {}
+    current_week = None
+    hit_counter = walk_count = 0
+    hit_index = hit_index.tolist()
+    credit = credit.tolist()
+    is_walk = is_walk.tolist()
+    for i, start in enumerate(day_starts.tolist()):
+        week = int(weeks[start])
+        if week_keys[start] != current_week:
+            current_week = week_keys[start]
+            hit_counter = walk_count = 0
+            points_by_week.setdefault(week, 0)
+
+        if walk_count < athlete.walking_limit:
+            first, hits_before = int(first_any[i]), int(hits_any[i])
+        else:
+            first, hits_before = int(first_no_walk[i]), int(hits_no_walk[i])
+
+        # the HIT workout that completes the counter earns the point if it comes before the regular activity
+        missing_hits = athlete.hit_required - hit_counter
+        if missing_hits <= hits_count[i] and hit_index[hits_start[i] + missing_hits - 1] <= first:
+            points_by_week[week] += 1
+            hit_counter = 0
+        elif first < n:
+            points_by_week[week] += credit[first]
+            walk_count += is_walk[first]
+            hit_counter += hits_before
+        else:
+            hit_counter += int(hits_count[i])
+    return points_by_week
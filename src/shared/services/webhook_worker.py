@@ -0,0 +1,177 @@
+"""
+file: webhook_worker.py
+
+description: This module processes the Strava push events that arrive at the /strava_webhook endpoint.
+The endpoint only queues the events, a background thread fetches the affected activity, updates the activity
+store and the route, and scores the affected week again. With WEBHOOK_INGEST=true the commands don't sync
+with Strava anymore and only read what the worker stored.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import os
+import queue
+import logging
+from threading import Lock, Thread
+from dotenv import load_dotenv
+
+import src.shared.services.athlete_data_controller as athlete_data_controller
+import src.shared.services.activities_data_controller as activities_data_controller
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.scoring_engine as scoring_engine
+from src.shared.models.activity import Activity
+from src.shared.models.athlete import Athlete, flush_athletes
+from src.shared.api.api_calls import api_request
+from src.shared.api.rate_governor import Priority
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+YEAR = int(os.getenv("YEAR", datetime.date.today().year))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Fields of the detailed activity representation that the summaries from the sync don't have, they aren't stored
+DETAIL_ONLY_KEYS = ("segment_efforts", "splits_metric", "splits_standard", "laps", "best_efforts", "photos",
+                    "stats_visibility", "similar_activities", "available_zones")
+
+
+class WebhookWorker:
+    """
+    Daemon thread that processes the queued Strava events one after another.
+    """
+
+    def __init__(self, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.events = queue.Queue(maxsize=queue_size)
+        self.start_lock = Lock()
+        self.stats_lock = Lock()
+        self.thread = None
+        self.counts = {"received": 0, "processed": 0, "ignored": 0, "failed": 0, "dropped": 0}
+
+    def start(self):
+        """
+        Starts the thread, calling it again while the thread is running does nothing.
+        """
+        with self.start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = Thread(target=self.run, name="webhook-worker", daemon=True)
+            self.thread.start()
+            logger.info("Webhook worker started.")
+
+    def enqueue(self, event: dict):
+        """
+        Queues an event for the worker and starts the worker if needed.
+        Returns False if the queue is full, Strava sends the event again later in that case.
+        """
+        self.start()
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            logger.warning(f"Webhook queue is full, dropped event for {event.get('object_type')} {event.get('object_id')}.")
+            self.count("dropped")
+            return False
+        self.count("received")
+        return True
+
+    def count(self, key: str):
+        with self.stats_lock:
+            self.counts[key] += 1
+
+    def stats(self):
+        """
+        Returns the event counts and the current length of the queue, they are exposed in the metrics.
+        """
+        with self.stats_lock:
+            return dict(self.counts, queued=self.events.qsize())
+
+    def run(self):
+        while True:
+            event = self.events.get()
+            try:
+                self.count("processed" if self.process(event) else "ignored")
+            except Exception as e:
+                logger.error(f"Processing the webhook event {event} failed: {e}")
+                self.count("failed")
+            finally:
+                self.events.task_done()
+
+    def process(self, event: dict):
+        """
+        Applies a single Strava event. Returns False if the event was ignored.
+        """
+        if event.get("object_type") != "activity":
+            # e.g. an athlete that revoked the access of the app
+            logger.info(f"Ignoring webhook event for {event.get('object_type')} {event.get('object_id')}: {event.get('updates')}")
+            return False
+
+        cred = next((cred for cred in athlete_data_controller.load_athletes() or []
+                     if cred['strava_data']['athlete']['id'] == event.get("owner_id")), None)
+        if cred is None:
+            logger.info(f"Ignoring webhook event of the unregistered athlete {event.get('owner_id')}.")
+            return False
+
+        athlete = Athlete(cred)
+        try:
+            activity_id = event["object_id"]
+            old_activity = activities_data_controller.get_activity(athlete.user_id, activity_id)
+            if event.get("aspect_type") == "delete":
+                new_activity = None
+                activities_data_controller.delete_activity(athlete.user_id, activity_id)
+                routes_data_controller.delete_route(activity_id, athlete.user_id)
+            else:
+                new_activity = self.fetch_activity(athlete, activity_id)
+                self.save_activity(athlete, new_activity)
+
+            # score the week of the activity again, and its old week if the date was changed
+            weeks = {challenge_week(activity) for activity in (old_activity, new_activity) if activity is not None}
+            weeks.discard(None)
+            for week in sorted(weeks):
+                start_date = datetime.date.fromisocalendar(YEAR, week, 1)
+                activities = activities_data_controller.iter_activities(athlete.user_id, start_date, start_date + datetime.timedelta(days=7))
+                points = scoring_engine.score_weeks(activities, athlete, [week])[week]
+                logger.info(f"Scored week {week} of {athlete.username} again after a {event.get('aspect_type')} event: {points} points.")
+        finally:
+            flush_athletes([athlete])
+        return True
+
+    def fetch_activity(self, athlete: Athlete, activity_id: int):
+        """
+        Fetches a single activity from Strava and strips the fields that only the detailed representation has.
+        """
+        headers = {"Authorization": f"Bearer {athlete.access_token}"}
+        activity, _ = api_request(f"https://www.strava.com/api/v3/activities/{activity_id}", headers, {}, athlete.username, athlete.user_id,
+                                  cache=False, priority=Priority.BACKGROUND, max_wait=None)
+        activity = {key: value for key, value in activity.items() if key not in DETAIL_ONLY_KEYS}
+        if activity.get("map"):
+            # the full polyline is only in the detailed representation, the routes use the summary polyline
+            activity["map"] = {key: value for key, value in activity["map"].items() if key != "polyline"}
+        return activity
+
+    def save_activity(self, athlete: Athlete, activity: dict):
+        """
+        Stores a created or updated activity and its route.
+        """
+        if challenge_week(activity) is None:
+            return
+        # the mark is only moved by the syncs, it says that everything before it was fetched from Strava
+        activities_data_controller.save_activities(athlete.user_id, [activity], advance_hwm=False)
+        if routes_data_controller.build_route(Activity(activity)) is None:
+            # e.g. the map was hidden or the type changed to a virtual ride
+            routes_data_controller.delete_route(activity["id"], athlete.user_id)
+        else:
+            routes_data_controller.save_routes(Activity(activity), athlete)
+
+
+def challenge_week(activity: dict):
+    """
+    Returns the calendar week of an activity, or None if it doesn't belong to the challenge year.
+    """
+    year, week, _ = datetime.date.fromisoformat(activity.get("start_date_local", "1900-01-01")[:10]).isocalendar()
+    return week if year == YEAR else None
+
+
+webhook_worker = WebhookWorker()
@@ -0,0 +1,89 @@
+"""
+file: week_precompute.py
+
+description: This module scores the previous calendar week of all athletes in the background, so the /week
+command on Monday morning finds the results, routes and synced activities already stored. The athletes are
+processed one after another with a pause in between and with background priority, so the precomputation
+doesn't use up the rate limit budget of the interactive commands.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import os
+import time
+import logging
+from dotenv import load_dotenv
+
+import src.shared.services.athlete_data_controller as athlete_data_controller
+import src.shared.services.scoring_engine as scoring_engine
+from src.shared.models.athlete import Athlete, flush_athletes
+from src.shared.api.rate_governor import Priority
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+YEAR = int(os.getenv("YEAR", datetime.date.today().year))
+PRECOMPUTE_SPACING = float(os.getenv("PRECOMPUTE_SPACING", 5))  # seconds between two athletes
+
+RULES = athlete_data_controller.load_global_rules()
+
+CHALLENGE_START_WEEK = RULES["CHALLENGE_START_WEEK"]
+
+
+def previous_week(today: datetime.date = None):
+    """
+    Returns the calendar week before today, or None if it doesn't belong to the challenge year.
+    """
+    year, week, _ = ((today or datetime.date.today()) - datetime.timedelta(days=7)).isocalendar()
+    return week if year == YEAR else None
+
+
+def precompute_athlete(cred: dict, week: int):
+    """
+    Syncs the activities of an athlete and scores the week and all weeks before it that weren't scored yet,
+    so the price multiplier of the week doesn't need a fetch either.
+    """
+    athlete = Athlete(cred)
+    try:
+        streak_table = athlete.get_streak_table(CHALLENGE_START_WEEK)
+        weeks = [past_week for past_week in range(CHALLENGE_START_WEEK, week) if streak_table.result(past_week) is None] + [week]
+        start_date = datetime.date.fromisocalendar(YEAR, weeks[0], 1)
+        # end_date is exclusive so use the next day at 00:00:00 time
+        end_date = datetime.date.fromisocalendar(YEAR, week, 7) + datetime.timedelta(days=1)
+        activities, num_of_API_requests, _ = athlete.fetch_athlete_activities(start_date, end_date, cache=False, priority=Priority.BACKGROUND)
+        points = scoring_engine.score_weeks(activities, athlete, weeks)[week]
+        logger.info(f"Precomputed week {week} of {athlete.username}: {points} points, {len(weeks)} weeks scored, {num_of_API_requests} requests.")
+    finally:
+        flush_athletes([athlete])
+
+
+def precompute_week(week: int = None, spacing: float = PRECOMPUTE_SPACING):
+    """
+    Precomputes the week (default: the previous week) for all athletes.
+    A failing athlete is logged and skipped, it will be fetched by the next command instead.
+
+    Returns:
+        int: The number of athletes whose week was precomputed.
+    """
+    week = week or previous_week()
+    if week is None or week < CHALLENGE_START_WEEK:
+        logger.info("No week of the challenge to precompute.")
+        return 0
+
+    creds = athlete_data_controller.load_athletes() or []
+    logger.info(f"Precomputing week {week} for {len(creds)} athletes.")
+    done = 0
+    for i, cred in enumerate(creds):
+        if i > 0 and spacing > 0:
+            time.sleep(spacing)  # spread the requests over time
+        try:
+            precompute_athlete(cred, week)
+            done += 1
+        except Exception as e:
+            logger.error(f"Precomputing week {week} of athlete {cred['strava_data']['athlete']['id']} failed: {e}")
+    logger.info(f"Precomputed week {week} for {done}/{len(creds)} athletes.")
+    return done
@@ -0,0 +1,51 @@
+"""
+file: backend.py
+
+description: This module selects the storage backend that is configured with the STORAGE_BACKEND environment
+variable ("json" or "sqlite").
+
+Author: Julian Friedl
+"""
+
+import os
+import logging
+from threading import Lock
+from dotenv import load_dotenv
+
+from src.shared.storage.json_backend import JsonBackend
+from src.shared.storage.sqlite_backend import SqliteBackend, SQLITE_PATH
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", SQLITE_PATH)
+
+backend_lock = Lock()
+backend = None
+
+
+def create_backend(name: str):
+    """
+    Creates a new storage backend by its name.
+    """
+    if name == "json":
+        return JsonBackend()
+    if name == "sqlite":
+        return SqliteBackend(STORAGE_SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_backend():
+    """
+    Returns the configured storage backend, it is created on the first call.
+    """
+    global backend
+    with backend_lock:
+        if backend is None:
+            backend = create_backend(STORAGE_BACKEND)
+            logger.info(f"Using the {backend.name} storage backend.")
+        return backend
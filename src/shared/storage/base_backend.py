@@ -0,0 +1,100 @@
+"""
+file: base_backend.py
+
+description: This module contains the interface every storage backend implements. The data controllers only talk
+to a backend, so the athletes, week results and routes can be kept in JSON files or in a database.
+
+Author: Julian Friedl
+"""
+
+import datetime
+
+
+class StorageBackend:
+    """
+    Interface of a storage backend. The athletes are stored in the same format as the entries of athletes.json
+    and the routes in the same format as routes.json.
+    """
+
+    name = "base"
+
+    def load_athletes(self, year: int):
+        """
+        Returns a list with the credentials of all athletes of the year.
+        """
+        raise NotImplementedError
+
+    def load_athlete_by_discord_id(self, year: int, discord_user_id: str):
+        """
+        Returns the credentials of the athlete with the discord id, or None if there is no such athlete.
+        """
+        raise NotImplementedError
+
+    def save_athlete(self, year: int, athlete: dict):
+        """
+        Inserts or replaces the credentials of one athlete.
+        """
+        self.save_athletes(year, [athlete])
+
+    def save_athletes(self, year: int, athletes: list):
+        """
+        Inserts or replaces the credentials of multiple athletes with a single write.
+        """
+        raise NotImplementedError
+
+    def load_routes(self, year: int):
+        """
+        Returns the routes of the year in the format of routes.json, or an empty dict if there are none.
+        """
+        raise NotImplementedError
+
+    def save_routes(self, year: int, user: dict, routes: list):
+        """
+        Inserts or replaces the routes of an athlete by their activity id and updates the metadata totals.
+
+        Args:
+            year (int): The year of the routes.
+            user (dict): user_id, discord_user_id and user_name of the athlete.
+            routes (list): The route entries.
+        """
+        raise NotImplementedError
+
+    def delete_route(self, year: int, athlete_id: int, activity_id: int):
+        """
+        Removes the route of an activity and updates the metadata totals.
+        """
+        raise NotImplementedError
+
+    def routes_version(self, year: int):
+        """
+        Returns a value that changes whenever the routes of the year change, e.g. to invalidate cached responses.
+        Returns None if the year has no routes.
+        """
+        raise NotImplementedError
+
+    def available_years(self):
+        """
+        Returns a sorted list of the years that have data.
+        """
+        raise NotImplementedError
+
+
+def serialize(obj):
+    """
+    Serializes an object to be saved to a file.
+
+    This function converts set and bytes objects to lists and strings respectively,
+    and recursively applies itself to elements of dictionaries, lists, and tuples.
+    """
+    if isinstance(obj, set):
+        return list(obj)
+    elif isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    elif isinstance(obj, dict):
+        return {str(k): serialize(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [serialize(i) for i in obj]
+    elif isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    else:
+        return obj
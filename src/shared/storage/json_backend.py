@@ -0,0 +1,126 @@
+"""
+file: json_backend.py
+
+description: This module contains the storage backend that keeps the data in data/<YEAR>/athletes.json and
+data/<YEAR>/routes.json.
+
+Author: Julian Friedl
+"""
+
+import json
+import os
+
+from src.shared.storage.base_backend import StorageBackend, serialize
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DATA_PATH = os.path.join(PROJECT_ROOT, 'data')
+
+METRICS = [("moving_time", "total_moving_time"), ("distance", "total_distance"), ("total_elevation_gain", "total_elevation_gain")]
+
+
+class JsonBackend(StorageBackend):
+
+    name = "json"
+
+    def __init__(self, data_path: str = DATA_PATH):
+        self.data_path = data_path
+
+    def year_path(self, year: int):
+        return os.path.join(self.data_path, str(year))
+
+    def athletes_file(self, year: int):
+        return os.path.join(self.year_path(year), 'athletes.json')
+
+    def routes_file(self, year: int):
+        return os.path.join(self.year_path(year), 'routes.json')
+
+    def load_athletes(self, year: int):
+        path = self.athletes_file(year)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'r') as file:
+                return json.load(file)
+        return []
+
+    def load_athlete_by_discord_id(self, year: int, discord_user_id: str):
+        for athlete in self.load_athletes(year):
+            if athlete.get("discord_user_id", None) == discord_user_id:
+                return athlete
+        return None
+
+    def save_athletes(self, year: int, athletes: list):
+        data = self.load_athletes(year)
+        index = {existing['strava_data']['athlete']['id']: i for i, existing in enumerate(data)}
+        for athlete in athletes:
+            athlete_id = athlete['strava_data']['athlete']['id']
+            if athlete_id in index:
+                data[index[athlete_id]] = athlete
+            else:
+                index[athlete_id] = len(data)
+                data.append(athlete)
+
+        os.makedirs(self.year_path(year), exist_ok=True)
+        with open(self.athletes_file(year), 'w') as f:
+            json.dump(data, f, default=serialize, indent=4)
+
+    def load_routes(self, year: int):
+        path = self.routes_file(year)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path) as file:
+                return json.load(file)
+        return {}
+
+    def save_routes(self, year: int, user: dict, routes: list):
+        data = self.load_routes(year) or {"metadata": {"total_moving_time": 0, "total_distance": 0, "total_elevation_gain": 0}, "athletes": {}}
+
+        # Ensure athlete structure exists
+        athlete_data = data["athletes"].setdefault(str(user["user_id"]), {
+            "user_id": user["user_id"],
+            "discord_user_id": user["discord_user_id"],
+            "user_name": user["user_name"],
+            "metadata": {"total_moving_time": 0, "total_distance": 0, "total_elevation_gain": 0},
+            "routes": []
+        })
+
+        # Upsert the routes by their activity id, this also collapses duplicates of older versions of the file
+        routes_by_id = {route["activity_id"]: route for route in athlete_data["routes"]}
+        for route in routes:
+            routes_by_id[route["activity_id"]] = route
+        athlete_data["routes"] = list(routes_by_id.values())
+
+        self.write_routes(year, data, athlete_data)
+
+    def delete_route(self, year: int, athlete_id: int, activity_id: int):
+        data = self.load_routes(year)
+        athlete_data = data.get("athletes", {}).get(str(athlete_id))
+        if athlete_data is None:
+            return
+        athlete_data["routes"] = [route for route in athlete_data["routes"] if route["activity_id"] != activity_id]
+        self.write_routes(year, data, athlete_data)
+
+    def write_routes(self, year: int, data: dict, athlete_data: dict):
+        """
+        Recalculates the totals of the changed athlete and of the year and writes the routes file.
+        """
+        for metric, meta_key in METRICS:
+            athlete_data["metadata"][meta_key] = sum(route.get(metric, 0) for route in athlete_data["routes"])
+            data["metadata"][meta_key] = sum(athlete["metadata"][meta_key] for athlete in data["athletes"].values())
+
+        os.makedirs(self.year_path(year), exist_ok=True)
+        with open(self.routes_file(year), 'w') as f:
+            json.dump(data, f, default=serialize, separators=(',', ':'))
+
+    def routes_version(self, year: int):
+        # the file is rewritten on every change, also by other processes (e.g. the migration)
+        try:
+            stat = os.stat(self.routes_file(year))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def available_years(self):
+        if not os.path.exists(self.data_path):
+            return []
+        years = [name for name in os.listdir(self.data_path)
+                    if os.path.isdir(os.path.join(self.data_path, name))
+                    and name.isdigit()]  # Ensure directory names are digits
+        return sorted(years)  # Return sorted list of years
@@ -0,0 +1,54 @@
+"""
+file: migrate.py
+
+description: This module copies the athletes and routes of the data/<YEAR>/*.json layout into the SQLite database.
+Existing rows in the database are updated, so the migration can be run more than once.
+
+usage: python -m src.shared.storage.migrate [--years 2023 2024] [--database data/challenge.sqlite3]
+
+Author: Julian Friedl
+"""
+
+import argparse
+import logging
+
+from src.shared.storage.json_backend import JsonBackend
+from src.shared.storage.sqlite_backend import SqliteBackend
+from src.shared.storage.backend import STORAGE_SQLITE_PATH
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def migrate(source, target, years: list = None):
+    """
+    Copies the athletes and routes of the given years (default: all years) from the source to the target backend.
+    """
+    for year in years or source.available_years():
+        year = int(year)
+        athletes = source.load_athletes(year)
+        if athletes:
+            target.save_athletes(year, athletes)
+
+        routes = source.load_routes(year)
+        num_of_routes = 0
+        for athlete_data in routes.get("athletes", {}).values():
+            user = {
+                "user_id": athlete_data["user_id"],
+                "discord_user_id": athlete_data.get("discord_user_id"),
+                "user_name": athlete_data.get("user_name"),
+            }
+            target.save_routes(year, user, athlete_data.get("routes", []))
+            num_of_routes += len(athlete_data.get("routes", []))
+
+        logger.info(f"Migrated {len(athletes)} athletes and {num_of_routes} routes of {year}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the JSON data files into the SQLite database.")
+    parser.add_argument("--years", nargs="*", help="Years to migrate, default: all years in the data directory")
+    parser.add_argument("--database", default=STORAGE_SQLITE_PATH, help="Path of the SQLite database")
+    args = parser.parse_args()
+
+    migrate(JsonBackend(), SqliteBackend(args.database), args.years)
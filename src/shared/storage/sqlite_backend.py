@@ -0,0 +1,254 @@
+"""
+file: sqlite_backend.py
+
+description: This module contains the storage backend that keeps the data in a SQLite database. Athletes,
+credentials, vars, week results and routes have their own tables, so a single athlete or route can be updated
+without rewriting everything else.
+
+Author: Julian Friedl
+"""
+
+import json
+import os
+import sqlite3
+from threading import Lock
+
+from src.shared.storage.base_backend import StorageBackend, serialize
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DATA_PATH = os.path.join(PROJECT_ROOT, 'data')
+SQLITE_PATH = os.path.join(DATA_PATH, 'challenge.sqlite3')
+
+TOKEN_KEYS = ("access_token", "refresh_token", "expires_at")
+VAR_KEYS = ("joker", "joker_weeks", "week_results")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS athletes (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    discord_user_id TEXT,
+    firstname TEXT,
+    lastname TEXT,
+    athlete_json TEXT NOT NULL,
+    constants_json TEXT NOT NULL,
+    PRIMARY KEY (year, athlete_id)
+);
+CREATE INDEX IF NOT EXISTS idx_athletes_athlete_id ON athletes (athlete_id);
+CREATE INDEX IF NOT EXISTS idx_athletes_discord_user_id ON athletes (discord_user_id);
+
+CREATE TABLE IF NOT EXISTS credentials (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    access_token TEXT,
+    refresh_token TEXT,
+    expires_at INTEGER,
+    strava_json TEXT NOT NULL,
+    PRIMARY KEY (year, athlete_id)
+);
+
+CREATE TABLE IF NOT EXISTS vars (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    joker INTEGER,
+    joker_weeks TEXT NOT NULL,
+    extra_json TEXT NOT NULL,
+    PRIMARY KEY (year, athlete_id)
+);
+
+CREATE TABLE IF NOT EXISTS week_results (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    PRIMARY KEY (year, athlete_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_week_results_week ON week_results (year, athlete_id, week);
+
+CREATE TABLE IF NOT EXISTS route_athletes (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    discord_user_id TEXT,
+    user_name TEXT,
+    PRIMARY KEY (year, athlete_id)
+);
+
+CREATE TABLE IF NOT EXISTS routes (
+    year INTEGER NOT NULL,
+    athlete_id INTEGER NOT NULL,
+    activity_id INTEGER NOT NULL,
+    type TEXT,
+    start_date TEXT,
+    moving_time REAL NOT NULL DEFAULT 0,
+    distance REAL NOT NULL DEFAULT 0,
+    total_elevation_gain REAL NOT NULL DEFAULT 0,
+    route_json TEXT NOT NULL,
+    PRIMARY KEY (year, athlete_id, activity_id)
+);
+CREATE INDEX IF NOT EXISTS idx_routes_athlete_id ON routes (athlete_id);
+CREATE INDEX IF NOT EXISTS idx_routes_start_date ON routes (year, start_date);
+
+CREATE TABLE IF NOT EXISTS route_versions (
+    year INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class SqliteBackend(StorageBackend):
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.lock = Lock()  # one connection is shared between the threads
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def load_athletes(self, year: int):
+        with self.lock:
+            return self.read_athletes("WHERE a.year = ?", (year,))
+
+    def load_athlete_by_discord_id(self, year: int, discord_user_id: str):
+        with self.lock:
+            athletes = self.read_athletes("WHERE a.year = ? AND a.discord_user_id = ?", (year, discord_user_id))
+        return athletes[0] if athletes else None
+
+    def read_athletes(self, where: str, params: tuple):
+        """
+        Assembles the credentials of the athletes that match the where clause. Has to be called while holding the lock.
+        """
+        rows = self.conn.execute(f"""
+            SELECT a.year, a.athlete_id, a.discord_user_id, a.athlete_json, a.constants_json,
+                   c.access_token, c.refresh_token, c.expires_at, c.strava_json,
+                   v.joker, v.joker_weeks, v.extra_json
+            FROM athletes a
+            JOIN credentials c ON c.year = a.year AND c.athlete_id = a.athlete_id
+            JOIN vars v ON v.year = a.year AND v.athlete_id = a.athlete_id
+            {where}
+            ORDER BY a.rowid""", params).fetchall()
+
+        athletes = []
+        for (year, athlete_id, discord_user_id, athlete_json, constants_json,
+             access_token, refresh_token, expires_at, strava_json, joker, joker_weeks, extra_json) in rows:
+            week_results = [f"{week}_{result}" for week, result in self.conn.execute(
+                "SELECT week, result FROM week_results WHERE year = ? AND athlete_id = ? ORDER BY position", (year, athlete_id))]
+
+            strava_data = json.loads(strava_json)
+            strava_data.update({"access_token": access_token, "refresh_token": refresh_token, "expires_at": expires_at})
+            strava_data["athlete"] = json.loads(athlete_json)
+
+            athlete_vars = {"joker": joker, "joker_weeks": json.loads(joker_weeks), "week_results": week_results}
+            athlete_vars.update(json.loads(extra_json))
+
+            athletes.append({
+                "strava_data": strava_data,
+                "constants": json.loads(constants_json),
+                "vars": athlete_vars,
+                "discord_user_id": discord_user_id,
+            })
+        return athletes
+
+    def save_athletes(self, year: int, athletes: list):
+        with self.lock, self.conn:
+            for athlete in athletes:
+                strava_data = athlete["strava_data"]
+                athlete_id = strava_data["athlete"]["id"]
+                athlete_vars = athlete.get("vars") or {}
+
+                self.conn.execute("""
+                    INSERT INTO athletes (year, athlete_id, discord_user_id, firstname, lastname, athlete_json, constants_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (year, athlete_id) DO UPDATE SET
+                        discord_user_id = excluded.discord_user_id, firstname = excluded.firstname, lastname = excluded.lastname,
+                        athlete_json = excluded.athlete_json, constants_json = excluded.constants_json""",
+                    (year, athlete_id, athlete.get("discord_user_id"), strava_data["athlete"].get("firstname"), strava_data["athlete"].get("lastname"),
+                     json.dumps(strava_data["athlete"], default=serialize), json.dumps(athlete.get("constants") or {}, default=serialize)))
+
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO credentials (year, athlete_id, access_token, refresh_token, expires_at, strava_json)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                    (year, athlete_id, strava_data.get("access_token"), strava_data.get("refresh_token"), strava_data.get("expires_at"),
+                     json.dumps({k: v for k, v in strava_data.items() if k not in TOKEN_KEYS and k != "athlete"}, default=serialize)))
+
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO vars (year, athlete_id, joker, joker_weeks, extra_json)
+                    VALUES (?, ?, ?, ?, ?)""",
+                    (year, athlete_id, athlete_vars.get("joker"), json.dumps(athlete_vars.get("joker_weeks", []), default=serialize),
+                     json.dumps({k: v for k, v in athlete_vars.items() if k not in VAR_KEYS}, default=serialize)))
+
+                self.conn.execute("DELETE FROM week_results WHERE year = ? AND athlete_id = ?", (year, athlete_id))
+                self.conn.executemany("INSERT INTO week_results (year, athlete_id, position, week, result) VALUES (?, ?, ?, ?, ?)",
+                    [(year, athlete_id, position, int(week_result.split("_")[0]), int(week_result.split("_")[1]))
+                     for position, week_result in enumerate(athlete_vars.get("week_results", []))])
+
+    def load_routes(self, year: int):
+        with self.lock:
+            owners = self.conn.execute(
+                "SELECT athlete_id, discord_user_id, user_name FROM route_athletes WHERE year = ? ORDER BY rowid", (year,)).fetchall()
+            if not owners:
+                return {}
+            totals = {athlete_id: (moving_time, distance, elevation_gain) for athlete_id, moving_time, distance, elevation_gain in self.conn.execute(
+                "SELECT athlete_id, SUM(moving_time), SUM(distance), SUM(total_elevation_gain) FROM routes WHERE year = ? GROUP BY athlete_id", (year,))}
+            routes = {}
+            for athlete_id, route_json in self.conn.execute("SELECT athlete_id, route_json FROM routes WHERE year = ? ORDER BY rowid", (year,)):
+                routes.setdefault(athlete_id, []).append(json.loads(route_json))
+
+        data = {"metadata": {"total_moving_time": 0, "total_distance": 0, "total_elevation_gain": 0}, "athletes": {}}
+        for athlete_id, discord_user_id, user_name in owners:
+            moving_time, distance, elevation_gain = totals.get(athlete_id, (0, 0, 0))
+            data["athletes"][str(athlete_id)] = {
+                "user_id": athlete_id,
+                "discord_user_id": discord_user_id,
+                "user_name": user_name,
+                "metadata": {"total_moving_time": moving_time, "total_distance": distance, "total_elevation_gain": elevation_gain},
+                "routes": routes.get(athlete_id, []),
+            }
+            data["metadata"]["total_moving_time"] += moving_time
+            data["metadata"]["total_distance"] += distance
+            data["metadata"]["total_elevation_gain"] += elevation_gain
+        return data
+
+    def save_routes(self, year: int, user: dict, routes: list):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO route_athletes (year, athlete_id, discord_user_id, user_name) VALUES (?, ?, ?, ?)
+                ON CONFLICT (year, athlete_id) DO NOTHING""",
+                (year, user["user_id"], user["discord_user_id"], user["user_name"]))
+            self.conn.executemany("""
+                INSERT INTO routes (year, athlete_id, activity_id, type, start_date, moving_time, distance, total_elevation_gain, route_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (year, athlete_id, activity_id) DO UPDATE SET
+                    type = excluded.type, start_date = excluded.start_date, moving_time = excluded.moving_time,
+                    distance = excluded.distance, total_elevation_gain = excluded.total_elevation_gain, route_json = excluded.route_json""",
+                [(year, user["user_id"], route["activity_id"], route.get("type"), serialize(route.get("start_date")),
+                  route.get("moving_time", 0), route.get("distance", 0), route.get("total_elevation_gain", 0),
+                  json.dumps(route, default=serialize)) for route in routes])
+            self.bump_routes_version(year)
+
+    def delete_route(self, year: int, athlete_id: int, activity_id: int):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM routes WHERE year = ? AND athlete_id = ? AND activity_id = ?", (year, athlete_id, activity_id))
+            self.bump_routes_version(year)
+
+    def bump_routes_version(self, year: int):
+        """
+        Counts a change of the routes of the year. Has to be called in the transaction of the change.
+        """
+        self.conn.execute("""
+            INSERT INTO route_versions (year, version) VALUES (?, 1)
+            ON CONFLICT (year) DO UPDATE SET version = version + 1""", (year,))
+
+    def routes_version(self, year: int):
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM route_versions WHERE year = ?", (year,)).fetchone()
+        return row[0] if row else None
+
+    def available_years(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT year FROM athletes UNION SELECT year FROM route_athletes ORDER BY year").fetchall()
+        return [str(year) for (year,) in rows]
@@ -0,0 +1,33 @@
+from flask import jsonify, request, Response
+import logging
+
+import src.shared.services.routes_data_controller as routes_data_controller
+from src.web.backend.controllers.map import BLACKLIST_ACTIVITIES, parse_list
+from src.web.backend.heatmap import get_tile, tile_version, tile_etag, HEATMAP_MAX_ZOOM
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+def heatmap(z: int, x: int, y: int):
+    """
+    Return the PNG of a heatmap tile
+
+    The years parameter selects the years (default the year of the challenge) and the athletes parameter the
+    athletes, without it the routes of all athletes are drawn. The tiles are cached on disk until the routes
+    of one of the years change, they carry an ETag so a client that already has the tile gets a 304.
+    """
+    if z > HEATMAP_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"error": f"No tile {z}/{x}/{y}, the max zoom level is {HEATMAP_MAX_ZOOM}."}), 404
+
+    years = parse_list(request.args.get('years')) or (str(routes_data_controller.YEAR),)
+    athlete_ids = frozenset(parse_list(request.args.get('athletes')))
+
+    logger.debug(f"heatmap tile {z}/{x}/{y} request received")
+    blacklist = frozenset(BLACKLIST_ACTIVITIES)
+    # the ETag only depends on the routes versions, a client that has the tile doesn't wait for it to be read or rendered
+    key = tile_version(years, athlete_ids, blacklist)
+    headers = {'ETag': tile_etag(*key), 'Cache-Control': 'no-cache'}
+    if headers['ETag'] in (tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')):
+        return Response(status=304, headers=headers)
+
+    png, _ = get_tile(years, athlete_ids, blacklist, z, x, y, key=key)
+    return Response(png, mimetype='image/png', headers=headers)
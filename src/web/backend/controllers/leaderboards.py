@@ -0,0 +1,23 @@
+from flask import jsonify, request
+import logging
+
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.route_stats as route_stats
+from src.web.backend.controllers.map import BLACKLIST_ACTIVITIES, parse_list
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+def leaderboards():
+    """
+    Return JSON of the unique cells, explored area and furthest from home leaderboards per year
+
+    The years parameter selects the years, by default the year of the challenge. The leaderboards are computed
+    from the statistics that were stored with the routes, no polyline is decoded.
+    """
+    years = parse_list(request.args.get('years')) or (str(routes_data_controller.YEAR),)
+    logger.info("leaderboards request received.")
+
+    data = {year: route_stats.get_leaderboards(int(year), frozenset(BLACKLIST_ACTIVITIES))
+            for year in years if year.isdigit()}
+
+    return jsonify(data)
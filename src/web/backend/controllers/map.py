@@ -1,9 +1,12 @@
 import json
-from flask import jsonify, render_template, request
+from flask import jsonify, render_template, request, Response, current_app
 import logging
 from traceback import format_exc
 
 import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.route_lod as route_lod
+import src.shared.services.route_index as route_index
+from src.web.backend.map_cache import map_cache
 # Initialize logger
 logger = logging.getLogger(__name__)
 
@@ -12,33 +15,94 @@ BLACKLIST_ACTIVITIES=[9525356360]
 def map():
     """
     Return JSON of the map as specified
+
+    The detail parameter (low, medium or full) or the zoom level of the map selects the precomputed
+    tier of the polylines, by default the full polylines are sent. With bbox=west,south,east,north only
+    the routes that intersect the viewport are sent.
+    The responses are cached per years, athletes and detail level until the routes of one of the years change.
+    They carry an ETag, so a client that already has the response gets a 304, and are sent compressed
+    if the client accepts it.
     """
-    years = request.args.get('years')  # Get 'years' as a list
-    athlete_ids = request.args.get('athletes')  # Get 'athlete_ids' as a list
-    
-    # Assuming 'load_routes' can accept a list of years and return data accordingly
-    data = routes_data_controller.load_routes(years)
+    years = parse_list(request.args.get('years'))  # Get 'years' as a list
+    athlete_ids = frozenset(parse_list(request.args.get('athletes')))  # Get 'athlete_ids' as a set
+    detail = parse_detail(request.args.get('detail'), request.args.get('zoom'))
+    if detail is None:
+        return jsonify({"error": f"detail has to be one of {', '.join(route_lod.DETAIL_LEVELS)} and zoom a number."}), 400
+    try:
+        bbox = route_index.parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+    except ValueError:
+        return jsonify({"error": "bbox has to be west,south,east,north in degrees."}), 400
 
-    
     logger.info("map request received")
+    key = (years, athlete_ids, detail, tuple(bbox) if bbox else None)
+    versions = {year: routes_data_controller.routes_version(int(year)) for year in years if year.isdigit()}
+    entry = map_cache.get(key, versions)
+    if entry is None:
+        entry = map_cache.put(key, versions, build_map(years, athlete_ids, detail, bbox))
+
+    body, encoding, etag = entry.encode(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if entry.matches(request.headers.get('If-None-Match')):
+        map_cache.count_not_modified()
+        return Response(status=304, headers=headers)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
+def parse_list(value: str):
+    """
+    Splits a comma separated query parameter into a tuple of its stripped, non-empty entries.
+    """
+    return tuple(entry.strip() for entry in (value or '').split(',') if entry.strip())
+
+def parse_detail(detail: str, zoom: str):
+    """
+    Returns the detail level of the polylines: the detail parameter, else the level for the zoom parameter,
+    else the full polylines. Returns None if a parameter is invalid.
+    """
+    if detail:
+        return detail if detail in route_lod.DETAIL_LEVELS else None
+    if zoom:
+        try:
+            return route_lod.detail_for_zoom(float(zoom))
+        except ValueError:
+            return None
+    return "full"
+
+def build_map(years: tuple, athlete_ids: frozenset, detail: str = "full", bbox: list = None):
+    """
+    Builds the JSON body with the routes of the athletes in the years, with the polylines of the detail level.
+    With a bounding box only the routes that intersect it are included, they are looked up in the route index.
+    """
+    if bbox is None:
+        # Assuming 'load_routes' can accept a list of years and return data accordingly
+        data = routes_data_controller.load_routes(','.join(years))
+    else:
+        indexes = {year: route_index.get_index(int(year)) for year in years if year.isdigit()}
+        data = {year: indexes[year].data if year in indexes else {} for year in years}
+
     filtered_data = {}
     for year, year_data in data.items():
         if year_data:  # Check if year_data is not an empty dict
-            # Filter athletes based on provided athlete_ids
-            filtered_athletes = {
-                k: v for k, v in year_data.get('athletes', {}).items() if str(v['user_id']) in athlete_ids
-            }
-
-            # Further filter the routes to remove any that are in the blacklist
-            for athlete_id, athlete_data in filtered_athletes.items():
-                athlete_data['routes'] = [
-                    route for route in athlete_data.get('routes', [])
+            matches = indexes[year].query(bbox) if bbox is not None else None
+
+            # Filter athletes based on provided athlete_ids, the ids have to match exactly
+            filtered_athletes = {}
+            for athlete_id, athlete_data in year_data.get('athletes', {}).items():
+                if str(athlete_data['user_id']) not in athlete_ids:
+                    continue
+                routes = athlete_data.get('routes', [])
+                if matches is not None:
+                    routes = [routes[position] for position in matches.get(athlete_id, [])]
+                # Further filter the routes to remove any that are in the blacklist, the loaded data isn't changed
+                # because the data of the route index is shared between the requests
+                filtered_athletes[athlete_id] = dict(athlete_data, routes=[
+                    route_lod.route_at_detail(route, detail) for route in routes
                     if route.get('activity_id') not in BLACKLIST_ACTIVITIES
-                ]
-            
+                ])
+
             if filtered_athletes:
                 filtered_data[year] = {'athletes': filtered_athletes}
-    
-    
-    return jsonify(filtered_data)
 
+    # same format as jsonify
+    return (current_app.json.dumps(filtered_data, indent=None, separators=(",", ":")) + "\n").encode('utf-8')
@@ -0,0 +1,36 @@
+from flask import jsonify
+import logging
+
+from src.shared.api.rate_governor import governor
+from src.shared.api.api_calls import cache_store, coalescing_stats
+from src.shared.api.http_client import latency_stats
+from src.shared.storage.backend import get_backend
+from src.shared.services import athlete_data_controller, routes_data_controller
+from src.shared.services.webhook_worker import webhook_worker
+from src.web.backend.map_cache import map_cache
+from src.web.backend.heatmap import tile_cache
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+def metrics():
+    """
+    Return JSON of the rate limit, cache, http, request coalescing, storage, webhook, map cache and heatmap tile metrics of the bot
+    """
+    logger.info("metrics request received.")
+
+    data = {
+        "rate_limit": governor.state(),
+        "cache": cache_store.stats(),
+        "http": latency_stats.as_dict(),
+        "coalesced_requests": coalescing_stats(),
+        "storage": {
+            "backend": get_backend().name,
+            "athlete_writes": athlete_data_controller.write_count,
+            "route_writes": routes_data_controller.write_count,
+        },
+        "webhook": webhook_worker.stats(),
+        "map_cache": map_cache.stats(),
+        "heatmap_tiles": tile_cache.stats(),
+    }
+
+    return jsonify(data)
@@ -0,0 +1,47 @@
+from flask import jsonify, request
+import os
+import logging
+from dotenv import load_dotenv
+
+import src.shared.services.athlete_data_controller as athlete_data_controller
+from src.shared.services.webhook_worker import webhook_worker
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# The token that was passed as verify_token when the push subscription was created
+STRAVA_VERIFY_TOKEN = os.getenv("STRAVA_VERIFY_TOKEN")
+# The id Strava returned when the push subscription was created, events of other subscriptions are rejected
+STRAVA_SUBSCRIPTION_ID = os.getenv("STRAVA_SUBSCRIPTION_ID")
+
+def strava_webhook():
+    """
+    Handles the validation request of a new Strava push subscription (GET) and the events of the subscription (POST).
+    The events are only queued, Strava expects an answer within two seconds. Events of another subscription
+    or of an athlete that isn't registered are rejected.
+    """
+    if request.method == 'GET':
+        if (STRAVA_VERIFY_TOKEN and request.args.get('hub.mode') == 'subscribe'
+                and request.args.get('hub.verify_token') == STRAVA_VERIFY_TOKEN):
+            logger.info("Strava push subscription validated.")
+            return jsonify({'hub.challenge': request.args.get('hub.challenge')})
+        logger.warning("Strava push subscription validation failed.")
+        return jsonify({'error': 'Invalid verify token'}), 403
+
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict) or 'object_id' not in event or 'object_type' not in event:
+        return jsonify({'error': 'Invalid event'}), 400
+    if not STRAVA_SUBSCRIPTION_ID or str(event.get('subscription_id')) != STRAVA_SUBSCRIPTION_ID:
+        logger.warning(f"Rejected webhook event of the unknown subscription {event.get('subscription_id')}.")
+        return jsonify({'error': 'Unknown subscription'}), 403
+    if event.get('owner_id') not in athlete_data_controller.load_athlete_ids():
+        logger.warning(f"Rejected webhook event of the unregistered athlete {event.get('owner_id')}.")
+        return jsonify({'error': 'Unknown athlete'}), 403
+
+    logger.info(f"Webhook event received: {event.get('aspect_type')} {event.get('object_type')} {event.get('object_id')}")
+    if not webhook_worker.enqueue(event):
+        # Strava retries events that weren't answered with 200
+        return jsonify({'error': 'Queue is full'}), 503
+    return jsonify({'status': 'queued'})
@@ -0,0 +1,66 @@
+"""
+file: fake_webhook_poster.py
+
+description: This script sends fake Strava push events to the /strava_webhook endpoint, so the webhook can be
+tested locally without a Strava push subscription. It can also send the validation request Strava sends when a
+subscription is created.
+
+usage: python -m src.web.backend.fake_webhook_poster --owner-id 123 --activity-id 456 [--aspect create|update|delete]
+       python -m src.web.backend.fake_webhook_poster --validate
+
+Author: Julian Friedl
+"""
+
+import argparse
+import os
+import time
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def validate(url: str, verify_token: str):
+    """
+    Sends the subscription validation request and returns the response.
+    """
+    params = {"hub.mode": "subscribe", "hub.challenge": "fake-challenge", "hub.verify_token": verify_token}
+    return requests.get(url, params=params, timeout=10)
+
+
+def post_event(url: str, owner_id: int, object_id: int, aspect_type: str = "create", object_type: str = "activity", updates: dict = None,
+               subscription_id: int = 0):
+    """
+    Sends an event in the format Strava uses and returns the response.
+    """
+    event = {
+        "aspect_type": aspect_type,
+        "event_time": int(time.time()),
+        "object_id": object_id,
+        "object_type": object_type,
+        "owner_id": owner_id,
+        "subscription_id": subscription_id,
+        "updates": updates or {},
+    }
+    return requests.post(url, json=event, timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send fake Strava push events to the webhook.")
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('PORT', 5000)}/strava_webhook", help="URL of the webhook")
+    parser.add_argument("--validate", action="store_true", help="Send the subscription validation request")
+    parser.add_argument("--verify-token", default=os.getenv("STRAVA_VERIFY_TOKEN", ""), help="Token for the validation request")
+    parser.add_argument("--subscription-id", type=int, default=int(os.getenv("STRAVA_SUBSCRIPTION_ID", 0)),
+                        help="Id of the push subscription the event belongs to")
+    parser.add_argument("--owner-id", type=int, help="Strava id of the athlete")
+    parser.add_argument("--activity-id", type=int, help="Strava id of the activity")
+    parser.add_argument("--aspect", default="create", choices=["create", "update", "delete"], help="Type of the event")
+    args = parser.parse_args()
+
+    if args.validate:
+        response = validate(args.url, args.verify_token)
+    elif args.owner_id is None or args.activity_id is None:
+        parser.error("--owner-id and --activity-id are required for an event")
+    else:
+        response = post_event(args.url, args.owner_id, args.activity_id, args.aspect, subscription_id=args.subscription_id)
+    print(response.status_code, response.text)
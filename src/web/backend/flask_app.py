@@ -9,7 +9,11 @@ import logging
 # Import the strava_auth function
 from src.web.backend.controllers.strava_auth import strava_auth
 from src.web.backend.controllers.map import map
+from src.web.backend.controllers.heatmap import heatmap
+from src.web.backend.controllers.leaderboards import leaderboards
 from src.web.backend.controllers.getAvailable import athletes, years
+from src.web.backend.controllers.metrics import metrics
+from src.web.backend.controllers.strava_webhook import strava_webhook
 
 from src.shared.config.log_config import setup_logging
 
@@ -25,9 +29,13 @@ CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5000", "http://12
 
 # Register the strava_auth function as a route
 app.route('/strava_auth')(strava_auth)
+app.route('/strava_webhook', methods=['GET', 'POST'])(strava_webhook)
 app.route('/api/map', methods=['GET'])(map)
+app.route('/api/heatmap/<int:z>/<int:x>/<int:y>.png', methods=['GET'])(heatmap)
+app.route('/api/leaderboards', methods=['GET'])(leaderboards)
 app.route('/api/athletes', methods=['GET'])(athletes)
 app.route('/api/years', methods=['GET'])(years)
+app.route('/api/metrics', methods=['GET'])(metrics)
 
 def run():
     """
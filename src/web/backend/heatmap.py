@@ -0,0 +1,424 @@
+"""
+file: heatmap.py
+
+description: This module renders the heatmap tiles of the routes. A tile is a 256x256 pixel square of the web
+mercator map (the z/x/y scheme of OpenStreetMap). The routes that intersect the tile are looked up in the route
+index, their polylines (at the detail level of the zoom) are sampled about once per pixel and every pixel counts
+the routes that pass through it. The counts are colored on a logarithmic scale and encoded as an indexed PNG.
+
+The tiles are cached on disk in a directory per years and athletes (a variant), with a subdirectory per routes
+version of the years. When routes are saved the version changes, the tiles are rendered again into a new
+subdirectory and the older ones are removed. The least recently used variants are removed beyond
+HEATMAP_CACHE_VARIANTS.
+
+Author: Julian Friedl
+"""
+
+import hashlib
+import logging
+import math
+import os
+import shutil
+import struct
+import time
+import zlib
+from threading import Lock
+from dotenv import load_dotenv
+
+import numpy as np
+
+import src.shared.services.route_index as route_index
+import src.shared.services.route_lod as route_lod
+import src.shared.services.routes_data_controller as routes_data_controller
+from src.shared.services.single_flight import SingleFlight
+from src.shared.config.log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+HEATMAP_CACHE_PATH = os.path.join(PROJECT_ROOT, 'cache', 'heatmap')
+
+HEATMAP_MAX_ZOOM = int(os.getenv("HEATMAP_MAX_ZOOM", 18))
+HEATMAP_SATURATION = max(int(os.getenv("HEATMAP_SATURATION", 10)), 1)  # routes through a pixel for the full color
+HEATMAP_CACHE_VARIANTS = max(int(os.getenv("HEATMAP_CACHE_VARIANTS", 32)), 1)  # combinations of years and athletes on disk
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798  # the web mercator map ends here
+
+# (level, red, green, blue, alpha) from a single route to HEATMAP_SATURATION routes through a pixel
+COLOR_STOPS = np.array([
+    (1, 252, 76, 2, 120),
+    (128, 255, 140, 0, 220),
+    (255, 255, 255, 200, 255),
+])
+
+
+def tile_bounds(z: int, x: int, y: int):
+    """
+    Returns the bounding box [west, south, east, north] of a tile in degrees.
+    """
+    tiles = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / tiles))))
+
+    return [x / tiles * 360 - 180, latitude(y + 1), (x + 1) / tiles * 360 - 180, latitude(y)]
+
+
+def project(points: np.ndarray, z: int, x: int, y: int):
+    """
+    Projects (lat, lng) points onto the pixels of a tile, points outside of the tile get coordinates outside
+    of 0 to TILE_SIZE.
+    """
+    tiles = 2 ** z
+    lat = np.radians(np.clip(points[:, 0], -MAX_LATITUDE, MAX_LATITUDE))
+    px = ((points[:, 1] + 180) / 360 * tiles - x) * TILE_SIZE
+    py = ((1 - np.log(np.tan(math.pi / 4 + lat / 2)) / math.pi) / 2 * tiles - y) * TILE_SIZE
+    return px, py
+
+
+def rasterize(px: np.ndarray, py: np.ndarray, route_ids: np.ndarray):
+    """
+    Counts the routes that pass through every pixel of a tile.
+
+    Args:
+        px, py (np.ndarray): Pixel coordinates of the points of all routes, route after route.
+        route_ids (np.ndarray): The route of every point, a route passes through a pixel at most once.
+
+    Returns:
+        np.ndarray: TILE_SIZE x TILE_SIZE route counts.
+    """
+    # segments between two consecutive points of the same route
+    same_route = route_ids[:-1] == route_ids[1:]
+    x0, y0, ids = px[:-1][same_route], py[:-1][same_route], route_ids[:-1][same_route]
+    dx, dy = px[1:][same_route] - x0, py[1:][same_route] - y0
+
+    # clip the segments to the tile and a pixel around it (Liang-Barsky), a segment that crosses the tile at a
+    # high zoom level would otherwise be sampled for millions of pixels outside of it
+    t0, t1 = np.zeros(len(x0)), np.ones(len(x0))
+    for start, delta in ((x0, dx), (y0, dy)):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ta, tb = (-1 - start) / delta, (TILE_SIZE + 1 - start) / delta
+        moving = delta != 0
+        t0 = np.where(moving, np.maximum(t0, np.minimum(ta, tb)), t0)
+        t1 = np.where(moving, np.minimum(t1, np.maximum(ta, tb)), t1)
+        outside = ~moving & ((start < -1) | (start > TILE_SIZE + 1))
+        t1[outside] = -1
+    visible = t0 <= t1
+    x0, y0, dx, dy, ids, t0, t1 = (a[visible] for a in (x0, y0, dx, dy, ids, t0, t1))
+
+    # sample every segment twice per pixel of its length, with one sample per pixel rounding errors at the
+    # pixel borders would leave gaps in the line
+    samples = np.ceil(2 * np.maximum(np.abs(dx), np.abs(dy)) * (t1 - t0)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(samples)), samples)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)
+    t = t0[segment] + (t1 - t0)[segment] * step / np.maximum(samples - 1, 1)[segment]
+    column = np.floor(x0[segment] + t * dx[segment]).astype(np.int64)
+    row = np.floor(y0[segment] + t * dy[segment]).astype(np.int64)
+
+    inside = (column >= 0) & (column < TILE_SIZE) & (row >= 0) & (row < TILE_SIZE)
+    pixels = (row[inside] * TILE_SIZE + column[inside]).astype(np.uint16)
+    ids = ids[segment][inside]
+    # a route is counted once per pixel, even if it passes through the pixel several times. The samples are sorted
+    # by pixel (a radix sort for uint16), the stable sort keeps the samples of a route next to each other
+    order = np.argsort(pixels, kind="stable")
+    pixels, ids = pixels[order], ids[order]
+    first = np.ones(len(pixels), dtype=bool)
+    first[1:] = (pixels[1:] != pixels[:-1]) | (ids[1:] != ids[:-1])
+    return np.bincount(pixels[first], minlength=TILE_SIZE * TILE_SIZE).reshape(TILE_SIZE, TILE_SIZE)
+
+
+def colorize(counts: np.ndarray):
+    """
+    Maps the route counts of the pixels to palette indices on a logarithmic scale, 0 is transparent.
+
+    Returns:
+        tuple: (indices as uint8 array, palette as (n, 4) RGBA array with n = highest used index + 1)
+    """
+    levels = np.log1p(np.minimum(counts, HEATMAP_SATURATION)) / math.log1p(HEATMAP_SATURATION)
+    indices = np.where(counts > 0, np.maximum(np.rint(levels * 255), 1), 0).astype(np.uint8)
+
+    level = np.arange(int(indices.max()) + 1)
+    palette = np.stack([np.interp(level, COLOR_STOPS[:, 0], COLOR_STOPS[:, channel]) for channel in range(1, 5)], axis=1)
+    palette[0] = 0
+    return indices, np.rint(palette).astype(np.uint8)
+
+
+def encode_png(indices: np.ndarray, palette: np.ndarray):
+    """
+    Encodes an image of palette indices as an 8 bit indexed PNG, the alpha of the palette goes into tRNS.
+    """
+    def chunk(kind: bytes, data: bytes):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    height, width = indices.shape
+    # every row starts with its filter type, 0 (none)
+    rows = np.hstack((np.zeros((height, 1), dtype=np.uint8), indices))
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+        chunk(b"PLTE", palette[:, :3].tobytes()),
+        chunk(b"tRNS", palette[:, 3].tobytes()),
+        chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)),
+        chunk(b"IEND", b""),
+    ))
+
+
+def render_tile(indexes: dict, athlete_ids: frozenset, blacklist: frozenset, z: int, x: int, y: int):
+    """
+    Renders the PNG of a tile from the routes of the athletes in the route indexes (year -> RouteIndex).
+    Without athlete ids the routes of all athletes are drawn, the activities in the blacklist never are.
+    """
+    bbox = tile_bounds(z, x, y)
+    detail = route_lod.detail_for_zoom(z)
+    encoded = []
+    for index in indexes.values():
+        athletes = index.data.get("athletes", {})
+        for athlete_key, positions in index.query(bbox).items():
+            if athlete_ids and str(athletes[athlete_key]["user_id"]) not in athlete_ids:
+                continue
+            for position in positions:
+                route = athletes[athlete_key]["routes"][position]
+                if route.get("activity_id") not in blacklist:
+                    encoded.append((route_lod.route_at_detail(route, detail).get("map") or {}).get("summary_polyline"))
+
+    # the polylines of all routes are decoded at once, decoding them one by one took most of the time of a tile
+    points, route_ids = route_lod.decode_many(encoded)
+    if len(points) > 1:
+        px, py = project(points, z, x, y)
+        counts = rasterize(px, py, route_ids)
+    else:
+        counts = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.int64)
+    return encode_png(*colorize(counts))
+
+
+class TileCache:
+    """
+    Disk cache of the rendered tiles.
+
+    The version directory of a variant is named after the stamps of the routes versions of its years (they only
+    grow when routes are saved) and a hash of the versions. A request that read the versions before the routes
+    changed renders its tile without caching it, it never switches the variant back to the older version or
+    removes the tiles of the newer one. At most HEATMAP_CACHE_VARIANTS variants are kept, the ones that weren't
+    used for the longest time are removed first.
+    """
+
+    def __init__(self, path: str = HEATMAP_CACHE_PATH, max_variants: int = HEATMAP_CACHE_VARIANTS):
+        self.path = path
+        self.max_variants = max_variants
+        self.lock = Lock()
+        self.flights = SingleFlight()  # a tile that is requested several times at once is rendered once
+        self.current = {}  # variant -> latest version directory
+        self.touched = {}  # variant -> time the modification time of its directory was last set
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(years: tuple, athlete_ids: frozenset, blacklist: frozenset, versions: dict):
+        """
+        Returns the (variant, version) directory names of the years, athletes and blacklist with the routes versions.
+        """
+        variant = hashlib.sha1(repr((years, sorted(athlete_ids), sorted(blacklist))).encode()).hexdigest()[:16]
+        stamps = "_".join(str(version_stamp(versions[year])) for year in years)
+        version = hashlib.sha1(repr(sorted(versions.items())).encode()).hexdigest()[:16]
+        return variant, f"{stamps}-{version}"
+
+    def get(self, variant: str, version: str, z: int, x: int, y: int, render):
+        """
+        Returns the cached PNG of the tile, or renders it with render() and caches it.
+        """
+        file_path = os.path.join(self.path, variant, version, str(z), str(x), f"{y}.png")
+        try:
+            with open(file_path, "rb") as file:
+                png = file.read()
+            with self.lock:
+                self.hits += 1
+            self.touch(variant)
+            return png
+        except FileNotFoundError:
+            pass
+
+        png, _ = self.flights.do(file_path, self.render, variant, version, file_path, render)
+        return png
+
+    def render(self, variant: str, version: str, file_path: str, render):
+        with self.lock:
+            self.misses += 1
+        latest = self.use_version(variant, version)
+        png = render()
+        with self.lock:
+            # the routes can have changed again while the tile was rendered
+            latest = latest and self.current.get(variant) == version
+        if not latest:
+            return png
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # written to a temporary file first, so a concurrent reader never gets half a tile
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(png)
+        os.replace(temp_path, file_path)
+        self.touch(variant)
+        return png
+
+    def use_version(self, variant: str, version: str):
+        """
+        Makes the version the latest one of the variant, unless a newer one is in use already.
+
+        Returns:
+            bool: True if the version is the latest one and its tiles can be cached.
+        """
+        with self.lock:
+            current = self.current.get(variant)
+            new_variant = current is None
+            if new_variant:
+                current = self.latest_on_disk(variant)
+            if current == version:
+                self.current[variant] = version
+                return True
+            if current is not None and not is_newer(version, current):
+                logger.debug(f"Not caching the tiles of {variant}/{version}, {current} is newer.")
+                return False
+            self.current[variant] = version
+        self.remove_old_versions(variant, version)
+        if new_variant:
+            self.evict_variants(variant)
+        return True
+
+    def latest_on_disk(self, variant: str):
+        """
+        Returns the newest version directory of a variant that is on disk, e.g. from before a restart.
+        """
+        variant_path = os.path.join(self.path, variant)
+        if not os.path.isdir(variant_path):
+            return None
+        latest = None
+        for name in os.listdir(variant_path):
+            if latest is None or is_newer(name, latest):
+                latest = name
+        return latest
+
+    def remove_old_versions(self, variant: str, version: str):
+        """
+        Removes the tiles of a variant that were rendered before the routes changed, a newer version is kept.
+        """
+        variant_path = os.path.join(self.path, variant)
+        if not os.path.isdir(variant_path):
+            return
+        for name in os.listdir(variant_path):
+            if name != version and not is_newer(name, version):
+                shutil.rmtree(os.path.join(variant_path, name), ignore_errors=True)
+                logger.info(f"Removed the outdated heatmap tiles {variant}/{name}.")
+
+    def evict_variants(self, keep: str):
+        """
+        Removes the variants that weren't used for the longest time, so at most max_variants are on disk.
+        Every combination of years and athletes is a variant of its own, without a limit they would fill the disk.
+        """
+        if not os.path.isdir(self.path):
+            return
+        variants = []
+        for name in os.listdir(self.path):
+            try:
+                if name != keep:
+                    variants.append((os.stat(os.path.join(self.path, name)).st_mtime, name))
+            except FileNotFoundError:
+                continue
+        variants.sort(reverse=True)
+        # the variant that is used now may not be on disk yet, it counts as one of them
+        for _, name in variants[self.max_variants - 1:]:
+            with self.lock:
+                self.current.pop(name, None)
+                self.touched.pop(name, None)
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            logger.info(f"Removed the heatmap tiles of the least recently used variant {name}.")
+
+    def touch(self, variant: str):
+        """
+        Sets the modification time of the variant directory, which tells the eviction when it was used last.
+        It is set at most once a minute per variant.
+        """
+        now = time.time()
+        with self.lock:
+            if now - self.touched.get(variant, 0) < 60:
+                return
+            self.touched[variant] = now
+        try:
+            os.utime(os.path.join(self.path, variant))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "variants": len(self.current)}
+
+
+def version_stamp(version):
+    """
+    Returns a number of a routes version that grows when the routes are saved: the counter of the SQLite backend,
+    the modification time of the routes file of the JSON backend ("mtime_ns-size") and 0 if there are no routes.
+    """
+    if version is None:
+        return 0
+    if isinstance(version, int):
+        return version
+    return int(str(version).split("-", 1)[0])
+
+
+def version_stamps(name: str):
+    """
+    Returns the stamps of a version directory name, or None for directories from before the names had stamps.
+    """
+    try:
+        return [int(stamp) for stamp in name.split("-", 1)[0].split("_") if stamp]
+    except ValueError:
+        return None
+
+
+def is_newer(version: str, other: str):
+    """
+    Returns True if the version directory name is newer than the other one, i.e. the routes of at least one of
+    the years were saved after the other one and none before.
+    """
+    if version == other:
+        return False
+    stamps, other_stamps = version_stamps(version), version_stamps(other)
+    if stamps is None or other_stamps is None:
+        return other_stamps is None
+    if len(stamps) != len(other_stamps):
+        return True
+    return all(stamp >= other_stamp for stamp, other_stamp in zip(stamps, other_stamps))
+
+
+def tile_version(years: tuple, athlete_ids: frozenset, blacklist: frozenset):
+    """
+    Returns the (variant, version) of the tiles of the years, athletes and blacklist. They only change when the
+    routes of the years change, so the ETag of a tile is known before the tile is read or rendered.
+    """
+    years = tuple(year for year in years if year.isdigit())
+    versions = {year: routes_data_controller.routes_version(int(year)) for year in years}
+    return tile_cache.key(years, athlete_ids, blacklist, versions)
+
+
+def tile_etag(variant: str, version: str):
+    return f'"{variant}-{version}"'
+
+
+def get_tile(years: tuple, athlete_ids: frozenset, blacklist: frozenset, z: int, x: int, y: int, key: tuple = None):
+    """
+    Returns the PNG of a tile and its ETag, from the disk cache if the routes of the years didn't change.
+    key is the (variant, version) of tile_version, if the caller already has it.
+    """
+    years = tuple(year for year in years if year.isdigit())
+    variant, version = key or tile_version(years, athlete_ids, blacklist)
+
+    def render():
+        indexes = {year: route_index.get_index(int(year)) for year in years}
+        return render_tile(indexes, athlete_ids, blacklist, z, x, y)
+
+    return tile_cache.get(variant, version, z, x, y, render), tile_etag(variant, version)
+
+
+tile_cache = TileCache()
@@ -0,0 +1,123 @@
+"""
+file: map_cache.py
+
+description: This module contains the in-memory cache of the /api/map responses. A response is stored once per
+combination of years and athletes, together with the routes version of every year it was built from, a strong
+ETag and its gzip (and, if the brotli package is installed, brotli) compressed body. As long as the routes didn't
+change a request is answered from the cache, or with 304 if the client already has the response.
+
+Author: Julian Friedl
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from dotenv import load_dotenv
+
+from src.shared.config.log_config import setup_logging
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MAP_CACHE_SIZE = int(os.getenv("MAP_CACHE_SIZE", 32))  # number of cached responses
+
+
+class CachedResponse:
+    """
+    A response body with its ETag and its compressed variants, compressed once when it is cached.
+    """
+
+    def __init__(self, versions: dict, body: bytes):
+        self.versions = versions
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.encoded = {"gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(body)
+
+    def encode(self, accept_encoding: str):
+        """
+        Returns the body in the best encoding the client accepts, the encoding (None for identity) and the ETag.
+        The ETag differs per encoding, because it is strong and the bytes differ.
+        """
+        accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.encoded and encoding in accepted:
+                return self.encoded[encoding], encoding, f'"{self.etag}-{encoding}"'
+        return self.body, None, f'"{self.etag}"'
+
+    def matches(self, if_none_match: str):
+        """
+        Returns True if the If-None-Match header contains one of the ETags of the response.
+        """
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in tags:
+            return True
+        # weak comparison is allowed for If-None-Match, proxies may have added W/
+        tags = {tag[2:] if tag.startswith("W/") else tag for tag in tags}
+        return any(tag.strip('"').split("-")[0] == self.etag for tag in tags)
+
+
+class MapCache:
+
+    def __init__(self, max_entries: int = MAP_CACHE_SIZE):
+        self.lock = Lock()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> CachedResponse, the least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key, versions: dict):
+        """
+        Returns the cached response for the key, or None if there is none or the routes changed since it was built.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.versions != versions:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, versions: dict, body: bytes):
+        """
+        Caches a response body that was built from the routes with the given versions.
+        """
+        entry = CachedResponse(versions, body)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def count_not_modified(self):
+        with self.lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "bytes": sum(len(entry.body) + sum(map(len, entry.encoded.values())) for entry in self.entries.values()),
+            }
+
+
+map_cache = MapCache()
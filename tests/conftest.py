@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the modules of the bot as src.*, like the bot does when it is started from the root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
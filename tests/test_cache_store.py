@@ -0,0 +1,82 @@
+"""
+file: test_cache_store.py
+
+description: Tests the SQLite cache store of the API responses: expiry after the TTL, eviction of the least
+recently used entries when the store exceeds its byte budget, invalidation of the entries of an athlete and
+reopening an existing database.
+
+Author: Julian Friedl
+"""
+
+import time
+
+import pytest
+
+from src.shared.api.cache_store import CacheStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "api_cache.sqlite3")
+
+
+def test_entries_expire_after_their_ttl(path):
+    store = CacheStore(path)
+    store.set("short", "1", {"a": 1}, ttl=0.05)
+    store.set("forever", "1", {"b": 2})
+    assert store.get("short") == {"a": 1}
+    time.sleep(0.1)
+    assert store.get("short") is None
+    assert store.get("forever") == {"b": 2}
+    assert store.stats()["expirations"] == 1
+    assert store.stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(path):
+    value = "x" * 100  # 102 bytes as JSON
+    store = CacheStore(path, max_bytes=350)
+    for key in ("a", "b", "c"):
+        store.set(key, "1", value)
+        time.sleep(0.01)
+    assert store.get("a") == value  # a is now used more recently than b
+    time.sleep(0.01)
+    store.set("d", "1", value)
+
+    assert store.get("b") is None
+    assert [store.get(key) for key in ("a", "c", "d")] == [value] * 3
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["bytes"] <= 350
+
+
+def test_replacing_an_entry_doesnt_count_its_size_twice(path):
+    store = CacheStore(path, max_bytes=250)
+    for _ in range(5):
+        store.set("a", "1", "x" * 100)
+    store.set("b", "1", "x" * 100)
+    assert store.stats()["evictions"] == 0
+    assert store.stats()["bytes"] == 204
+
+
+def test_invalidate_user_removes_only_their_entries(path):
+    store = CacheStore(path)
+    store.set("a1", "1", [1])
+    store.set("a2", 1, [2])
+    store.set("b1", "2", [3])
+    assert store.invalidate_user(1) == 2
+    assert store.get("a1") is None and store.get("a2") is None
+    assert store.get("b1") == [3]
+    assert store.stats()["bytes"] == 3
+
+
+def test_reopening_keeps_entries_and_size(path):
+    store = CacheStore(path)
+    store.set("a", "1", {"x": "y" * 50})
+    store.set("b", "2", [1, 2, 3], ttl=60)
+    size = store.stats()["bytes"]
+    store.conn.close()
+
+    reopened = CacheStore(path)
+    assert reopened.get("a") == {"x": "y" * 50}
+    assert reopened.get("b") == [1, 2, 3]
+    assert reopened.stats()["bytes"] == size
+    assert reopened.invalidate_user("1") == 1
@@ -0,0 +1,180 @@
+"""
+file: test_fetch_engine.py
+
+description: Tests the paging and the per-athlete concurrency of the fetch engine: the prefetching of iter_pages
+and aiter_pages stops at the first short or empty page, the pages arrive in order and errors of a page or an
+athlete are raised to the caller. The sync of an athlete is tested end to end with a fake send_request.
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import datetime
+import threading
+import time
+
+import pytest
+
+import src.shared.api.api_calls as api_calls
+import src.shared.services.activities_data_controller as activities_data_controller
+from src.shared.models.athlete import Athlete
+from src.shared.services.fetch_engine import iter_pages, aiter_pages, map_athletes, gather_athletes
+
+PER_PAGE = 10
+
+
+class FakePages:
+    """
+    A paginated endpoint with total entries, it records the requested pages.
+    """
+
+    def __init__(self, total: int, fail_page: int = None):
+        self.total = total
+        self.fail_page = fail_page
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def get(self, page: int):
+        with self.lock:
+            self.requested.append(page)
+        if page == self.fail_page:
+            raise RuntimeError(f"page {page} failed")
+        start = (page - 1) * PER_PAGE
+        return list(range(start, min(start + PER_PAGE, self.total))), page
+
+    def fetch_page(self, page: int):
+        # the later pages arrive first, the pages still have to be yielded in order
+        time.sleep(0.02 / page)
+        return self.get(page)
+
+    async def fetch_page_async(self, page: int):
+        await asyncio.sleep(0.02 / page)
+        return self.get(page)
+
+
+def collect(pages: FakePages, prefetch: int = 3):
+    return list(iter_pages(pages.fetch_page, PER_PAGE, prefetch))
+
+
+def acollect(pages: FakePages, prefetch: int = 3):
+    async def run():
+        return [page async for page in aiter_pages(pages.fetch_page_async, PER_PAGE, prefetch)]
+    return asyncio.run(run())
+
+
+@pytest.fixture(params=[collect, acollect], ids=["threads", "asyncio"])
+def pages_of(request):
+    return request.param
+
+
+@pytest.mark.parametrize("total, yielded", [
+    (0, [1]),  # empty first page
+    (7, [1]),  # short first page, nothing is prefetched
+    (10, [1, 2]),  # full first page, the empty second page is the last one
+    (25, [1, 2, 3]),  # short third page
+    (40, [1, 2, 3, 4, 5]),  # the empty fifth page is in the second round of prefetching
+])
+def test_pages_stop_at_the_first_short_or_empty_page(pages_of, total, yielded):
+    pages = FakePages(total)
+    result = pages_of(pages)
+    assert [page for page, _, _ in result] == yielded
+    assert [entry for _, data, _ in result for entry in data] == list(range(total))
+    assert all(page == info for page, _, info in result)
+    if total < PER_PAGE:
+        assert pages.requested == [1]
+
+
+def test_pages_are_prefetched_in_rounds(pages_of):
+    pages = FakePages(25)
+    pages_of(pages, prefetch=3)
+    # page 1 alone, then pages 2-4 at the same time, page 4 is dropped
+    assert sorted(pages.requested) == [1, 2, 3, 4]
+
+
+def test_pages_before_a_failed_page_are_yielded(pages_of):
+    pages = FakePages(100, fail_page=3)
+    yielded = []
+
+    def consume():
+        if pages_of is collect:
+            for page, _, _ in iter_pages(pages.fetch_page, PER_PAGE, 3):
+                yielded.append(page)
+        else:
+            async def run():
+                async for page, _, _ in aiter_pages(pages.fetch_page_async, PER_PAGE, 3):
+                    yielded.append(page)
+            asyncio.run(run())
+
+    with pytest.raises(RuntimeError, match="page 3 failed"):
+        consume()
+    assert yielded == [1, 2]
+
+
+def test_map_athletes_keeps_the_order():
+    def worker(cred):
+        time.sleep(0.01 * (5 - cred))
+        return cred * 2
+    assert map_athletes(worker, [1, 2, 3, 4], max_workers=4) == [2, 4, 6, 8]
+    assert map_athletes(worker, []) == []
+
+
+def test_map_athletes_raises_the_error_of_a_worker():
+    started = []
+
+    def worker(cred):
+        started.append(cred)
+        if cred == 2:
+            raise ValueError("athlete 2 failed")
+        time.sleep(0.05)
+        return cred
+
+    with pytest.raises(ValueError, match="athlete 2 failed"):
+        map_athletes(worker, list(range(1, 11)), max_workers=2)
+    # the athletes that weren't started yet are cancelled
+    assert len(started) < 10
+
+
+def test_gather_athletes_raises_the_error_of_a_worker():
+    async def worker(cred):
+        if cred == 2:
+            raise ValueError("athlete 2 failed")
+        await asyncio.sleep(0.01)
+        return cred
+
+    async def run():
+        assert await gather_athletes(worker, [1, 3], max_concurrency=1) == [1, 3]
+        with pytest.raises(ValueError, match="athlete 2 failed"):
+            await gather_athletes(worker, [1, 2, 3])
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def athlete(tmp_path, monkeypatch):
+    monkeypatch.setattr(activities_data_controller, "ACTIVITIES_PATH", str(tmp_path))
+    return Athlete({
+        "strava_data": {"access_token": "t", "refresh_token": "r", "expires_at": time.time() + 99999,
+                        "athlete": {"id": 1, "firstname": "A", "lastname": "B", "profile_medium": ""}},
+        "constants": {}, "vars": {}, "discord_user_id": "1",
+    }, refresh=False)
+
+
+@pytest.mark.parametrize("total, pages, requests", [(450, 3, 4), (400, 3, 4), (0, 1, 1)])
+def test_sync_requests_the_pages_up_to_the_last_one(athlete, monkeypatch, total, pages, requests):
+    start = datetime.datetime(activities_data_controller.YEAR, 1, 5, 8)
+    activities = [{"id": i + 1, "type": "Run", "start_date": (start + datetime.timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "start_date_local": (start + datetime.timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ")} for i in range(total)]
+    requested = []
+
+    def send_request(url, headers, params, username, user_id, cache_key, ttl, priority, max_wait):
+        requested.append(params["page"])
+        first = (params["page"] - 1) * params["per_page"]
+        return activities[first:first + params["per_page"]]
+
+    monkeypatch.setattr(api_calls, "send_request", send_request)
+    # the pages after the last one were requested speculatively, only the pages up to the last one are counted
+    assert athlete.sync_activities(cache=False) == (pages, 0)
+    assert sorted(requested) == list(range(1, requests + 1))
+    stored = activities_data_controller.iter_activities(1, datetime.date(activities_data_controller.YEAR, 1, 1),
+                                                         datetime.date(activities_data_controller.YEAR + 1, 1, 1))
+    assert [activity["id"] for activity in stored] == [activity["id"] for activity in activities]
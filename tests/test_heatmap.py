@@ -0,0 +1,109 @@
+"""
+file: test_heatmap.py
+
+description: Tests the versions of the heatmap tiles: a client that sends the ETag of a tile gets a 304 before
+the tile is read, and the tile cache never switches back to an older routes version or removes the newer tiles.
+
+Author: Julian Friedl
+"""
+
+import math
+import os
+import random
+
+import polyline
+import pytest
+
+import src.shared.services.route_index as route_index
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.storage.backend as storage_backend
+import src.web.backend.controllers.heatmap as heatmap_controller
+import src.web.backend.heatmap as heatmap
+from src.shared.models.activity import Activity
+from src.shared.storage.sqlite_backend import SqliteBackend
+from src.web.backend.flask_app import app
+
+YEAR = 2026
+USER = {"user_id": 1, "discord_user_id": "1", "user_name": "A B"}
+TILE_URL = f"/api/heatmap/10/544/360.png?years={YEAR}"
+
+
+def make_route(activity_id: int):
+    rnd = random.Random(activity_id)
+    lat, lng, points = 47.26, 11.39, []
+    for _ in range(100):
+        heading = rnd.uniform(0, 2 * math.pi)
+        lat, lng = lat + 0.0003 * math.cos(heading), lng + 0.0004 * math.sin(heading)
+        points.append((round(lat, 5), round(lng, 5)))
+    return routes_data_controller.build_route(Activity({
+        "id": activity_id, "name": "run", "type": "Run", "start_date_local": f"{YEAR}-03-01T08:00:00Z",
+        "moving_time": 3600, "elapsed_time": 3700, "distance": 10000, "total_elevation_gain": 100,
+        "map": {"id": "a", "summary_polyline": polyline.encode(points)},
+    }))
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    backend = SqliteBackend(str(tmp_path / "challenge.sqlite3"))
+    monkeypatch.setattr(storage_backend, "backend", backend)
+    # the versions of a new database start at 1 again, nothing may be left from another test
+    monkeypatch.setattr(route_index, "indexes", {})
+    monkeypatch.setattr(heatmap, "tile_cache", heatmap.TileCache(str(tmp_path / "heatmap")))
+    backend.save_routes(YEAR, USER, [make_route(1), make_route(2)])
+    return backend
+
+
+def test_heatmap_answers_304_without_reading_the_tile(backend, monkeypatch):
+    client = app.test_client()
+    response = client.get(TILE_URL)
+    assert response.status_code == 200 and response.data.startswith(b"\x89PNG")
+    etag = response.headers["ETag"]
+
+    def get_tile(*args, **kwargs):
+        raise AssertionError("the tile was read for a 304")
+
+    monkeypatch.setattr(heatmap_controller, "get_tile", get_tile)
+    response = client.get(TILE_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag
+
+    monkeypatch.setattr(heatmap_controller, "get_tile", heatmap.get_tile)
+    backend.save_routes(YEAR, USER, [make_route(3)])
+    response = client.get(TILE_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("version, other, newer", [
+    ("5-a", "4-b", True),
+    ("4-b", "5-a", False),
+    ("5-a", "5-a", False),
+    ("5_3-a", "4_3-b", True),
+    ("5_2-a", "4_3-b", False),  # one year is newer and one older, e.g. a mix of a restored backup
+    ("5_3-a", "5_3-b", True),  # the same stamps with other versions, e.g. another backend
+    ("5-a", "0123456789abcdef", True),  # directories from before the names had stamps are older
+    ("0123456789abcdef", "5-a", False),
+    ("5_3-a", "5-b", True),  # other years
+])
+def test_is_newer(version, other, newer):
+    assert heatmap.is_newer(version, other) == newer
+
+
+def test_tile_versions_never_move_backwards(tmp_path):
+    cache = heatmap.TileCache(str(tmp_path))
+    variant = "variant"
+    assert cache.get(variant, "1-a", 3, 1, 2, lambda: b"first") == b"first"
+    assert cache.get(variant, "2-b", 3, 1, 2, lambda: b"second") == b"second"
+    assert os.listdir(tmp_path / variant) == ["2-b"]
+
+    # a request that read the versions before the routes changed doesn't switch back or remove the newer tiles
+    assert not cache.use_version(variant, "1-a")
+    assert cache.current[variant] == "2-b"
+    assert cache.get(variant, "1-a", 3, 1, 3, lambda: b"old") == b"old"
+    assert os.listdir(tmp_path / variant) == ["2-b"]
+
+    # a restarted server finds the newest version on disk
+    restarted = heatmap.TileCache(str(tmp_path))
+    assert not restarted.use_version(variant, "1-a")
+    assert restarted.get(variant, "2-b", 3, 1, 2, lambda: b"rendered again") == b"second"
+
+    assert restarted.use_version(variant, "3-c")
+    assert os.listdir(tmp_path / variant) == []
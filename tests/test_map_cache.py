@@ -0,0 +1,98 @@
+"""
+file: test_map_cache.py
+
+description: Tests the cached /api/map responses through the Flask test client: a client that sends the ETag it
+has gets a 304, every encoding of a response has an ETag of its own and the ETag changes with the routes.
+
+Author: Julian Friedl
+"""
+
+import gzip
+import json
+import math
+import random
+
+import polyline
+import pytest
+
+import src.shared.services.route_index as route_index
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.storage.backend as storage_backend
+from src.shared.models.activity import Activity
+from src.shared.storage.sqlite_backend import SqliteBackend
+from src.web.backend.flask_app import app
+from src.web.backend.map_cache import map_cache
+
+YEAR = 2026
+USER = {"user_id": 1, "discord_user_id": "1", "user_name": "A B"}
+MAP_URL = f"/api/map?years={YEAR}&athletes=1"
+
+
+def make_route(activity_id: int):
+    rnd = random.Random(activity_id)
+    lat, lng, points = 47.26, 11.39, []
+    for _ in range(100):
+        heading = rnd.uniform(0, 2 * math.pi)
+        lat, lng = lat + 0.0003 * math.cos(heading), lng + 0.0004 * math.sin(heading)
+        points.append((round(lat, 5), round(lng, 5)))
+    return routes_data_controller.build_route(Activity({
+        "id": activity_id, "name": "run", "type": "Run", "start_date_local": f"{YEAR}-03-01T08:00:00Z",
+        "moving_time": 3600, "elapsed_time": 3700, "distance": 10000, "total_elevation_gain": 100,
+        "map": {"id": "a", "summary_polyline": polyline.encode(points)},
+    }))
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    backend = SqliteBackend(str(tmp_path / "challenge.sqlite3"))
+    monkeypatch.setattr(storage_backend, "backend", backend)
+    # the versions of a new database start at 1 again, nothing may be left from another test
+    monkeypatch.setattr(route_index, "indexes", {})
+    map_cache.entries.clear()
+    backend.save_routes(YEAR, USER, [make_route(1), make_route(2)])
+    return backend
+
+
+def test_map_answers_304_for_its_etag(backend):
+    client = app.test_client()
+    response = client.get(MAP_URL)
+    assert response.status_code == 200
+    assert len(json.loads(response.data)[str(YEAR)]["athletes"]["1"]["routes"]) == 2
+    etag = response.headers["ETag"]
+
+    not_modified = map_cache.stats()["not_modified"]
+    response = client.get(MAP_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.data == b""
+    assert response.headers["ETag"] == etag
+    assert map_cache.stats()["not_modified"] == not_modified + 1
+
+    for if_none_match in (f"W/{etag}", f'"other", {etag}', "*"):
+        assert client.get(MAP_URL, headers={"If-None-Match": if_none_match}).status_code == 304
+    assert client.get(MAP_URL, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_map_etags_differ_per_encoding(backend):
+    client = app.test_client()
+    identity = client.get(MAP_URL)
+    compressed = client.get(MAP_URL, headers={"Accept-Encoding": "gzip, deflate"})
+    assert identity.headers.get("Content-Encoding") is None
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == identity.data
+    assert compressed.headers["ETag"] == identity.headers["ETag"][:-1] + '-gzip"'
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+
+    # the ETag of one encoding also matches the response in the other one, the content is the same
+    assert client.get(MAP_URL, headers={"If-None-Match": compressed.headers["ETag"]}).status_code == 304
+    response = client.get(MAP_URL, headers={"Accept-Encoding": "gzip", "If-None-Match": identity.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == compressed.headers["ETag"]
+
+
+def test_map_etag_changes_with_the_routes(backend):
+    client = app.test_client()
+    etag = client.get(MAP_URL).headers["ETag"]
+    backend.save_routes(YEAR, USER, [make_route(3)])
+    response = client.get(MAP_URL, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(json.loads(response.data)[str(YEAR)]["athletes"]["1"]["routes"]) == 3
@@ -0,0 +1,57 @@
+"""
+file: test_rate_governor.py
+
+description: Tests the rate governor: requests that are sent right away never count as waiting, a rejected
+request doesn't stay counted as waiting, and every retry of the HTTP client takes budget of its own.
+
+Author: Julian Friedl
+"""
+
+import asyncio
+
+import pytest
+
+import src.shared.api.http_client as http_client
+from src.shared.api.rate_governor import RateGovernor, Priority, RateLimitExceeded
+
+
+def test_request_sent_right_away_is_never_counted_as_waiting():
+    governor = RateGovernor(short_limit=100, daily_limit=1000, reserve=10)
+    seen = []
+    original = governor.try_take
+
+    def try_take(priority, deadline, waited):
+        seen.append(dict(governor.waiting))
+        return original(priority, deadline, waited)
+
+    governor.try_take = try_take
+    governor.acquire(Priority.INTERACTIVE)
+    asyncio.run(governor.acquire_async(Priority.INTERACTIVE))
+    assert all(waiting[Priority.INTERACTIVE] == 0 for waiting in seen)
+    assert governor.state()["short_usage"] == 2
+    assert governor.state()["throttled"] == 0
+
+
+def test_async_waiting_is_undone_when_rejected():
+    governor = RateGovernor(short_limit=1, daily_limit=1000, reserve=0)
+    governor.acquire(Priority.BACKGROUND)
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(governor.acquire_async(Priority.BACKGROUND, max_wait=0))
+    assert governor.state()["waiting_background"] == 0
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_every_retry_takes_budget(monkeypatch):
+    governor = RateGovernor(short_limit=100, daily_limit=1000, reserve=10)
+    statuses = iter([502, 503, 200])
+    monkeypatch.setattr(http_client.session, "request", lambda method, url, **kwargs: FakeResponse(next(statuses)))
+    monkeypatch.setattr(http_client, "backoff_delay", lambda attempt: 0)
+
+    response = http_client.get("https://www.strava.com/api/v3/athlete/activities", acquire=lambda: governor.acquire())
+    assert response.status_code == 200
+    assert governor.state()["short_usage"] == 3
+    assert governor.state()["daily_usage"] == 3
@@ -0,0 +1,84 @@
+"""
+file: test_route_index.py
+
+description: Tests the grid index of the routes against a brute-force scan: for 50k random bounding boxes the
+routes RouteIndex.query returns have to be exactly the ones that intersect the viewport, also for routes that
+are too large for the grid.
+
+Author: Julian Friedl
+"""
+
+import random
+
+import pytest
+
+import src.shared.services.route_index as route_index
+
+ROUTES = 50000
+ATHLETES = 50
+
+
+def random_bbox(rnd: random.Random, max_size: float):
+    """
+    Returns a random bounding box around the Alps. Some are single points and some lie exactly on the grid lines,
+    where rounding down to the cells is the easiest to get wrong.
+    """
+    if rnd.random() < 0.1:
+        west, south = rnd.randint(90, 130) / 10, rnd.randint(455, 485) / 10
+    else:
+        west, south = rnd.uniform(9, 13), rnd.uniform(45.5, 48.5)
+    if rnd.random() < 0.05:
+        return [west, south, west, south]
+    return [west, south, west + rnd.uniform(0, max_size), south + rnd.uniform(0, max_size * 0.7)]
+
+
+@pytest.fixture(scope="module")
+def year_data():
+    rnd = random.Random(23)
+    routes_per_athlete = ROUTES // ATHLETES
+    return {"athletes": {str(athlete_id): {"user_id": athlete_id, "routes": [
+        {"activity_id": athlete_id * 10**6 + position, "bbox": random_bbox(rnd, rnd.choice([0.01, 0.05, 0.3]))}
+        for position in range(routes_per_athlete)]} for athlete_id in range(ATHLETES)}}
+
+
+def brute_force(year_data: dict, bbox: list):
+    matches = {}
+    for athlete_key, athlete_data in year_data["athletes"].items():
+        for position, route in enumerate(athlete_data["routes"]):
+            if route_index.intersects(route["bbox"], bbox):
+                matches.setdefault(athlete_key, []).append(position)
+    return matches
+
+
+@pytest.mark.parametrize("cell_size", [0.1, 0.037])
+@pytest.mark.parametrize("viewport_size", [0, 0.02, 0.1, 0.5, 2.0, 10.0])
+def test_query_matches_brute_force(year_data, cell_size, viewport_size):
+    index = route_index.RouteIndex(year_data, cell_size=cell_size)
+    rnd = random.Random(int(viewport_size * 1000) + int(cell_size * 1000))
+    for _ in range(10):
+        bbox = random_bbox(rnd, viewport_size)
+        assert index.query(bbox) == brute_force(year_data, bbox), bbox
+
+
+def test_routes_without_bbox_are_left_out():
+    year_data = {"athletes": {"1": {"routes": [{"activity_id": 1, "bbox": None},
+                                               {"activity_id": 2, "bbox": [11.0, 47.0, 11.2, 47.1]}]}}}
+    index = route_index.RouteIndex(year_data)
+    assert index.query([10.0, 46.0, 12.0, 48.0]) == {"1": [1]}
+
+
+def test_oversized_routes_are_checked_by_every_query():
+    rnd = random.Random(5)
+    routes = [{"activity_id": position, "bbox": random_bbox(rnd, 0.05)} for position in range(2000)]
+    # a flight across half of the world would cover 1.5 million cells of 0.1 degrees
+    routes[7]["bbox"] = [0.0, 0.0, 179.0, 85.0]
+    routes[1500]["bbox"] = [-170.0, -80.0, 10.0, 46.0]
+    year_data = {"athletes": {"1": {"routes": routes}}}
+    index = route_index.RouteIndex(year_data, cell_size=0.1, max_cells=400)
+    assert index.oversized == [("1", 7), ("1", 1500)]
+    assert all(("1", 7) not in entries and ("1", 1500) not in entries for entries in index.cells.values())
+    for viewport_size in (0, 0.02, 0.5, 10.0):
+        for _ in range(20):
+            bbox = random_bbox(rnd, viewport_size)
+            assert index.query(bbox) == brute_force(year_data, bbox), bbox
+    assert index.query([-100.0, -50.0, -90.0, -40.0]) == {"1": [1500]}
@@ -0,0 +1,124 @@
+"""
+file: test_route_stats.py
+
+description: Tests the route statistics with known inputs: haversine distances, the round trip of the packed
+cell ids, the cells of segments that cross several grid cells (against a dense sampling of the segments) and the
+leaderboards of a small year.
+
+Author: Julian Friedl
+"""
+
+import math
+
+import numpy as np
+import polyline
+import pytest
+
+import src.shared.services.route_stats as route_stats
+
+CELLS_PER_ROW = route_stats.COVERAGE_COLUMNS
+
+
+def cell(row: int, column: int):
+    return row * CELLS_PER_ROW + column
+
+
+def test_haversine_of_known_distances():
+    # a degree of latitude and a quarter of the equator on the sphere
+    assert route_stats.haversine(0, 0, 1, 0) == pytest.approx(route_stats.EARTH_RADIUS * math.pi / 180)
+    assert route_stats.haversine(0, 0, 0, 90) == pytest.approx(route_stats.EARTH_RADIUS * math.pi / 2)
+    # London to Paris
+    assert route_stats.haversine(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343_560, abs=100)
+    assert route_stats.haversine(47.26, 11.39, 47.26, 11.39) == 0
+    distances = route_stats.haversine(0, 0, np.array([0.0, 1.0, -1.0]), np.array([1.0, 0.0, 0.0]))
+    assert distances == pytest.approx([route_stats.EARTH_RADIUS * math.pi / 180] * 3)
+
+
+@pytest.mark.parametrize("cells", [
+    [],
+    [0],
+    [cell(13726, 19139)],
+    [cell(9000, 18000), cell(9000, 18001), cell(9001, 17999), cell(13726, 19139), cell(17999, CELLS_PER_ROW - 1)],
+])
+def test_packed_cells_round_trip(cells):
+    cells = np.array(cells, dtype=np.int64)
+    packed = route_stats.pack_cells(cells)
+    assert isinstance(packed, str)
+    assert route_stats.unpack_cells(packed).tolist() == cells.tolist()
+
+
+def test_packed_cells_round_trip_of_a_large_route():
+    rng = np.random.default_rng(25)
+    cells = np.unique(rng.integers(0, 180 * 360 * 10**4, 5000))
+    assert np.array_equal(route_stats.unpack_cells(route_stats.pack_cells(cells)), cells)
+
+
+def test_coverage_of_a_point_and_a_horizontal_segment():
+    assert route_stats.coverage(np.array([[0.005, 0.005]])).tolist() == [cell(9000, 18000)]
+    # from the middle of a cell three grid lines to the east
+    points = np.array([[0.005, 0.005], [0.005, 0.035]])
+    assert route_stats.coverage(points).tolist() == [cell(9000, 18000 + column) for column in range(4)]
+
+
+def sampled_cells(points: np.ndarray, samples: int = 200_000):
+    t = np.linspace(0, 1, samples)
+    cells = [route_stats.cell_ids(start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1]))
+             for start, end in zip(points[:-1], points[1:])]
+    return np.unique(np.concatenate(cells)).tolist()
+
+
+@pytest.mark.parametrize("points", [
+    [[0.001, 0.001], [0.029, 0.019]],  # diagonal through five cells
+    [[47.2612, 11.3951], [47.2198, 11.4484], [47.2655, 11.4812]],  # a turn
+    [[-33.8712, 151.2011], [-33.8401, 151.2499]],  # south and east of the origin
+    [[0.0051, -0.0321], [0.0049, 0.0215]],  # across the prime meridian
+])
+def test_coverage_of_segments_that_cross_several_cells(points):
+    points = np.array(points)
+    covered = route_stats.coverage(points)
+    assert covered.tolist() == sampled_cells(points)
+    assert len(covered) > 2
+
+
+def route(activity_id: int, points: list):
+    return {"activity_id": activity_id, "stats": route_stats.build_stats(points)}
+
+
+def test_leaderboards_of_known_routes():
+    home = (48.2055, 16.3755)  # the middle of a coverage cell
+    north = [home, (home[0] + 0.1, home[1])]  # 11.1 km to the north
+    east = [home, (home[0], home[1] + 0.03)]
+    far_away = [(47.2655, 11.4005), (47.2655, 11.4105)]
+    year_data = {"athletes": {
+        "1": {"user_id": 1, "user_name": "A", "routes": [route(1, north), route(2, east), route(3, list(reversed(north)))]},
+        "2": {"user_id": 2, "user_name": "B", "routes": [
+            route(4, east),
+            # saved before the statistics existed, it is decoded from the polyline
+            {"activity_id": 5, "map": {"summary_polyline": polyline.encode(far_away)}},
+            route(6, far_away),
+        ]},
+        "3": {"user_id": 3, "user_name": "C", "routes": [route(7, [home])]},
+        "4": {"user_id": 4, "user_name": "D", "routes": [{"activity_id": 8, "map": {"summary_polyline": ""}}]},
+    }}
+    boards = route_stats.build_leaderboards(year_data, blacklist=frozenset({6}))
+
+    cells_north = route_stats.coverage(np.array(north))
+    cells_east = route_stats.coverage(np.array(east))
+    cells_far = route_stats.coverage(np.array(far_away))
+    assert (len(cells_north), len(cells_east), len(cells_far)) == (11, 4, 2)
+    assert boards["unique_cells"] == [
+        {"user_id": 1, "user_name": "A", "value": 14},
+        {"user_id": 2, "user_name": "B", "value": 6},
+        {"user_id": 3, "user_name": "C", "value": 1},
+    ]
+    area_a = route_stats.cell_area(np.union1d(cells_north, cells_east)).sum()
+    assert boards["explored_area"][0] == {"user_id": 1, "user_name": "A", "value": round(float(area_a), 2)}
+    assert 14 * 0.75 < boards["explored_area"][0]["value"] < 14 * 0.85  # a cell is about 0.8 km² at this latitude
+
+    furthest = {entry["user_id"]: entry["value"] for entry in boards["furthest_from_home"]}
+    # A starts twice at home and once in the north, home is the start cell with the most routes
+    assert furthest[1] == pytest.approx(route_stats.haversine(home[0], home[1], home[0] + 0.1, home[1]) / 1000, abs=0.01)
+    # B starts once at home and once far away, the first of the most common cells is home
+    assert furthest[2] > 300
+    assert furthest[3] == 0
+    assert [entry["user_id"] for entry in boards["furthest_from_home"]] == [2, 1, 3]
@@ -0,0 +1,98 @@
+"""
+file: test_save_changed_athletes.py
+
+description: Tests that flushing a changed athlete only saves the vars it changed: two commands that work on
+copies of the same athlete and score different weeks or use a joker don't overwrite each other's changes.
+
+Author: Julian Friedl
+"""
+
+import time
+
+import pytest
+
+import src.shared.services.athlete_data_controller as athlete_data_controller
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.scoring_engine as scoring_engine
+import src.shared.storage.backend as storage_backend
+from src.shared.models.athlete import Athlete, flush_athletes
+from src.shared.storage.json_backend import JsonBackend
+from src.shared.storage.sqlite_backend import SqliteBackend
+
+YEAR = athlete_data_controller.YEAR
+
+
+def make_credentials():
+    return {
+        "strava_data": {"access_token": "t", "refresh_token": "r", "expires_at": time.time() + 99999,
+                        "athlete": {"id": 1, "firstname": "A", "lastname": "B", "profile_medium": ""}},
+        "constants": {"rules": {"Run": 30}, "points_required": 3, "price_per_week": 5, "start_week": 1},
+        "vars": {"joker": 1, "joker_weeks": [], "week_results": ["1_1", "2_0"], "week_cache": {}},
+        "discord_user_id": "1",
+    }
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "json":
+        backend = JsonBackend(str(tmp_path))
+    else:
+        backend = SqliteBackend(str(tmp_path / "challenge.sqlite3"))
+    monkeypatch.setattr(storage_backend, "backend", backend)
+    monkeypatch.setattr(routes_data_controller, "write_routes", lambda routes, athlete: None)
+    backend.save_athletes(YEAR, [make_credentials()])
+    return backend
+
+
+def load_athlete():
+    return Athlete(athlete_data_controller.load_athlete_by_discord_id("1"), refresh=False)
+
+
+def test_weeks_scored_by_different_commands_are_kept(backend):
+    first, second = load_athlete(), load_athlete()
+    scoring_engine.score_weeks([], first, [3])
+    scoring_engine.score_weeks([], second, [4])
+    flush_athletes([first])
+    flush_athletes([second])
+
+    stored = athlete_data_controller.load_athlete_by_discord_id("1")["vars"]
+    assert stored["week_results"] == ["1_1", "2_0", "3_0", "4_0"]
+    assert sorted(stored["week_cache"]) == ["3", "4"]
+    assert not first.dirty and first.changed_vars == {}
+
+
+def test_scoring_doesnt_overwrite_a_joker(backend):
+    scoring, joker = load_athlete(), load_athlete()
+    joker.credentials["vars"]["joker_weeks"].append(5)
+    joker.credentials["vars"]["joker"] -= 1
+    joker.mark_dirty("joker_weeks")
+    joker.mark_dirty("joker")
+    flush_athletes([joker])
+    scoring_engine.score_weeks([], scoring, [3])
+    flush_athletes([scoring])
+
+    stored = athlete_data_controller.load_athlete_by_discord_id("1")["vars"]
+    assert stored["joker"] == 0 and stored["joker_weeks"] == [5]
+    assert stored["week_results"] == ["1_1", "2_0", "3_0"]
+
+
+def test_a_rescored_week_replaces_the_stored_one(backend):
+    athlete = load_athlete()
+    athlete.joker_weeks.append(2)
+    scoring_engine.score_weeks([], athlete, [2])
+    assert athlete.changed_vars == {"week_results": {2}, "week_cache": {2}}
+    flush_athletes([athlete])
+
+    stored = athlete_data_controller.load_athlete_by_discord_id("1")["vars"]
+    assert stored["week_results"] == ["1_1", "2_2"]
+
+
+def test_only_the_token_is_saved_without_changed_vars(backend):
+    stale = make_credentials()
+    stale["vars"]["week_results"] = []
+    stale["strava_data"]["expires_at"] += 100
+    athlete_data_controller.save_changed_athletes([stale])
+
+    stored = athlete_data_controller.load_athlete_by_discord_id("1")
+    assert stored["strava_data"]["expires_at"] == stale["strava_data"]["expires_at"]
+    assert stored["vars"]["week_results"] == ["1_1", "2_0"]
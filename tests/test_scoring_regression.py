@@ -0,0 +1,241 @@
+"""
+file: test_scoring_regression.py
+
+description: Regression test of the scoring over a fixed set of activities: the points of score_weeks, the price
+multipliers of the StreakTable and the amounts of the total command have to be the same as the ones of the
+scoring before the week cache and the streak table existed (get_points, get_price_multiplier and the loop of
+get_yearly_payments, copied below). The cases include a start week after the first week with activities, joker
+weeks, streaks of missed weeks and weeks that are taken from the fingerprint cache.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import time
+
+import pytest
+
+import src.bot.commands.total_command as total_command
+import src.bot.commands.week_command as week_command
+import src.shared.services.routes_data_controller as routes_data_controller
+import src.shared.services.scoring_engine as scoring_engine
+from src.bot.commands.total_command import TotalCommand
+from src.bot.commands.week_command import WeekCommand
+from src.shared.models.activity import Activity
+from src.shared.models.athlete import Athlete
+
+YEAR = 2026
+START_WEEK = 2
+LAST_WEEK = 12
+MULTIPLIER = 2
+JOKER_WEEKS = [5]
+
+
+def activity(activity_id: int, week: int, weekday: int, activity_type: str, minutes: int, hour: int = 8, elapsed_hours: float = None):
+    start = datetime.datetime.combine(datetime.date.fromisocalendar(YEAR, week, weekday), datetime.time(hour))
+    return {"id": activity_id, "name": f"a{activity_id}", "type": activity_type,
+            "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"), "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "moving_time": minutes * 60, "elapsed_time": int((elapsed_hours or minutes / 60 + 0.1) * 3600)}
+
+
+# the oldest one first, like the activity store streams them
+ACTIVITIES = [
+    # week 1 is before the start week, it would be missed
+    activity(1, 1, 2, "Walk", 20),
+    # week 2: three runs on different days, passed
+    activity(2, 2, 1, "Run", 30), activity(3, 2, 2, "Run", 29), activity(4, 2, 3, "Run", 45),
+    # week 3: nothing, missed
+    # week 4: walks count once, missed
+    activity(5, 4, 1, "Walk", 60), activity(6, 4, 2, "Walk", 60), activity(7, 4, 3, "Ride", 20),
+    # week 5: joker week with too few points
+    activity(8, 5, 4, "Run", 30),
+    # week 6: two HIT workouts make a point, two rides on one day count once, passed
+    activity(9, 6, 1, "Workout", 20), activity(10, 6, 1, "WeightTraining", 25, hour=18),
+    activity(11, 6, 3, "Ride", 60), activity(12, 6, 3, "Ride", 90, hour=17), activity(13, 6, 5, "Run", 30),
+    # week 7: missed, the streak continues after the joker week
+    activity(14, 7, 6, "Ride", 20),
+    # week 8: a multi-day hike from Saturday to Monday morning, its three days count as points, passed
+    activity(15, 8, 6, "Hike", 600, hour=20, elapsed_hours=36),
+    # weeks 9 and 10: missed
+    activity(16, 9, 2, "Run", 10),
+    # week 11: passed, resets the streak
+    activity(17, 11, 1, "Run", 30), activity(18, 11, 2, "Swim", 30), activity(19, 11, 4, "Run", 40),
+    # week 12: missed
+    activity(20, 12, 7, "Run", 30, hour=23),
+]
+
+
+def make_credentials():
+    return {
+        "strava_data": {"access_token": "t", "refresh_token": "r", "expires_at": time.time() + 99999,
+                        "athlete": {"id": 1, "firstname": "A", "lastname": "B", "profile_medium": ""}},
+        "constants": {"rules": {"Ride": 60, "Run": 30, "Walk": 60, "Hike": 60, "Swim": 30, "Workout": 60,
+                                "WeightTraining": 60},
+                      "points_required": 3, "price_per_week": 5, "spazi": 3, "walking_limit": 1, "hit_required": 2,
+                      "hit_min_time": 15, "min_duration_multi_day": 360, "start_week": START_WEEK},
+        "vars": {"joker": 0, "joker_weeks": list(JOKER_WEEKS), "week_results": []},
+        "discord_user_id": "1",
+    }
+
+
+def baseline_points(activities: list, athlete: Athlete, week: int):
+    """
+    The points of WeekCommand.get_points before the scoring engine, the activities are the newest one first.
+    """
+    points = 0
+    hit_counter = 0
+    activities_done_set = set()
+    for activity_data in reversed(activities):
+        activity = Activity(activity_data)
+        if activity.is_in_week(week):
+            hit_counter = activity.count_hit_workouts(hit_counter, activities_done_set, athlete)
+            if hit_counter == athlete.hit_required:
+                points += 1
+                activities_done_set.add((activity.type, activity.date))
+                hit_counter = 0
+            else:
+                points += activity.calculate_points(activities_done_set, athlete)
+    return points
+
+
+def baseline_week_results(points_by_week: dict, athlete: Athlete):
+    """
+    The week_results get_points inserted for the weeks in order.
+    """
+    week_results = []
+    for week, points in sorted(points_by_week.items()):
+        if week in athlete.joker_weeks:
+            week_results.insert(week - 1, f"{week}_2")
+        elif points < athlete.points_required:
+            week_results.insert(week - 1, f"{week}_0")
+        else:
+            week_results.insert(week - 1, f"{week}_1")
+    return week_results
+
+
+def baseline_multiplier(week_results: list, week: int):
+    """
+    WeekCommand.get_price_multiplier before the streak table.
+    """
+    missed_weeks_count = 0
+    for week_result in reversed(week_results):
+        result_week = int(week_result.split("_")[0])
+        result = int(week_result.split("_")[1])
+        if result_week >= week:
+            continue
+        if result == 1:
+            break
+        elif result == 0:
+            missed_weeks_count += 1
+        elif result == 2:
+            continue
+    return MULTIPLIER ** missed_weeks_count
+
+
+def baseline_total(week_results: list, price_per_week: int):
+    """
+    The amount of an athlete in TotalCommand.get_yearly_payments before the streak table.
+    """
+    week_results_dict = {int(w.split('_')[0]): int(w.split('_')[1]) for w in week_results}
+    amount_to_pay = 0
+    price_multiplier = 0
+    for week in range(START_WEEK, LAST_WEEK + 1):
+        result = week_results_dict.get(week, None)
+        if result == 2:
+            continue
+        elif result == 1:
+            price_multiplier = 0
+            continue
+        elif result == 0:
+            amount_to_pay += price_per_week * (MULTIPLIER ** price_multiplier)
+            price_multiplier += 1
+    return amount_to_pay
+
+
+@pytest.fixture
+def scored_weeks(monkeypatch):
+    """
+    Runs the object scoring without writing routes, returns the weeks that weren't taken from the week cache.
+    """
+    monkeypatch.setattr(scoring_engine, "SCORING_BACKEND", "object")
+    monkeypatch.setattr(routes_data_controller, "write_routes", lambda routes, athlete: None)
+    for module in (week_command, total_command):
+        monkeypatch.setattr(module, "MULTIPLIER", MULTIPLIER)
+        monkeypatch.setattr(module, "MULTIPLIER_ON", True)
+        monkeypatch.setattr(module, "CHALLENGE_START_WEEK", START_WEEK)
+    scored = []
+    score_week = scoring_engine.score_week
+
+    def counting_score_week(activities, athlete):
+        scored.append(activities[0].date.isocalendar()[1] if activities else None)
+        return score_week(activities, athlete)
+
+    monkeypatch.setattr(scoring_engine, "score_week", counting_score_week)
+    return scored
+
+
+def check_against_baseline(athlete: Athlete, activities: list):
+    weeks = list(range(START_WEEK, LAST_WEEK + 1))
+    points = scoring_engine.score_weeks(activities, athlete, weeks)
+    newest_first = list(reversed(activities))
+    expected_points = {week: baseline_points(newest_first, athlete, week) for week in weeks}
+    assert points == expected_points
+
+    expected_results = baseline_week_results(expected_points, athlete)
+    assert athlete.week_results == expected_results
+    for week in weeks:
+        assert WeekCommand(week).get_price_multiplier(athlete) == baseline_multiplier(expected_results, week), week
+
+    command = TotalCommand()
+    command.last_week = LAST_WEEK
+    assert command.calculate_amount(athlete, [], {}) == (athlete.username, baseline_total(expected_results, athlete.price_per_week))
+    return points
+
+
+def test_scoring_matches_the_baseline(scored_weeks):
+    athlete = Athlete(make_credentials(), refresh=False)
+    points = check_against_baseline(athlete, ACTIVITIES)
+    assert [week for week in range(START_WEEK, LAST_WEEK + 1) if points[week] >= 3] == [2, 6, 8, 11]
+    assert athlete.week_results == ["2_1", "3_0", "4_0", "5_2", "6_1", "7_0", "8_1", "9_0", "10_0", "11_1", "12_0"]
+    # weeks 9 and 10 are the second and third missed week after week 8
+    assert WeekCommand(11).get_price_multiplier(athlete) == 4
+    # the weeks without activities aren't scored with score_week
+    assert sorted(week for week in scored_weeks if week is not None) == [2, 4, 5, 6, 7, 8, 9, 11, 12]
+
+
+def test_cached_weeks_match_the_baseline(scored_weeks):
+    athlete = Athlete(make_credentials(), refresh=False)
+    scoring_engine.score_weeks(ACTIVITIES, athlete, list(range(START_WEEK, LAST_WEEK + 1)))
+    scored_weeks.clear()
+
+    # a new command loads the athlete with the cached weeks, only the week with a changed activity is scored again
+    credentials = athlete.credentials
+    changed = [dict(activity, moving_time=3600) if activity["id"] == 16 else activity for activity in ACTIVITIES]
+    changed.append(activity(21, 9, 4, "Run", 30))
+    changed.append(activity(22, 9, 5, "Run", 30))
+    changed.sort(key=lambda activity: activity["start_date_local"])
+    athlete = Athlete(credentials, refresh=False)
+    check_against_baseline(athlete, changed)
+    assert scored_weeks == [9]
+    assert athlete.week_results[7] == "9_1"
+
+    # a joker changes the result of a cached week without scoring it again
+    scored_weeks.clear()
+    credentials["vars"]["joker_weeks"].append(7)
+    athlete = Athlete(credentials, refresh=False)
+    check_against_baseline(athlete, changed)
+    assert scored_weeks == []
+    assert athlete.week_results[5] == "7_2"
+
+
+def test_changed_rules_score_the_affected_weeks_again(scored_weeks):
+    athlete = Athlete(make_credentials(), refresh=False)
+    scoring_engine.score_weeks(ACTIVITIES, athlete, list(range(START_WEEK, LAST_WEEK + 1)))
+    scored_weeks.clear()
+
+    credentials = athlete.credentials
+    credentials["constants"]["rules"]["Walk"] = 20
+    athlete = Athlete(credentials, refresh=False)
+    check_against_baseline(athlete, ACTIVITIES)
+    # only week 4 has walks in the scored weeks, week 1 is before the start week
+    assert scored_weeks == [4]
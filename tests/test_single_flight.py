@@ -0,0 +1,167 @@
+"""
+file: test_single_flight.py
+
+description: Tests the coalescing of identical work that runs at the same time: callers with the same key share
+one call and its result or exception, a later call does the work again, and identical Strava requests are sent
+only once (with a fake send_request).
+
+Author: Julian Friedl
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import src.shared.api.api_calls as api_calls
+from src.shared.api.api_calls import API_CALL_TYPE
+from src.shared.services.single_flight import SingleFlight, AsyncSingleFlight
+
+
+def run_threads(count: int, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+
+
+def test_threads_with_the_same_key_share_one_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    threads = run_threads(4, lambda: results.append(flights.do("key", work, 21)))
+    wait_for(lambda: flights.shared == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [21]
+    assert sorted(results) == [(42, False), (42, True), (42, True), (42, True)]
+    assert flights.stats() == {"running": 0, "shared": 3}
+
+    # nothing is kept once the call is done
+    assert flights.do("key", work, 1) == (2, False)
+    assert calls == [21, 1]
+
+
+def test_threads_share_the_exception_of_the_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def work():
+        release.wait(5)
+        raise ValueError("failed")
+
+    def call():
+        try:
+            flights.do("key", work)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = run_threads(3, call)
+    wait_for(lambda: flights.shared == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3 and len({id(error) for error in errors}) == 1
+    assert flights.stats()["running"] == 0
+
+
+def test_different_keys_dont_wait_for_each_other():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+    assert flights.shared == 0
+
+
+def test_coroutines_with_the_same_key_share_one_call():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.02)
+        return value * 2
+
+    async def run():
+        results = await asyncio.gather(*[flights.do("key", work, 21) for _ in range(4)])
+        again = await flights.do("key", work, 1)
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert calls == [21, 1]
+    assert results == [(42, False), (42, True), (42, True), (42, True)]
+    assert again == (2, False)
+    assert flights.stats() == {"running": 0, "shared": 3}
+
+
+def test_coroutines_share_the_exception_of_the_call():
+    flights = AsyncSingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        raise ValueError("failed")
+
+    async def run():
+        return await asyncio.gather(*[flights.do("key", work) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flights.shared == 2 and flights.flights == {}
+
+
+def test_a_cancelled_caller_doesnt_cancel_the_call():
+    flights = AsyncSingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("key", work))
+        second = asyncio.ensure_future(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == ("done", True)
+
+
+def test_identical_requests_are_sent_once(monkeypatch):
+    release = threading.Event()
+    sent = []
+
+    def send_request(url, headers, params, username, user_id, cache_key, ttl, priority, max_wait):
+        sent.append(params)
+        release.wait(5)
+        return [{"id": 1}]
+
+    monkeypatch.setattr(api_calls, "send_request", send_request)
+    shared_before = api_calls.request_flights.shared
+    results = []
+    threads = run_threads(3, lambda: results.append(
+        api_calls.api_request("https://example.org/activities", {}, {"page": 1}, "A B", "1", cache=False)))
+    wait_for(lambda: api_calls.request_flights.shared == shared_before + 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(sent) == 1
+    # the joined requests didn't reach Strava, they count as answered from the cache
+    assert sorted(call_type.value for _, call_type in results) == [API_CALL_TYPE.Cache.value, API_CALL_TYPE.Cache.value, API_CALL_TYPE.API.value]
+    assert all(data == [{"id": 1}] for data, _ in results)
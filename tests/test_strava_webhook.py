@@ -0,0 +1,68 @@
+"""
+file: test_strava_webhook.py
+
+description: Tests that the Strava webhook only queues the events of the configured push subscription and of
+registered athletes.
+
+Author: Julian Friedl
+"""
+
+import time
+
+import pytest
+
+import src.shared.storage.backend as storage_backend
+import src.web.backend.controllers.strava_webhook as strava_webhook
+from src.shared.services.athlete_data_controller import YEAR
+from src.shared.storage.json_backend import JsonBackend
+from src.web.backend.flask_app import app
+
+SUBSCRIPTION_ID = 4711
+ATHLETE_ID = 42
+
+
+def make_event(**fields):
+    event = {"aspect_type": "create", "event_time": int(time.time()), "object_id": 1, "object_type": "activity",
+             "owner_id": ATHLETE_ID, "subscription_id": SUBSCRIPTION_ID, "updates": {}}
+    event.update(fields)
+    return event
+
+
+@pytest.fixture
+def queued(tmp_path, monkeypatch):
+    backend = JsonBackend(str(tmp_path))
+    backend.save_athletes(YEAR, [{
+        "strava_data": {"access_token": "t", "refresh_token": "r", "expires_at": 0,
+                        "athlete": {"id": ATHLETE_ID, "firstname": "A", "lastname": "B"}},
+        "constants": {}, "vars": {"joker": 1, "joker_weeks": [], "week_results": []}, "discord_user_id": "1",
+    }])
+    monkeypatch.setattr(storage_backend, "backend", backend)
+    monkeypatch.setattr(strava_webhook, "STRAVA_SUBSCRIPTION_ID", str(SUBSCRIPTION_ID))
+    events = []
+    monkeypatch.setattr(strava_webhook.webhook_worker, "enqueue", lambda event: events.append(event) or True)
+    return events
+
+
+def test_event_of_a_registered_athlete_is_queued(queued):
+    response = app.test_client().post("/strava_webhook", json=make_event())
+    assert response.status_code == 200
+    assert [event["object_id"] for event in queued] == [1]
+
+
+@pytest.mark.parametrize("event", [
+    make_event(subscription_id=1),
+    make_event(subscription_id=None),
+    make_event(owner_id=43),
+    make_event(owner_id=str(ATHLETE_ID)),
+], ids=["other subscription", "no subscription", "unregistered athlete", "owner id as string"])
+def test_other_events_are_rejected(queued, event):
+    response = app.test_client().post("/strava_webhook", json=event)
+    assert response.status_code == 403
+    assert queued == []
+
+
+def test_events_are_rejected_without_a_configured_subscription(queued, monkeypatch):
+    monkeypatch.setattr(strava_webhook, "STRAVA_SUBSCRIPTION_ID", None)
+    response = app.test_client().post("/strava_webhook", json=make_event())
+    assert response.status_code == 403
+    assert queued == []
@@ -0,0 +1,61 @@
+"""
+file: test_vector_scoring.py
+
+description: Differential test of the NumPy scoring backend: for random athletes and activities the points of
+vector_scoring.score_weeks have to be the same as the points of the object-based scoring_engine.score_week for
+every week.
+
+Author: Julian Friedl
+"""
+
+import datetime
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import src.shared.services.scoring_engine as scoring_engine
+import src.shared.services.vector_scoring as vector_scoring
+from src.shared.models.activity import Activity
+
+TYPES = ["Workout", "WeightTraining", "Walk", "Run", "Ride", "Hike", "Yoga", "AlpineSki", None]
+
+
+def random_case(rnd: random.Random):
+    """
+    Returns an athlete with random rules and up to 40 random activities over three weeks, the oldest one first.
+    The moving times are close to the limits of the rules and some activities are multi-day or start at midnight.
+    """
+    athlete = SimpleNamespace(
+        username="test",
+        rules={activity_type: rnd.choice([10, 30, 45, 60, 120]) for activity_type in rnd.sample(TYPES[:-1], rnd.randint(2, 8))},
+        spazi=rnd.choice([0, 3, 5]), walking_limit=rnd.choice([0, 1, 2, 3]), hit_required=rnd.choice([1, 2, 3]),
+        hit_min_time=rnd.choice([0, 15, 20]), min_duration_multi_day=rnd.choice([0, 60, 360]))
+    activities = []
+    first_day = datetime.datetime(2026, 1, 1) + datetime.timedelta(days=rnd.randint(0, 300))
+    for activity_id in range(rnd.randint(0, 40)):
+        start = first_day + datetime.timedelta(minutes=rnd.randint(0, 21 * 24 * 60))
+        if rnd.random() < 0.1:
+            start = start.replace(hour=0, minute=0)
+        activities.append({
+            "id": activity_id, "type": rnd.choice(TYPES), "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "moving_time": rnd.choice([0, 600, 900, 959, 960, 1200, 1700, 3420, 3421, 3600, 5400, 7200]) + rnd.choice([0, 1, 59]),
+            "elapsed_time": rnd.choice([600, 3600, 20000, 90000, 200000]),
+        })
+    activities.sort(key=lambda activity: activity["start_date_local"])
+    return athlete, activities
+
+
+def score_with_engine(activities: list, athlete):
+    points = {}
+    for week, week_activities in scoring_engine.iter_weeks(activities):
+        points[week] = points.get(week, 0) + scoring_engine.score_week(Activity.from_page(list(week_activities)), athlete)
+    return points
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_score_weeks_matches_scoring_engine(seed):
+    rnd = random.Random(seed)
+    for _ in range(500):
+        athlete, activities = random_case(rnd)
+        assert vector_scoring.score_weeks(activities, athlete) == score_with_engine(activities, athlete), (athlete, activities)